@@ -0,0 +1,93 @@
+"""
+Micro-benchmark for decoding Helix responses in `TwitchInterface._send_request`.
+
+Compares the previous approach (build a `TypeAdapter` per call, `response.json()` then `validate_python` on `["data"]`)
+against the registered response models (built once, decoded straight from the response bytes).
+
+Run from the repo root:
+    python -m benchmarks.bench_send_request
+"""
+
+from pydantic import TypeAdapter
+
+import json
+import timeit
+from typing import List
+
+from src.twitch.interface import get_response_model
+from src.twitch.models import TwitchEventSubscription
+
+
+def mock_subscription(i: int) -> dict:
+    return {
+        "id": f"mock-id-{i}",
+        "type": "channel.chat.message",
+        "version": "1",
+        "status": "enabled",
+        "cost": 0,
+        "condition": {"broadcaster_user_id": "1234", "user_id": "5678"},
+        "created_at": "2024-01-02T15:04:05.123456789Z",
+        "transport": {
+            "method": "webhook",
+            "callback": "https://example.com/bryti",
+        },
+    }
+
+
+"""
+Response bodies (as raw bytes) for each benchmarked endpoint.
+"""
+MOCK_RESPONSES = {
+    # A page of current subscriptions.
+    "get_event_subscriptions": json.dumps(
+        {
+            "data": [mock_subscription(i) for i in range(20)],
+            "total": 20,
+            "total_cost": 0,
+            "max_total_cost": 10000,
+            "pagination": {},
+        }
+    ).encode("UTF-8"),
+    # The single newly-created subscription.
+    "create_event_subscription": json.dumps(
+        {
+            "data": [mock_subscription(0)],
+            "total": 1,
+            "total_cost": 0,
+            "max_total_cost": 10000,
+        }
+    ).encode("UTF-8"),
+}
+
+
+def decode_per_call(content: bytes, DataType):
+    return TypeAdapter(DataType).validate_python(json.loads(content)["data"])
+
+
+def decode_registered(content: bytes, DataType):
+    return get_response_model(DataType).model_validate_json(content).data
+
+
+def main(number: int = 2000):
+    DataType = List[TwitchEventSubscription]
+    for name, content in MOCK_RESPONSES.items():
+        assert decode_per_call(content, DataType) == decode_registered(
+            content, DataType
+        )
+
+        before_s = timeit.timeit(
+            lambda: decode_per_call(content, DataType), number=number
+        )
+        after_s = timeit.timeit(
+            lambda: decode_registered(content, DataType), number=number
+        )
+        before_us = before_s / number * 1e6
+        after_us = after_s / number * 1e6
+        print(
+            f"{name}: {before_us:.1f}us -> {after_us:.1f}us per call "
+            f"({before_us - after_us:.1f}us saved, {before_us / after_us:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
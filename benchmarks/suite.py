@@ -0,0 +1,301 @@
+"""
+Micro-benchmark suite for the hot paths of handling an event, for catching regressions per commit.
+
+Each benchmark is timed in-process (no network), and results are written as JSON:
+    {"format": 1, "python": "...", "benchmarks": {"<name>": {"ns_per_op": ..., "median_ns_per_op": ..., "number": ...}}}
+
+Run from the repo root, i.e.:
+    python -m benchmarks.suite                                   # run everything, compare against the stored baseline
+    python -m benchmarks.suite --filter state_table              # only benchmarks whose name contains "state_table"
+    python -m benchmarks.suite --output results.json             # also write the results to a file
+    python -m benchmarks.suite --save-baseline                   # overwrite the stored baseline with these results
+
+Exits non-zero if any benchmark is slower than its baseline by more than the threshold.
+Baselines are machine-dependent: re-save them (in the same commit) when the reference machine changes.
+"""
+
+import argparse
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import timeit
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+)
+
+from src.common.commands import resolve_command
+from src.common.state_models import (
+    CounterState,
+    Permission,
+    State,
+)
+from src.common.state_table_interface import (
+    DynamoDBStateTableInterface,
+    ddb_to_dict,
+    dict_to_ddb,
+)
+from src.common.telemetry import telemetry
+from src.twitch.models import (
+    NOTIFICATION_MODELS,
+    TwitchHeaders,
+)
+from src.twitch.service import TwitchService
+from tools.load_generator import synthetic_chat_event
+
+
+FORMAT_VERSION = 1
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "baseline.json")
+DEFAULT_THRESHOLD = 0.25
+REPEAT = 5
+
+# Name -> function building the callable to time (so that setup isn't timed).
+BENCHMARKS: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str) -> Callable:
+    def register(setup: Callable[[], Callable[[], Any]]) -> Callable:
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+# --- Fixtures ---
+
+
+MOCK_NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+CHAT_HEADERS, CHAT_BODY = synthetic_chat_event(
+    random.Random(0), broadcasters=1, command_ratio=1
+)
+
+MOCK_STATE = State(
+    user="mock-user",
+    twitch_user_id="mock-twitch-user-id",
+    discord_user_id="mock-discord-user-id",
+    deaths=CounterState(
+        count=123, last_timestamp=MOCK_NOW - timedelta(hours=1, minutes=2, seconds=3)
+    ),
+    crimes=CounterState(count=45, last_timestamp=MOCK_NOW - timedelta(days=2)),
+    version=67,
+)
+MOCK_STATE_DICT = MOCK_STATE.model_dump(mode="json", exclude_none=True)
+MOCK_STATE_ITEM = dict_to_ddb(MOCK_STATE_DICT)
+
+
+class StubDynamoDBClient:
+    """
+    Answers `update_item` with a fixed item, so that only the interface's own work is timed.
+    """
+
+    def update_item(self, **kwargs) -> Dict[str, Any]:
+        return {"Attributes": MOCK_STATE_ITEM}
+
+
+# --- Benchmarks ---
+
+
+@benchmark("twitch.verify_signature")
+def bench_verify_signature():
+    headers = TwitchHeaders.model_validate(CHAT_HEADERS)
+    return lambda: TwitchService.verify_signature(None, headers, CHAT_BODY)
+
+
+@benchmark("twitch.headers_model_validate")
+def bench_headers_model_validate():
+    return lambda: TwitchHeaders.model_validate(CHAT_HEADERS)
+
+
+@benchmark("twitch.chat_notification_model_validate_json")
+def bench_chat_notification_model_validate_json():
+    NotificationModel = NOTIFICATION_MODELS["channel.chat.message"]
+    return lambda: NotificationModel.model_validate_json(CHAT_BODY)
+
+
+@benchmark("commands.resolve_command")
+def bench_resolve_command():
+    args = ["deaths", "set", "5"]
+    return lambda: resolve_command(args)
+
+
+@benchmark("state_table.ddb_to_dict")
+def bench_ddb_to_dict():
+    return lambda: ddb_to_dict(MOCK_STATE_ITEM)
+
+
+@benchmark("state_table.dict_to_ddb")
+def bench_dict_to_ddb():
+    return lambda: dict_to_ddb(MOCK_STATE_DICT)
+
+
+@benchmark("state_table.update_state")
+def bench_update_state():
+    state_table = DynamoDBStateTableInterface(StubDynamoDBClient(), "mock-table-name")
+
+    def update_state():
+        state_table.update_state(MOCK_STATE)
+        # Don't let the recorded spans pile up across iterations.
+        telemetry.spans.clear()
+
+    return update_state
+
+
+@benchmark("state_models.counter_time_since")
+def bench_counter_time_since():
+    return lambda: MOCK_STATE.deaths.time_since(MOCK_NOW)
+
+
+@benchmark("state_models.permission_compare")
+def bench_permission_compare():
+    return lambda: Permission.MODERATOR < Permission.BROADCASTER
+
+
+# --- Runner ---
+
+
+def run_benchmark(
+    setup: Callable[[], Callable[[], Any]], repeat: int = REPEAT
+) -> Dict[str, Any]:
+    """
+    Time a benchmark: calibrate the number of calls per round to take at least ~0.2s, then take the best of a few rounds.
+    """
+
+    fn = setup()
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    rounds_s = timer.repeat(repeat=repeat, number=number)
+    rounds_ns_per_op = [round_s / number * 1e9 for round_s in rounds_s]
+    return {
+        "ns_per_op": round(min(rounds_ns_per_op), 1),
+        "median_ns_per_op": round(statistics.median(rounds_ns_per_op), 1),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def run_suite(
+    name_filter: Optional[str] = None, repeat: int = REPEAT
+) -> Dict[str, Any]:
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if name_filter is None or name_filter in name:
+            results[name] = run_benchmark(setup, repeat)
+
+    return {
+        "format": FORMAT_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "benchmarks": results,
+    }
+
+
+def compare(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    threshold: float = DEFAULT_THRESHOLD,
+) -> List[Dict[str, Any]]:
+    """
+    Compare results against a baseline.
+
+    :return: One row per benchmark in both, with its relative change and whether it regressed past the threshold.
+    """
+
+    rows = []
+    for name, result in results["benchmarks"].items():
+        baseline_result = baseline["benchmarks"].get(name)
+        if baseline_result is None:
+            continue
+
+        change = result["ns_per_op"] / baseline_result["ns_per_op"] - 1
+        rows.append(
+            {
+                "name": name,
+                "baseline_ns_per_op": baseline_result["ns_per_op"],
+                "ns_per_op": result["ns_per_op"],
+                "change": round(change, 3),
+                "regressed": change > threshold,
+            }
+        )
+
+    return rows
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--filter", help="Only run benchmarks whose name contains this."
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=REPEAT,
+        help="Rounds per benchmark (the best is kept).",
+    )
+    parser.add_argument("--output", help="Write the results (JSON) to this file.")
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE_PATH,
+        help="Baseline results (JSON) to compare against.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Relative slowdown counted as a regression.",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Overwrite the baseline with these results.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    results = run_suite(args.filter, args.repeat)
+    output = json.dumps(results, indent=4, sort_keys=True) + "\n"
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(output)
+
+        print(output, end="")
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print(output, end="")
+        return 0
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+
+    rows = compare(results, baseline, args.threshold)
+    for row in rows:
+        flag = "  REGRESSED" if row["regressed"] else ""
+        print(
+            f"{row['name']:<48} {row['baseline_ns_per_op']:>12.1f}ns -> {row['ns_per_op']:>12.1f}ns "
+            f"({row['change']:+.1%}){flag}"
+        )
+
+    return 1 if any(row["regressed"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,170 @@
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.metrics import (
+    Metrics,
+    MetricUnit,
+)
+
+from datetime import datetime
+from typing import (
+    Any,
+    List,
+    Optional,
+)
+
+from src.common.state_models import (
+    CounterState,
+    EventContext,
+    State,
+)
+from src.common.state_table_interface import StateTableInterface
+from src.twitch.interface import TwitchInterface
+
+
+logger = Logger(service="bryti")
+metrics = Metrics(namespace="bryti", service="bryti")
+
+
+class BufferedStateTable:
+    """
+    Wraps the state table for handling a batch of events for a single broadcaster:
+    their state is read once, changes to it are applied in-memory, and written once (by `flush`).
+    Everything else (i.e. lookups) is passed through to the wrapped state table.
+    """
+
+    def __init__(self, state_table_interface: StateTableInterface):
+        self.state_table = state_table_interface
+        self.broadcaster = None
+        self.state = None
+        self.is_fetched = False
+        self.is_dirty = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.state_table, name)
+
+    def fetch_twitch_context(
+        self,
+        broadcaster_twitch_user_id: str,
+        chatter_twitch_user_id: Optional[str],
+        attributes: Optional[List[str]] = None,
+        consistent_read: bool = False,
+        read_state: bool = True,
+    ) -> EventContext:
+        """
+        Fetches the broadcaster's state the first time, then re-uses the (buffered) state for the rest of the batch.
+        Since later events in the batch may write it, the whole state is always read (consistently), whatever the projection (or `read_state`).
+        """
+
+        if not self.is_fetched:
+            context = self.state_table.fetch_twitch_context(
+                broadcaster_twitch_user_id,
+                chatter_twitch_user_id,
+                consistent_read=True,
+            )
+            self.broadcaster = context.broadcaster
+            self.state = context.state
+            self.is_fetched = True
+            return context
+
+        chatter = None
+        permission = None
+        if chatter_twitch_user_id == broadcaster_twitch_user_id:
+            chatter = self.broadcaster
+        elif chatter_twitch_user_id is not None:
+            chatter = self.state_table.lookup_by_twitch(chatter_twitch_user_id)
+            if self.broadcaster is not None and chatter is not None:
+                permission = self.state_table.get_permission(
+                    self.broadcaster.user,
+                    chatter.user,
+                )
+
+        return EventContext(
+            broadcaster=self.broadcaster,
+            state=self.state,
+            chatter=chatter,
+            permission=permission,
+        )
+
+    def update_state(self, state: State) -> State:
+        """
+        Buffers the given state, to be written by `flush`.
+        """
+
+        self.state = state
+        self.is_dirty = True
+        return state
+
+    def increment_counter(
+        self,
+        state: State,
+        counter_name: str,
+        timestamp: datetime,
+        dedup_window_s: int,
+    ) -> Optional[State]:
+        """
+        Increments one of the buffered state's counters in-memory, enforcing the dedup window like the state table does.
+        """
+
+        counter = getattr(state, counter_name)
+        count = 0
+        if counter is not None:
+            time_since = timestamp - counter.last_timestamp
+            if time_since.total_seconds() <= dedup_window_s:
+                return None
+
+            count = counter.count
+
+        updated_state = state.model_copy(deep=True)
+        setattr(
+            updated_state,
+            counter_name,
+            CounterState(count=count + 1, last_timestamp=timestamp),
+        )
+        return self.update_state(updated_state)
+
+    def flush(self):
+        """
+        Writes the buffered state (if it changed) with a single update.
+
+        :raises VersionConflictError: If the state changed in the table since it was read.
+        """
+
+        if self.is_dirty:
+            self.state = self.state_table.update_state(self.state)
+            self.is_dirty = False
+
+
+class BufferedTwitchInterface:
+    """
+    Wraps the Twitch interface for handling a batch of events: chat messages are held back until `flush`,
+    so that nothing is sent for a batch whose state failed to be written (and will be retried).
+    Everything else is passed through to the wrapped interface.
+    """
+
+    def __init__(self, twitch_interface: TwitchInterface):
+        self.twitch = twitch_interface
+        self.chat_messages = []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.twitch, name)
+
+    def send_chat_message(self, *args, **kwargs):
+        self.chat_messages.append((args, kwargs))
+
+    def flush(self):
+        """
+        Sends the held back chat messages, in order.
+        By now the batch's state has been written, so failing (and re-running) the batch would apply its commands twice:
+        a message that fails to be sent is logged and skipped instead.
+        """
+
+        while self.chat_messages:
+            args, kwargs = self.chat_messages.pop(0)
+            try:
+                self.twitch.send_chat_message(*args, **kwargs)
+            except Exception:
+                logger.exception("Failed to send chat message", broadcaster_id=args[0])
+                metrics.add_metric(
+                    name="ChatMessageSendFailures",
+                    unit=MetricUnit.Count,
+                    value=1,
+                )
@@ -11,8 +11,17 @@ from datetime import (
     datetime,
     timezone,
 )
-from inspect import isclass
-from typing import List
+from enum import Enum
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
 
 from src.common.api_interfaces import APIInterfaces
 from src.common.state_models import (
@@ -25,8 +34,42 @@ from src.common.state_models import (
 DATETIME_FMT = "%Y-%m-%d @ %-I:%M:%S%P %Z"
 
 
+class InvalidCommandArgsError(ValueError):
+    def __init__(self, usage: str):
+        super().__init__(f"Usage: {usage}")
+        self.usage = usage
+
+
+class CommandRequirement(str, Enum):
+    # The broadcaster's state (or only the attributes in STATE_ATTRIBUTES).
+    STATE = "state"
+    # The chatter's identity, for what the broadcaster granted them (beyond what their role in the channel gives them).
+    CHATTER = "chatter"
+
+
 class AbstractCommand(ABC):
-    def __init__(self, interfaces: APIInterfaces, state: State, permission: Permission):
+    # What has to be fetched for the command to execute (anything else isn't fetched at all).
+    REQUIRES: FrozenSet[CommandRequirement] = frozenset(CommandRequirement)
+    # The state attributes a read-only command needs, so that only those are read (None: it needs the whole state, to write it).
+    STATE_ATTRIBUTES: Optional[List[str]] = None
+    # The args `execute` takes (name -> type to coerce the raw arg to), in order.
+    ARGS: Dict[str, Callable[[str], Any]] = {}
+    # Whether the command writes back the whole state it read (a version-checked read-modify-write, i.e. `update_state`),
+    # as opposed to only atomic, conditional writes (i.e. `increment_counter`) that can't be lost to a concurrent one.
+    READ_MODIFY_WRITE: bool = False
+    # The least permission the chatter needs for the command (beyond it, their custom grant doesn't need to be looked up).
+    PERMISSION: Permission = Permission.EVERYBODY
+
+    def __init__(
+        self,
+        interfaces: APIInterfaces,
+        state: Optional[State],
+        permission: Permission,
+    ):
+        """
+        :param state: The broadcaster's state, or None if the command doesn't require it.
+        :param permission: The chatter's permission (only from their role in the channel, if the command doesn't require the chatter).
+        """
         self.interfaces = interfaces
         self.state = state
         self.permission = permission
@@ -45,6 +88,9 @@ class StatusCommand(AbstractCommand):
     Generate a status reply to the ping.
     """
 
+    REQUIRES = frozenset()
+    STATE_ATTRIBUTES = []
+
     def execute(self) -> str:
         timestamp_str = self.timestamp.strftime(DATETIME_FMT)
         return f"Ok at {timestamp_str}!"
@@ -65,25 +111,34 @@ class AbstractCounterCommand(AbstractCommand):
 
         return reply
 
-    def _add(self, counter, dedup_msg) -> str | CounterState:
-        if self.permission < Permission.MODERATOR:
+    def _add(self, counter_name, dedup_msg) -> Optional[str]:
+        if self.permission < self.PERMISSION:
             return self.DENIED_MSG
 
-        if counter is None:
-            return CounterState(count=1, last_timestamp=self.timestamp)
+        # Skip the write altogether if the state we already have shows it's too soon.
+        counter = getattr(self.state, counter_name)
+        if counter is not None:
+            time_since = self.timestamp - counter.last_timestamp
+            time_since_s = time_since.total_seconds()
 
-        time_since = self.timestamp - counter.last_timestamp
-        time_since_s = time_since.total_seconds()
+            if time_since_s <= self.DEDUP_WINDOW_S:
+                return dedup_msg
 
-        if time_since_s <= self.DEDUP_WINDOW_S:
+        state = self.interfaces.state_table.increment_counter(
+            self.state,
+            counter_name,
+            self.timestamp,
+            self.DEDUP_WINDOW_S,
+        )
+        if state is None:
+            # Somebody else incremented it within the window since the state was read.
             return dedup_msg
 
-        counter.count += 1
-        counter.last_timestamp = self.timestamp
-        return counter
+        self.state = state
+        return None
 
     def _set(self, counter, count) -> str | CounterState:
-        if self.permission != Permission.BROADCASTER:
+        if self.permission < self.PERMISSION:
             return self.DENIED_MSG
 
         return CounterState(
@@ -108,6 +163,9 @@ class DeathsInfoCommand(AbstractDeathsCommand):
     Get info about the broadcaster's deaths.
     """
 
+    REQUIRES = frozenset([CommandRequirement.STATE])
+    STATE_ATTRIBUTES = ["deaths"]
+
     def execute(self) -> str:
         return self._generate_reply()
 
@@ -117,16 +175,16 @@ class DeathsAddCommand(AbstractDeathsCommand):
     Increment the broadcaster's death count.
     """
 
+    PERMISSION = Permission.MODERATOR
+
     def execute(self) -> str:
         dedup_msg = (
             "It's been too soon since they last died! Are you sure they died again?"
         )
-        result = self._add(self.state.deaths, dedup_msg)
-        if isinstance(result, str):
-            return result
+        denied_reply = self._add("deaths", dedup_msg)
+        if denied_reply is not None:
+            return denied_reply
 
-        self.state.deaths = result
-        self.state = self.interfaces.state_table.update_state(self.state)
         return self._generate_reply()
 
 
@@ -135,6 +193,10 @@ class DeathsSetCommand(AbstractDeathsCommand):
     Set the broadcaster's death count directly.
     """
 
+    ARGS = {"deaths": int}
+    READ_MODIFY_WRITE = True
+    PERMISSION = Permission.BROADCASTER
+
     def execute(self, deaths: int) -> str:
         result = self._set(self.state.deaths, deaths)
         if isinstance(result, str):
@@ -161,6 +223,9 @@ class CrimesInfoCommand(AbstractCrimesCommand):
     Get info about the broadcaster's crimes.
     """
 
+    REQUIRES = frozenset([CommandRequirement.STATE])
+    STATE_ATTRIBUTES = ["crimes"]
+
     def execute(self) -> str:
         return self._generate_reply()
 
@@ -170,14 +235,14 @@ class CrimesAddCommand(AbstractCrimesCommand):
     Increment the broadcaster's crime count.
     """
 
+    PERMISSION = Permission.MODERATOR
+
     def execute(self) -> str:
         dedup_msg = "It's been too soon since they last committed a crime! Did they really commit another?"
-        result = self._add(self.state.crimes, dedup_msg)
-        if isinstance(result, str):
-            return result
+        denied_reply = self._add("crimes", dedup_msg)
+        if denied_reply is not None:
+            return denied_reply
 
-        self.state.crimes = result
-        self.state = self.interfaces.state_table.update_state(self.state)
         return self._generate_reply()
 
 
@@ -186,6 +251,10 @@ class CrimesSetCommand(AbstractCrimesCommand):
     Set the broadcaster's crime count directly.
     """
 
+    ARGS = {"crimes": int}
+    READ_MODIFY_WRITE = True
+    PERMISSION = Permission.BROADCASTER
+
     def execute(self, crimes: int) -> str:
         result = self._set(self.state.crimes, crimes)
         if isinstance(result, str):
@@ -200,6 +269,9 @@ class CrimesSetCommand(AbstractCrimesCommand):
 
 
 class TwitchConnectCommand(AbstractCommand):
+    REQUIRES = frozenset()
+    STATE_ATTRIBUTES = []
+
     def execute(self) -> str:
         # TODO: generate URL for access.
         return "Not implemented yet!"
@@ -233,29 +305,77 @@ COMMAND_TREE = {
 # TODO: add "help" command/dynamically generate help content.
 
 
-def resolve_command(args: List[str]):
+def compile_command_tree(
+    tree: Dict[Optional[str], Any],
+    path: Tuple[str, ...] = (),
+) -> Tuple[Dict[Tuple[str, ...], Type[AbstractCommand]], FrozenSet[Tuple[str, ...]]]:
+    """
+    Flatten the command tree into a lookup by token path (i.e. ("deaths", "set") -> DeathsSetCommand).
+    A group's default command is keyed by the group's own path.
+
+    :return: The commands by path, and the paths of the command groups.
+    """
+    commands = {}
+    groups = {path}
+    for token, node in tree.items():
+        if token is None:
+            commands[path] = node
+        elif isinstance(node, dict):
+            group_commands, group_groups = compile_command_tree(node, (*path, token))
+            commands.update(group_commands)
+            groups.update(group_groups)
+        else:
+            commands[(*path, token)] = node
+
+    return commands, frozenset(groups)
+
+
+# Compiled once, so that resolving a command is a dict lookup per token (at most).
+COMMANDS, COMMAND_GROUPS = compile_command_tree(COMMAND_TREE)
+COMMAND_DEPTH = max(len(path) for path in COMMANDS)
+COMMAND_ARG_TYPES = {
+    CommandClass: tuple(CommandClass.ARGS.values())
+    for CommandClass in COMMANDS.values()
+}
+COMMAND_USAGES = {
+    CommandClass: " ".join([*path, *(f"<{name}>" for name in CommandClass.ARGS)])
+    for path, CommandClass in COMMANDS.items()
+}
+
+
+def parse_args(CommandClass: Type[AbstractCommand], args: List[str]) -> List[Any]:
     """
-    Look up a command from the command tree using the given args.
+    Coerce the raw args to the types the command declares, rejecting the wrong number of args or ones that don't coerce.
     """
-    # Make a shallow copy of the list so that we aren't modifying the provided reference.
-    args = args.copy()
-
-    # Traverse down the tree.
-    curr_node = COMMAND_TREE
-    FoundCommandClass = None
-    for i in range(len(args)):
-        arg = args.pop(0)
-        curr_node = curr_node.get(arg)
-        if not curr_node:
-            # Gave an arg that doesn't exist at this level.
-            break
-        elif isclass(curr_node) and issubclass(curr_node, AbstractCommand):
-            # Leaf node of command tree.
-            FoundCommandClass = curr_node
-            break
-    else:
-        # Check if in subcommand group w/ no-arg default.
-        FoundCommandClass = curr_node.get(None)
-
-    # Provide remaining args as well to caller.
-    return FoundCommandClass, args
+    arg_types = COMMAND_ARG_TYPES[CommandClass]
+    if len(args) != len(arg_types):
+        raise InvalidCommandArgsError(COMMAND_USAGES[CommandClass])
+
+    try:
+        return [arg_type(arg) for arg_type, arg in zip(arg_types, args)]
+    except ValueError as e:
+        raise InvalidCommandArgsError(COMMAND_USAGES[CommandClass]) from e
+
+
+def resolve_command(
+    args: List[str],
+) -> Tuple[Optional[Type[AbstractCommand]], List[Any]]:
+    """
+    Look up a command from the compiled command tree using the given args, and parse the remaining args for it.
+
+    :raises InvalidCommandArgsError: If the command was found, but the remaining args don't match what it takes.
+    """
+    # Longest matching token path first, so that the usual (fully specified) command is found in a single lookup.
+    for depth in range(min(len(args), COMMAND_DEPTH), 0, -1):
+        path = tuple(args[:depth])
+        CommandClass = COMMANDS.get(path)
+        if CommandClass is None:
+            continue
+
+        if path in COMMAND_GROUPS and depth < len(args):
+            # A group's default only applies if no args are left, otherwise the subcommand doesn't exist.
+            return None, []
+
+        return CommandClass, parse_args(CommandClass, args[depth:])
+
+    return None, []
@@ -0,0 +1,58 @@
+from src.common.state_table_interface import StateTableInterface
+from src.common.ttl_cache import TTLCache
+
+
+class EventDeduplicator:
+    """
+    Tracks which events have already been handled, so that re-deliveries of them can be skipped.
+    Checks an in-memory set of recently seen IDs first, then claims the ID in the state table (shared across instances).
+    """
+
+    RECENT_IDS_SIZE = 4096
+    CLAIM_TTL_S = 3600
+
+    def __init__(
+        self,
+        state_table_interface: StateTableInterface,
+        claim_ttl_s: int = CLAIM_TTL_S,
+    ):
+        self.state_table = state_table_interface
+        self.claim_ttl_s = claim_ttl_s
+        self.recent_ids = TTLCache(self.RECENT_IDS_SIZE, claim_ttl_s)
+
+    def is_recent(self, event_id: str) -> bool:
+        """
+        Whether this instance has recently seen the event (without claiming it in the table).
+        """
+
+        return self.recent_ids.get(event_id, default=False)
+
+    def claim(self, event_id: str, durable: bool = True) -> bool:
+        """
+        Claim an event for handling.
+
+        :param event_id: The unique ID of the event.
+        :param durable: Whether to claim it in the state table too, otherwise only re-deliveries to this instance are caught.
+        :return: True if the event hasn't been seen before (and is now claimed), False if it's a duplicate.
+        """
+
+        if self.is_recent(event_id):
+            return False
+
+        claimed = True
+        if durable:
+            claimed = self.state_table.claim_event(event_id, self.claim_ttl_s)
+
+        self.recent_ids.put(event_id, True)
+        return claimed
+
+    def release(self, event_id: str, durable: bool = True):
+        """
+        Release the claim on an event that failed to be handled, so that a retry of it will be.
+
+        :param durable: Whether the event was claimed in the state table too.
+        """
+
+        self.recent_ids.invalidate(event_id)
+        if durable:
+            self.state_table.release_event(event_id)
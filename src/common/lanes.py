@@ -0,0 +1,158 @@
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.metrics import (
+    Metrics,
+    MetricUnit,
+)
+
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+)
+from contextlib import contextmanager
+import contextvars
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+)
+import uuid
+
+from src.common.state_table_interface import StateTableInterface
+
+
+logger = Logger(service="bryti")
+metrics = Metrics(namespace="bryti", service="bryti")
+
+
+class KeyedLanes:
+    """
+    Serializes work per key (i.e. per broadcaster), while work for different keys runs in parallel.
+    Within this process, each key gets its own lock; across instances, a lease on the key is held in the state table.
+
+    If the lease can't be acquired in time (i.e. a crashed holder's lease hasn't expired yet), the work runs anyway,
+    still guarded by the state's version condition.
+    """
+
+    # Should outlive the longest piece of work (i.e. the Lambda timeout), so that a lease isn't lost mid-way.
+    LEASE_S = 30
+    LEASE_WAIT_S = 5
+    LEASE_POLL_BASE_S = 0.02
+    LEASE_POLL_MAX_S = 0.5
+
+    # Threads for running different keys' work alongside each other.
+    WORKERS = 8
+
+    def __init__(
+        self,
+        state_table_interface: StateTableInterface,
+        lease_s: int = LEASE_S,
+        lease_wait_s: float = LEASE_WAIT_S,
+        workers: int = WORKERS,
+    ):
+        self.state_table = state_table_interface
+        self.lease_s = lease_s
+        self.lease_wait_s = lease_wait_s
+        self.owner = str(uuid.uuid4())
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        # Key -> [lock, number of threads using it], so that locks are dropped once nobody needs them.
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._held = threading.local()
+
+    def _acquire_lock(self, key: str) -> threading.Lock:
+        with self._locks_lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+
+        entry[0].acquire()
+        return entry[0]
+
+    def _release_lock(self, key: str):
+        with self._locks_lock:
+            entry = self._locks[key]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def _acquire_lease(self, key: str) -> bool:
+        """
+        Poll for the lease on the given key (with capped exponential backoff), until it's acquired or the wait runs out.
+        """
+
+        deadline = time.monotonic() + self.lease_wait_s
+        poll_s = self.LEASE_POLL_BASE_S
+        while True:
+            if self.state_table.acquire_lease(key, self.owner, self.lease_s):
+                return True
+
+            if time.monotonic() + poll_s > deadline:
+                return False
+
+            metrics.add_metric(name="LaneLeaseWaits", unit=MetricUnit.Count, value=1)
+            time.sleep(poll_s)
+            poll_s = min(poll_s * 2, self.LEASE_POLL_MAX_S)
+
+    @contextmanager
+    def lane(self, key: str) -> Iterator[None]:
+        """
+        Hold the lane for the given key for the duration of the block.
+        Re-entering a lane that the current thread already holds is a no-op.
+        """
+
+        held = self._held.__dict__.setdefault("keys", set())
+        if key in held:
+            yield
+            return
+
+        self._acquire_lock(key)
+        held.add(key)
+        try:
+            leased = self._acquire_lease(key)
+            if not leased:
+                logger.warning("Timed out waiting for lease", key=key)
+                metrics.add_metric(
+                    name="LaneLeaseTimeouts",
+                    unit=MetricUnit.Count,
+                    value=1,
+                )
+
+            try:
+                yield
+            finally:
+                if leased:
+                    self.state_table.release_lease(key, self.owner)
+        finally:
+            held.discard(key)
+            self._release_lock(key)
+
+    def submit(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """
+        Run the given function in the key's lane, on a worker thread.
+        """
+
+        def run_in_lane():
+            with self.lane(key):
+                return fn(*args, **kwargs)
+
+        # Carry over the caller's context (i.e. telemetry dimensions) to the worker thread.
+        return self.executor.submit(contextvars.copy_context().run, run_in_lane)
+
+    def run_all(self, work: Dict[str, Callable[[], Any]]) -> Dict[str, Future]:
+        """
+        Run each key's work in its own lane, in parallel, and wait for all of it to finish.
+
+        :param work: Key -> the work to do for it.
+        :return: Key -> the (finished) future of its work, holding either its result or its exception.
+        """
+
+        futures = {key: self.submit(key, fn) for key, fn in work.items()}
+        for future in futures.values():
+            # Exceptions are left on the futures for the caller to inspect.
+            future.exception()
+
+        return futures
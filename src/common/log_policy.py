@@ -0,0 +1,234 @@
+from aws_lambda_powertools.logging import Logger
+from pydantic import BaseModel
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import copy
+import functools
+import logging
+import random
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    Optional,
+)
+
+
+class LogScope:
+    """
+    What's known about the current invocation (or one broadcaster's part of it), and what was decided about logging it.
+    """
+
+    def __init__(self):
+        self.kind: Optional[str] = None
+        self.broadcaster_user_id: Optional[str] = None
+        self.is_sampled = True
+        self.is_full = False
+
+
+class Payload:
+    """
+    An object to log (i.e. an event), only rendered (cut down to the allowed fields, unless debugging) if the log line is actually emitted.
+    """
+
+    def __init__(self, obj: Any):
+        self.obj = obj
+
+
+class LogPolicy:
+    """
+    Decides what's logged, and how much of it:
+    - info logs are sampled per kind of invocation (warnings and errors are always logged),
+    - payloads are cut down to an allowlist of fields (IDs, command, outcome) and only rendered if the line is emitted,
+    - a single broadcaster can be debugged, logging everything for them with full payloads.
+    """
+
+    # Share of invocations (per kind) whose info logs are kept. Chat messages are by far the most common notifications.
+    SAMPLE_RATES = {
+        "webhook_callback_verification": 1.0,
+        "revocation": 1.0,
+        "notification": 0.05,
+        "command": 1.0,
+    }
+    DEFAULT_SAMPLE_RATE = 1.0
+
+    # Fields kept from payloads (at any depth, as long as their parents are models or dicts).
+    ALLOWED_FIELDS = frozenset(
+        [
+            # Requests
+            "requestId",
+            "routeKey",
+            "statusCode",
+            "twitch-eventsub-message-id",
+            "twitch-eventsub-message-type",
+            "twitch-eventsub-subscription-type",
+            "twitch-eventsub-message-retry",
+            # Twitch events
+            "event_id",
+            "event_type",
+            "subscription_type",
+            "retry_count",
+            "id",
+            "type",
+            "status",
+            "message_id",
+            "broadcaster_user_id",
+            "chatter_user_id",
+            # State
+            "user",
+            "version",
+            # Commands
+            "command",
+            "outcome",
+        ]
+    )
+
+    def __init__(
+        self,
+        logger: Logger,
+        sample_rates: Optional[Dict[str, float]] = None,
+        debug_broadcaster_user_id: Optional[str] = None,
+    ):
+        self.logger = logger
+        self.sample_rates = {**self.SAMPLE_RATES, **(sample_rates or {})}
+        self.debug_broadcaster_user_id = debug_broadcaster_user_id
+        self._scope: ContextVar[Optional[LogScope]] = ContextVar(
+            "log_scope", default=None
+        )
+
+    def _current(self) -> LogScope:
+        scope = self._scope.get()
+        if scope is None:
+            scope = LogScope()
+            self._scope.set(scope)
+
+        return scope
+
+    def invocation(self, handler: Callable) -> Callable:
+        """
+        Decorator for a Lambda handler, starting a fresh scope for each invocation.
+        """
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            token = self._scope.set(LogScope())
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                self._scope.reset(token)
+
+        return wrapper
+
+    def update(
+        self,
+        kind: Optional[str] = None,
+        broadcaster_user_id: Optional[str] = None,
+    ):
+        """
+        Narrow down the current scope: each new kind is sampled at its own rate, and the debugged broadcaster is always logged in full.
+        """
+
+        scope = self._current()
+        if kind is not None and kind != scope.kind:
+            scope.kind = kind
+            sample_rate = self.sample_rates.get(kind, self.DEFAULT_SAMPLE_RATE)
+            scope.is_sampled = scope.is_full or random.random() < sample_rate
+
+        if broadcaster_user_id is not None:
+            scope.broadcaster_user_id = broadcaster_user_id
+            if broadcaster_user_id == self.debug_broadcaster_user_id:
+                scope.is_full = True
+                scope.is_sampled = True
+
+    @contextmanager
+    def scope(self, **kwargs) -> Iterator[None]:
+        """
+        Narrow down a copy of the current scope for the duration of the block (i.e. for one broadcaster's part of a batch).
+        """
+
+        token = self._scope.set(copy.copy(self._current()))
+        try:
+            self.update(**kwargs)
+            yield
+        finally:
+            self._scope.reset(token)
+
+    @staticmethod
+    def payload(obj: Any) -> Payload:
+        return Payload(obj)
+
+    def is_enabled(self, level: int) -> bool:
+        if not self.logger.isEnabledFor(level):
+            return False
+
+        return level >= logging.WARNING or self._current().is_sampled
+
+    def _allowed(self, obj: Any) -> Any:
+        """
+        Helper to cut a model/dict down to its allowed fields, without serializing the rest of it.
+        """
+
+        if isinstance(obj, BaseModel):
+            items = ((name, getattr(obj, name)) for name in type(obj).model_fields)
+        elif isinstance(obj, dict):
+            items = obj.items()
+        else:
+            return obj
+
+        allowed = {}
+        for name, value in items:
+            if name in self.ALLOWED_FIELDS:
+                allowed[name] = (
+                    value.model_dump(mode="json")
+                    if isinstance(value, BaseModel)
+                    else value
+                )
+            elif isinstance(value, (BaseModel, dict)):
+                nested = self._allowed(value)
+                if nested:
+                    allowed[name] = nested
+
+        return allowed
+
+    def _render(self, value: Any) -> Any:
+        if not isinstance(value, Payload):
+            # Callables (i.e. stats getters) are only called if the log line is actually emitted.
+            return value() if callable(value) else value
+
+        if self._current().is_full:
+            obj = value.obj
+            return obj.model_dump(mode="json") if isinstance(obj, BaseModel) else obj
+
+        return self._allowed(value.obj)
+
+    def _log(self, level: int, message: str, fields: Dict[str, Any]):
+        """
+        Log a line, if its level is enabled and (for info and below) the invocation is sampled.
+        Payloads and callables among the fields are only rendered once that's decided.
+        """
+
+        if not self.is_enabled(level):
+            return
+
+        log = getattr(self.logger, logging.getLevelName(level).lower())
+        log(
+            message,
+            **{name: self._render(value) for name, value in fields.items()},
+            sampled_kind=self._current().kind,
+            # Attribute the line to the caller of `debug`/`info`/`warning`.
+            stacklevel=4,
+        )
+
+    def debug(self, message: str, **fields):
+        self._log(logging.DEBUG, message, fields)
+
+    def info(self, message: str, **fields):
+        self._log(logging.INFO, message, fields)
+
+    def warning(self, message: str, **fields):
+        self._log(logging.WARNING, message, fields)
+
+
+log_policy = LogPolicy(Logger(service="bryti"))
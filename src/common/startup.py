@@ -0,0 +1,198 @@
+"""
+Cold start bookkeeping: deferring the heavy parts of a cold start (imports, clients, model builds) until their first use,
+and a breakdown of how long each part took, whether it happened during init or later on first use.
+"""
+
+from aws_lambda_powertools.logging import Logger
+
+from contextlib import contextmanager
+import functools
+from importlib import import_module
+import threading
+import time
+from types import ModuleType
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+
+
+logger = Logger(service="bryti")
+
+
+class StartupReport:
+    """
+    How long each startup step (i.e. "import:boto3", "build:dynamodb_client") took, in ms.
+    Steps are split by whether they ran during init (before `mark_ready`) or were deferred until their first use.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.ready_at = None
+        self.init_ms: Dict[str, float] = {}
+        self.first_use_ms: Dict[str, float] = {}
+        self.is_reported = False
+        self.is_preloaded = False
+        self._lock = threading.Lock()
+
+    def record(self, step: str, duration_s: float):
+        with self._lock:
+            steps = self.init_ms if self.ready_at is None else self.first_use_ms
+            steps[step] = round(duration_s * 1000, 2)
+
+    @contextmanager
+    def timed(self, step: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(step, time.perf_counter() - start)
+
+    def mark_ready(self):
+        """
+        Mark the end of init (i.e. the end of the handler module's import).
+        """
+        self.ready_at = time.perf_counter()
+
+    def report(self) -> Optional[Dict[str, Any]]:
+        """
+        The breakdown, the first time it's asked for only (i.e. on the cold start's first invocation), otherwise None.
+        """
+
+        with self._lock:
+            if self.is_reported:
+                return None
+
+            self.is_reported = True
+            init_total_s = (self.ready_at or time.perf_counter()) - self.started_at
+            return {
+                "preloaded": self.is_preloaded,
+                "init_total_ms": round(init_total_s * 1000, 2),
+                "init_ms": dict(self.init_ms),
+                "first_use_ms": dict(self.first_use_ms),
+            }
+
+    def log_report(self, handler: Callable) -> Callable:
+        """
+        Decorator for a Lambda handler, logging the breakdown after the cold start's first invocation (so including what was deferred to it).
+        """
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                report = self.report()
+                if report is not None:
+                    logger.info("Startup report", **report)
+
+        return wrapper
+
+
+startup = StartupReport()
+
+
+class LazyModule:
+    """
+    Stands in for a module, only importing it on first attribute access (and recording how long that took).
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self) -> ModuleType:
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    with startup.timed(f"import:{self._name}"):
+                        self._module = import_module(self._name)
+
+        return self._module
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.load(), name)
+
+
+class Deferred:
+    """
+    Stands in for an object (i.e. a client), only building it on first attribute access (and recording how long that took).
+    """
+
+    def __init__(self, name: str, build: Callable[[], Any]):
+        self._name = name
+        self._build = build
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    with startup.timed(f"build:{self._name}"):
+                        self._value = self._build()
+
+        return self._value
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+
+# Everything deferred, so that it can all be loaded up front instead (see `preload`).
+LAZY_MODULES: Dict[str, LazyModule] = {}
+DEFERRED: List[Deferred] = []
+PRELOADERS: Dict[str, Callable[[], None]] = {}
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    Import a module lazily: it's only actually imported once one of its attributes is used.
+    """
+    module = LAZY_MODULES.get(name)
+    if module is None:
+        module = LAZY_MODULES[name] = LazyModule(name)
+
+    return module
+
+
+def deferred(name: str, build: Callable[[], Any]) -> Deferred:
+    """
+    Build an object lazily: it's only actually built once one of its attributes is used.
+    """
+    value = Deferred(name, build)
+    DEFERRED.append(value)
+    return value
+
+
+def preloader(name: str) -> Callable:
+    """
+    Register a function to run in `preload` (i.e. building models that are otherwise built on first use).
+    """
+
+    def register(fn: Callable[[], None]) -> Callable[[], None]:
+        PRELOADERS[name] = fn
+        return fn
+
+    return register
+
+
+def preload():
+    """
+    Load everything that's been deferred right away, i.e. to pay for it during init instead of on first use.
+    """
+    for module in list(LAZY_MODULES.values()):
+        module.load()
+
+    for value in list(DEFERRED):
+        value.get()
+
+    for name, fn in list(PRELOADERS.items()):
+        with startup.timed(f"preload:{name}"):
+            fn()
+
+    startup.is_preloaded = True
@@ -11,7 +11,6 @@ from datetime import (
 from enum import Enum
 from typing import (
     Annotated,
-    Dict,
     Optional,
 )
 
@@ -38,12 +37,16 @@ class Permission(str, Enum):
         return members.index(self) >= members.index(other)
 
 
+def to_iso_utc(dt: datetime) -> str:
+    """
+    Format a datetime the way it's stored in the state table (which keeps them comparable as strings).
+    """
+    return dt.astimezone(timezone.utc).isoformat(timespec="seconds")
+
+
 ISOUTCDatetime = Annotated[
     datetime,
-    PlainSerializer(
-        lambda dt: dt.astimezone(timezone.utc).isoformat(timespec="seconds"),
-        return_type=str,
-    ),
+    PlainSerializer(to_iso_utc, return_type=str),
 ]
 
 
@@ -88,7 +91,14 @@ class CounterState(BaseModel):
 
 
 class State(LookupFields):
-    members: Dict[str, Permission] = {}
     deaths: Optional[CounterState] = None
     crimes: Optional[CounterState] = None
     version: int = 0
+
+
+class EventContext(BaseModel):
+    broadcaster: Optional[LookupFields] = None
+    state: Optional[State] = None
+    chatter: Optional[LookupFields] = None
+    # What the chatter has been granted in the broadcaster's channel (if anything).
+    permission: Optional[Permission] = None
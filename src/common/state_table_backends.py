@@ -0,0 +1,447 @@
+from abc import abstractmethod
+from contextlib import contextmanager
+from datetime import (
+    datetime,
+    timedelta,
+)
+import json
+import sqlite3
+import threading
+import time
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from src.common.state_models import (
+    CounterState,
+    LookupFields,
+    Permission,
+    State,
+)
+from src.common.startup import (
+    deferred,
+    lazy_import,
+)
+from src.common.state_table_interface import (
+    DynamoDBStateTableInterface,
+    StateTableInterface,
+    VersionConflictError,
+)
+
+boto3 = lazy_import("boto3")
+
+# A marker (for a claimed event, or a lease): its owner (if any), and when it expires.
+Marker = Tuple[Optional[str], float]
+
+
+class LocalStateTableInterface(StateTableInterface):
+    """
+    Base for state tables stored locally, implementing the conditional semantics once on top of a few storage primitives.
+    Each conditional check + write runs inside a single `_transaction`.
+    """
+
+    @abstractmethod
+    def _transaction(self) -> Iterator[None]:
+        pass
+
+    @abstractmethod
+    def _load(self, user: str) -> Optional[State]:
+        pass
+
+    @abstractmethod
+    def _load_by(self, key: str, value: str) -> Optional[State]:
+        """
+        Load the user with the given value for one of the lookup keys.
+        """
+        pass
+
+    @abstractmethod
+    def _store(self, state: State):
+        pass
+
+    @abstractmethod
+    def _load_marker(self, key: str) -> Optional[Marker]:
+        pass
+
+    @abstractmethod
+    def _store_marker(self, key: str, owner: Optional[str], expires_at: float):
+        pass
+
+    @abstractmethod
+    def _delete_marker(self, key: str):
+        pass
+
+    def _find_user(self, key: str, value: str) -> Optional[LookupFields]:
+        with self._transaction():
+            state = self._load_by(key, value)
+
+        if state is None:
+            return None
+
+        return LookupFields.model_validate(
+            state.model_dump(include=set(LookupFields.model_fields))
+        )
+
+    def _read_state(
+        self,
+        user: str,
+        attributes: Optional[List[str]],
+        consistent_read: bool,
+    ) -> Optional[State]:
+        """
+        Local reads are always consistent, but are still projected (so that callers see the same partial state as from DynamoDB).
+        """
+
+        with self._transaction():
+            state = self._load(user)
+
+        if state is None or attributes is None:
+            return state
+
+        return State.model_validate(state.model_dump(include=set(attributes)))
+
+    def _write_state(self, state: State) -> State:
+        with self._transaction():
+            current = self._load(state.user)
+            if current is not None and current.version != state.version:
+                # Somebody else wrote a newer version since this state was read.
+                raise VersionConflictError(state.user)
+
+            updated_state = state.model_copy(update={"version": state.version + 1})
+            self._store(updated_state)
+            return updated_state
+
+    def _increment_counter(
+        self,
+        state: State,
+        counter_name: str,
+        timestamp: datetime,
+        dedup_window_s: int,
+    ) -> Optional[State]:
+        with self._transaction():
+            current = self._load(state.user)
+            current_counter = getattr(current, counter_name) if current else None
+            if getattr(state, counter_name) is None:
+                # Start the counter, unless somebody else did in the meantime (and fill in the lookup fields for a new item).
+                if current_counter is not None:
+                    return None
+
+                if current is None:
+                    current = State.model_validate(
+                        state.model_dump(include={"user", *self.LOOKUP_KEYS})
+                    )
+
+                count = 1
+            else:
+                cutoff = timestamp - timedelta(seconds=dedup_window_s)
+                if current_counter is None or current_counter.last_timestamp >= cutoff:
+                    return None
+
+                count = current_counter.count + 1
+
+            updated_state = current.model_copy(
+                update={
+                    counter_name: CounterState(count=count, last_timestamp=timestamp),
+                    "version": current.version + 1,
+                },
+            )
+            self._store(updated_state)
+            return updated_state
+
+    def _claim_event(self, event_id: str, ttl_s: int) -> bool:
+        key = self.EVENT_KEY_PREFIX + event_id
+        now = time.time()
+        with self._transaction():
+            marker = self._load_marker(key)
+            if marker is not None and marker[1] >= now:
+                return False
+
+            self._store_marker(key, None, now + ttl_s)
+            return True
+
+    def _release_event(self, event_id: str):
+        with self._transaction():
+            self._delete_marker(self.EVENT_KEY_PREFIX + event_id)
+
+    def _acquire_lease(self, key: str, owner: str, lease_s: int) -> bool:
+        key = self.LEASE_KEY_PREFIX + key
+        now = time.time()
+        with self._transaction():
+            marker = self._load_marker(key)
+            if marker is not None and marker[1] >= now and marker[0] != owner:
+                return False
+
+            self._store_marker(key, owner, now + lease_s)
+            return True
+
+    def _release_lease(self, key: str, owner: str):
+        key = self.LEASE_KEY_PREFIX + key
+        with self._transaction():
+            marker = self._load_marker(key)
+            if marker is not None and marker[0] == owner:
+                self._delete_marker(key)
+
+
+class InMemoryStateTableInterface(LocalStateTableInterface):
+    """
+    State table held in the process' memory (i.e. for tests, benchmarks and load tests), with a dict per lookup index.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._states: Dict[str, State] = {}
+        self._indexes: Dict[str, Dict[str, str]] = {key: {} for key in self.LOOKUP_KEYS}
+        self._markers: Dict[str, Marker] = {}
+        self._permissions: Dict[str, Permission] = {}
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        with self._lock:
+            yield
+
+    def _load(self, user: str) -> Optional[State]:
+        # Hand out copies, so that changes to a read state don't leak into the table before they're written.
+        state = self._states.get(user)
+        return state.model_copy(deep=True) if state is not None else None
+
+    def _load_by(self, key: str, value: str) -> Optional[State]:
+        user = self._indexes[key].get(value)
+        return self._load(user) if user is not None else None
+
+    def _store(self, state: State):
+        previous = self._states.get(state.user)
+        for key, index in self._indexes.items():
+            if previous is not None and getattr(previous, key) is not None:
+                index.pop(getattr(previous, key), None)
+
+            if getattr(state, key) is not None:
+                index[getattr(state, key)] = state.user
+
+        self._states[state.user] = state.model_copy(deep=True)
+
+    def _load_marker(self, key: str) -> Optional[Marker]:
+        return self._markers.get(key)
+
+    def _store_marker(self, key: str, owner: Optional[str], expires_at: float):
+        self._markers[key] = (owner, expires_at)
+
+    def _delete_marker(self, key: str):
+        self._markers.pop(key, None)
+
+    def _read_permission(self, user: str, member: str) -> Optional[Permission]:
+        with self._transaction():
+            return self._permissions.get(self._member_key(user, member))
+
+    def _write_permissions(self, user: str, permissions: Dict[str, Permission]):
+        with self._transaction():
+            for member, permission in permissions.items():
+                self._permissions[self._member_key(user, member)] = permission
+
+    def _delete_permissions(self, user: str, members: List[str]):
+        with self._transaction():
+            for member in members:
+                self._permissions.pop(self._member_key(user, member), None)
+
+    # States only ever live as long as the process, so there are no legacy `members` maps.
+
+    def _find_legacy_members(self) -> Iterator[str]:
+        return iter([])
+
+    def _read_legacy_members(self, user: str) -> Dict[str, Permission]:
+        return {}
+
+    def _remove_legacy_members(self, user: str):
+        pass
+
+
+class SQLiteStateTableInterface(LocalStateTableInterface):
+    """
+    State table persisted in a local SQLite file (i.e. for a single-box deployment), with an SQL index per lookup key.
+    Transactions take the database's write lock up front, so that conditional writes are also atomic across processes.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        # Transactions are managed explicitly (see `_transaction`).
+        self._connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS states (
+                user TEXT PRIMARY KEY,
+                twitch_user_id TEXT,
+                discord_user_id TEXT,
+                github_user_id TEXT,
+                state TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS twitch_lookup_index ON states (twitch_user_id);
+            CREATE INDEX IF NOT EXISTS discord_lookup_index ON states (discord_user_id);
+            CREATE INDEX IF NOT EXISTS github_lookup_index ON states (github_user_id);
+            CREATE TABLE IF NOT EXISTS markers (
+                key TEXT PRIMARY KEY,
+                owner TEXT,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS permissions (
+                user TEXT NOT NULL,
+                member TEXT NOT NULL,
+                permission TEXT NOT NULL,
+                PRIMARY KEY (user, member)
+            );
+            """
+        )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        with self._lock:
+            if self._depth > 0:
+                # Already inside this thread's transaction.
+                yield
+                return
+
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            else:
+                self._connection.execute("COMMIT")
+            finally:
+                self._depth -= 1
+
+    def _load(self, user: str) -> Optional[State]:
+        row = self._connection.execute(
+            "SELECT state FROM states WHERE user = ?",
+            (user,),
+        ).fetchone()
+        return State.model_validate_json(row[0]) if row else None
+
+    def _load_by(self, key: str, value: str) -> Optional[State]:
+        if key not in self.LOOKUP_KEYS:
+            raise ValueError(f"Unknown lookup key: {key}")
+
+        row = self._connection.execute(
+            f"SELECT state FROM states WHERE {key} = ? LIMIT 1",
+            (value,),
+        ).fetchone()
+        return State.model_validate_json(row[0]) if row else None
+
+    def _store(self, state: State):
+        self._connection.execute(
+            """
+            INSERT OR REPLACE INTO states (user, twitch_user_id, discord_user_id, github_user_id, state)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (
+                state.user,
+                state.twitch_user_id,
+                state.discord_user_id,
+                state.github_user_id,
+                state.model_dump_json(exclude_none=True),
+            ),
+        )
+
+    def _load_marker(self, key: str) -> Optional[Marker]:
+        row = self._connection.execute(
+            "SELECT owner, expires_at FROM markers WHERE key = ?",
+            (key,),
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _store_marker(self, key: str, owner: Optional[str], expires_at: float):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO markers (key, owner, expires_at) VALUES (?, ?, ?)",
+            (key, owner, expires_at),
+        )
+
+    def _delete_marker(self, key: str):
+        self._connection.execute("DELETE FROM markers WHERE key = ?", (key,))
+
+    def _read_permission(self, user: str, member: str) -> Optional[Permission]:
+        with self._transaction():
+            row = self._connection.execute(
+                "SELECT permission FROM permissions WHERE user = ? AND member = ?",
+                (user, member),
+            ).fetchone()
+
+        return Permission(row[0]) if row else None
+
+    def _write_permissions(self, user: str, permissions: Dict[str, Permission]):
+        with self._transaction():
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO permissions (user, member, permission) VALUES (?, ?, ?)",
+                [
+                    (user, member, permission.value)
+                    for member, permission in permissions.items()
+                ],
+            )
+
+    def _delete_permissions(self, user: str, members: List[str]):
+        with self._transaction():
+            self._connection.executemany(
+                "DELETE FROM permissions WHERE user = ? AND member = ?",
+                [(user, member) for member in members],
+            )
+
+    def _find_legacy_members(self) -> Iterator[str]:
+        with self._transaction():
+            rows = self._connection.execute(
+                "SELECT user FROM states WHERE json_extract(state, '$.members') IS NOT NULL"
+            ).fetchall()
+
+        return (row[0] for row in rows)
+
+    def _read_legacy_members(self, user: str) -> Dict[str, Permission]:
+        with self._transaction():
+            row = self._connection.execute(
+                "SELECT json_extract(state, '$.members') FROM states WHERE user = ?",
+                (user,),
+            ).fetchone()
+
+        members = json.loads(row[0]) if row and row[0] is not None else {}
+        return {
+            member: Permission(permission) for member, permission in members.items()
+        }
+
+    def _remove_legacy_members(self, user: str):
+        with self._transaction():
+            self._connection.execute(
+                "UPDATE states SET state = json_remove(state, '$.members') WHERE user = ?",
+                (user,),
+            )
+
+
+def build_state_table_interface(
+    spec: Optional[str],
+    table_name: str,
+) -> StateTableInterface:
+    """
+    Build a state table from its configured spec:
+    - None/empty/"dynamodb": the DynamoDB table with the given name,
+    - "memory": an in-memory table,
+    - "sqlite:<path>": a SQLite table stored at the given path.
+    """
+
+    if not spec or spec == "dynamodb":
+        # The client is only created on first use (creating it loads the service's whole API model).
+        dynamodb_client = deferred("dynamodb_client", lambda: boto3.client("dynamodb"))
+        return DynamoDBStateTableInterface(dynamodb_client, table_name)
+    elif spec == "memory":
+        return InMemoryStateTableInterface()
+    elif spec.startswith("sqlite:"):
+        return SQLiteStateTableInterface(spec.removeprefix("sqlite:"))
+
+    raise ValueError(f"Unknown state table: {spec}")
@@ -1,18 +1,41 @@
-from boto3.dynamodb.types import (
-    TypeDeserializer,
-    TypeSerializer,
-)
+from botocore.exceptions import ClientError
 
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from datetime import (
+    datetime,
+    timedelta,
+)
 import string
+import time
 from typing import (
+    Dict,
+    Iterator,
     List,
     Optional,
 )
 
 from src.common.state_models import (
+    CounterState,
+    EventContext,
     LookupFields,
+    Permission,
     State,
+    to_iso_utc,
 )
+from src.common.startup import lazy_import
+from src.common.telemetry import telemetry
+from src.common.ttl_cache import TTLCache
+
+# Importing boto3 is a large share of a cold start, so it's only paid for on the first item conversion.
+dynamodb_types = lazy_import("boto3.dynamodb.types")
+
+# Sentinel to tell an uncached lookup apart from a cached "user not found" (None).
+NOT_CACHED = object()
 
 
 def ddb_to_dict(item: dict) -> dict:
@@ -22,7 +45,7 @@ def ddb_to_dict(item: dict) -> dict:
     :param item: DynamoDB-formatted item.
     :return: A normally-formatted dictionary.
     """
-    converter = TypeDeserializer()
+    converter = dynamodb_types.TypeDeserializer()
     return {k: converter.deserialize(v) for k, v in item.items()}
 
 
@@ -33,16 +56,469 @@ def dict_to_ddb(obj: dict) -> dict:
     :param obj: A normally-formatted dictionary.
     :return: A DynamoDB-formatted item.
     """
-    converter = TypeSerializer()
+    converter = dynamodb_types.TypeSerializer()
     return {k: converter.serialize(v) for k, v in obj.items()}
 
 
-class StateTableInterface:
+def is_conditional_check_failure(e: ClientError) -> bool:
+    """
+    Whether the given DynamoDB error was caused by a failed condition expression.
+    """
+    return e.response["Error"]["Code"] == "ConditionalCheckFailedException"
+
+
+class VersionConflictError(Exception):
+    pass
+
+
+class UnprocessedItemsError(Exception):
+    pass
+
+
+class StateTableInterface(ABC):
+    """
+    The table of users' state, with lookup indexes from each platform's user IDs to users (and marker items for claimed events/leases).
+    Backends implement the storage primitives (the abstract `_` methods), all with the same conditional semantics:
+    - state writes are conditioned on the version last read (and increment it), otherwise raising VersionConflictError,
+    - counter increments are rejected within the dedup window (against what's actually stored),
+    - event claims and leases hold until they expire (or are released), and leases can be renewed by their owner.
+
+    Members' permissions in a broadcaster's channel are items of their own (one per member), instead of part of the broadcaster's state,
+    so that the state's size (and the cost of reading/writing it) doesn't grow with the channel's members.
+    """
+
+    # Threads for running the independent reads of a fetch plan alongside each other.
+    FETCH_WORKERS = 2
+
+    # Platform ID -> user mappings almost never change, so lookups are cached in-process.
+    LOOKUP_CACHE_SIZE = 1024
+    LOOKUP_CACHE_TTL_S = 600
+    # A user that wasn't found may be created by another instance at any time (which only invalidates its own cache),
+    # so "not found" is only cached briefly.
+    LOOKUP_NOT_FOUND_TTL_S = 5
+    LOOKUP_KEYS = ["twitch_user_id", "discord_user_id", "github_user_id"]
+
+    # Marker items for claimed events share the table, under keys that can't collide with user names.
+    EVENT_KEY_PREFIX = "event#"
+    LEASE_KEY_PREFIX = "lease#"
+    MEMBER_KEY_PREFIX = "member#"
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.FETCH_WORKERS)
+        self.lookup_cache = TTLCache(self.LOOKUP_CACHE_SIZE, self.LOOKUP_CACHE_TTL_S)
+
+    # --- Storage primitives ---
+
+    @abstractmethod
+    def _find_user(self, key: str, value: str) -> Optional[LookupFields]:
+        """
+        Look up the user with the given platform user ID (i.e. key "twitch_user_id") in its lookup index.
+        """
+        pass
+
+    @abstractmethod
+    def _read_state(
+        self,
+        user: str,
+        attributes: Optional[List[str]],
+        consistent_read: bool,
+    ) -> Optional[State]:
+        """
+        Read the user's item, with only the given attributes (or all of them, if None).
+        """
+        pass
+
+    @abstractmethod
+    def _write_state(self, state: State) -> State:
+        pass
+
+    @abstractmethod
+    def _read_permission(self, user: str, member: str) -> Optional[Permission]:
+        pass
+
+    @abstractmethod
+    def _write_permissions(self, user: str, permissions: Dict[str, Permission]):
+        pass
+
+    @abstractmethod
+    def _delete_permissions(self, user: str, members: List[str]):
+        pass
+
+    @abstractmethod
+    def _find_legacy_members(self) -> Iterator[str]:
+        """
+        Find the users whose item still has a `members` map (from before permissions were items of their own).
+        """
+        pass
+
+    @abstractmethod
+    def _read_legacy_members(self, user: str) -> Dict[str, Permission]:
+        pass
+
+    @abstractmethod
+    def _remove_legacy_members(self, user: str):
+        pass
+
+    @abstractmethod
+    def _increment_counter(
+        self,
+        state: State,
+        counter_name: str,
+        timestamp: datetime,
+        dedup_window_s: int,
+    ) -> Optional[State]:
+        pass
+
+    @abstractmethod
+    def _claim_event(self, event_id: str, ttl_s: int) -> bool:
+        pass
+
+    @abstractmethod
+    def _release_event(self, event_id: str):
+        pass
+
+    @abstractmethod
+    def _acquire_lease(self, key: str, owner: str, lease_s: int) -> bool:
+        pass
+
+    @abstractmethod
+    def _release_lease(self, key: str, owner: str):
+        pass
+
+    # --- Shared logic ---
+
+    def _lookup(self, key: str, value: str) -> Optional[LookupFields]:
+        """
+        Helper to get the corresponding user primary key + IDs for a given platform user ID.
+        Reads through the lookup cache (including, briefly, for users that weren't found).
+        """
+
+        cache_key = (key, value)
+        cached = self.lookup_cache.get(cache_key, default=NOT_CACHED)
+        if cached is not NOT_CACHED:
+            return cached
+
+        lookup = self._find_user(key, value)
+        ttl_s = self.LOOKUP_NOT_FOUND_TTL_S if lookup is None else None
+        self.lookup_cache.put(cache_key, lookup, ttl_s=ttl_s)
+        return lookup
+
+    def _member_key(self, user: str, member: str) -> str:
+        """
+        Helper to get the key of a member's permission item in a user's channel.
+        """
+
+        return f"{self.MEMBER_KEY_PREFIX}{user}#{member}"
+
+    def _invalidate_lookups(self, state: State):
+        """
+        Helper to drop cached lookups that may be stale after the given state was written.
+        """
+
+        for key in self.LOOKUP_KEYS:
+            value = getattr(state, key)
+            if value is not None:
+                self.lookup_cache.invalidate((key, value))
+
+        # Also catch IDs that have since been changed/removed for this user.
+        self.lookup_cache.invalidate_if(
+            lambda _, lookup: lookup is not None and lookup.user == state.user
+        )
+
+    @telemetry.timed("state_table.lookup_by_twitch")
+    def lookup_by_twitch(self, twitch_user_id: str) -> Optional[LookupFields]:
+        """
+        Looks up a user by a Twitch user ID.
+        """
+
+        return self._lookup("twitch_user_id", twitch_user_id)
+
+    @telemetry.timed("state_table.lookup_by_discord")
+    def lookup_by_discord(self, discord_user_id: str) -> Optional[LookupFields]:
+        """
+        Looks up a user by a Discord user ID.
+        """
+
+        return self._lookup("discord_user_id", discord_user_id)
+
+    @telemetry.timed("state_table.lookup_by_github")
+    def lookup_by_github(self, github_user_id: str) -> Optional[LookupFields]:
+        """
+        Looks up a user by a GitHub user ID.
+        """
+
+        return self._lookup("github_user_id", github_user_id)
+
+    @telemetry.timed("state_table.get_state")
+    def get_state(
+        self,
+        user: str,
+        attributes: Optional[List[str]] = None,
+        consistent_read: bool = False,
+    ) -> Optional[State]:
+        """
+        Reads the state of a given user.
+        A projected state (only some attributes) is partial, so it's only for reading: it must not be passed to `update_state`.
+
+        :param user: The primary key/user to read the state of.
+        :param attributes: If given, only read these attributes (plus the user's key, lookup fields and version).
+        :param consistent_read: Whether to read strongly consistently (i.e. before a conditional write), instead of eventually.
+        :return: A State object representing what's in the table.
+        """
+
+        if attributes is not None:
+            attributes = list(
+                dict.fromkeys(["user", *self.LOOKUP_KEYS, "version", *attributes])
+            )
+
+        return self._read_state(user, attributes, consistent_read)
+
+    @telemetry.timed("state_table.get_permission")
+    def get_permission(self, user: str, member: str) -> Optional[Permission]:
+        """
+        Reads the permission a member has been granted in a user's channel, with a single point read.
+
+        :param user: The primary key/user of the channel's broadcaster.
+        :param member: The primary key/user of the member.
+        :return: The member's permission, or None if they haven't been granted any.
+        """
+
+        return self._read_permission(user, member)
+
+    @telemetry.timed("state_table.grant_permissions")
+    def grant_permissions(self, user: str, permissions: Dict[str, Permission]):
+        """
+        Grants (or changes) permissions for any number of members of a user's channel, in bulk.
+
+        :param user: The primary key/user of the channel's broadcaster.
+        :param permissions: Member's primary key/user -> the permission to grant them.
+        """
+
+        if permissions:
+            self._write_permissions(user, permissions)
+
+    @telemetry.timed("state_table.revoke_permissions")
+    def revoke_permissions(self, user: str, members: List[str]):
+        """
+        Revokes the permissions of any number of members of a user's channel, in bulk (members without any are skipped).
+
+        :param user: The primary key/user of the channel's broadcaster.
+        :param members: The members' primary keys/users.
+        """
+
+        if members:
+            self._delete_permissions(user, members)
+
+    def migrate_members(self, user: str) -> int:
+        """
+        Moves the permissions in a user's legacy `members` map to items of their own, then removes the map from the user's item.
+        Members that have since been granted a permission as an item of their own keep that one instead.
+        Safe to re-run, i.e. if it failed partway.
+
+        :param user: The primary key/user of the channel's broadcaster.
+        :return: How many members' permissions were moved.
+        """
+
+        members = self._read_legacy_members(user)
+        permissions = {
+            member: permission
+            for member, permission in members.items()
+            if self._read_permission(user, member) is None
+        }
+        self.grant_permissions(user, permissions)
+        self._remove_legacy_members(user)
+        return len(permissions)
+
+    def migrate_all_members(self) -> Dict[str, int]:
+        """
+        Runs `migrate_members` for every user whose item still has a legacy `members` map.
+
+        :return: User -> how many members' permissions were moved.
+        """
+
+        return {
+            user: self.migrate_members(user) for user in self._find_legacy_members()
+        }
+
+    @telemetry.timed("state_table.fetch_twitch_context")
+    def fetch_twitch_context(
+        self,
+        broadcaster_twitch_user_id: str,
+        chatter_twitch_user_id: Optional[str],
+        attributes: Optional[List[str]] = None,
+        consistent_read: bool = False,
+        read_state: bool = True,
+    ) -> EventContext:
+        """
+        Fetches everything needed to handle a Twitch chat event: the broadcaster's state, the chatter's identity and their permission in the channel.
+        The chatter lookup runs concurrently with the broadcaster lookup, then the state read runs concurrently with the (dependent) permission read.
+        The chatter lookup and permission read are skipped entirely if the broadcaster is the chatter (or no chatter is given).
+
+        :param broadcaster_twitch_user_id: The Twitch user ID of the channel's broadcaster.
+        :param chatter_twitch_user_id: The Twitch user ID of the user who sent the message, or None if they don't need to be looked up.
+        :param attributes: If given, only read these attributes of the broadcaster's state (see `get_state`).
+        :param consistent_read: Whether to read the broadcaster's state strongly consistently.
+        :param read_state: Whether to read the broadcaster's state at all (otherwise the broadcaster is only looked up for the chatter's permission).
+        :return: The broadcaster's lookup fields and state, the chatter's lookup fields and permission (each None if not found).
+        """
+
+        chatter_future = None
+        if chatter_twitch_user_id not in (None, broadcaster_twitch_user_id):
+            chatter_future = self.executor.submit(
+                contextvars.copy_context().run,
+                self.lookup_by_twitch,
+                chatter_twitch_user_id,
+            )
+
+        broadcaster = self.lookup_by_twitch(broadcaster_twitch_user_id)
+        state_future = None
+        if broadcaster is not None and read_state:
+            state_future = self.executor.submit(
+                contextvars.copy_context().run,
+                self.get_state,
+                broadcaster.user,
+                attributes,
+                consistent_read,
+            )
+
+        chatter = None
+        if chatter_future:
+            chatter = chatter_future.result()
+        elif chatter_twitch_user_id == broadcaster_twitch_user_id:
+            chatter = broadcaster
+
+        permission = None
+        if chatter_future and broadcaster is not None and chatter is not None:
+            permission = self.get_permission(broadcaster.user, chatter.user)
+
+        state = state_future.result() if state_future else None
+
+        return EventContext(
+            broadcaster=broadcaster,
+            state=state,
+            chatter=chatter,
+            permission=permission,
+        )
+
+    @telemetry.timed("state_table.update_state")
+    def update_state(self, state: State) -> State:
+        """
+        Updates the table with the given state, validating/incrementing the version in the table if successful.
+
+        :param state: The corresponding state to put into the table.
+        :return: The updated state, with the new version number.
+        :raises VersionConflictError: If the version in the table no longer matches the given state's.
+        """
+
+        try:
+            updated_state = self._write_state(state)
+        except VersionConflictError:
+            # The state was read through a stale lookup (i.e. a cached "not found" for a user since created elsewhere),
+            # so make sure the retry looks the user up again.
+            self._invalidate_lookups(state)
+            raise
+
+        self._invalidate_lookups(updated_state)
+        return updated_state
+
+    @telemetry.timed("state_table.increment_counter")
+    def increment_counter(
+        self,
+        state: State,
+        counter_name: str,
+        timestamp: datetime,
+        dedup_window_s: int,
+    ) -> Optional[State]:
+        """
+        Atomically increments one of the user's counters, writing only that counter (+ the version) instead of the whole item.
+        The dedup window is enforced against what's actually in the table.
+
+        :param state: The last read state of the user, only used to check whether the counter exists yet.
+        :param counter_name: The counter attribute to increment (i.e. "deaths" or "crimes").
+        :param timestamp: When the increment happened.
+        :param dedup_window_s: Reject the increment if the counter was last incremented within this many seconds.
+        :return: The updated state, or None if the increment was rejected by the dedup window.
+        """
+
+        updated_state = self._increment_counter(
+            state,
+            counter_name,
+            timestamp,
+            dedup_window_s,
+        )
+        if updated_state is None:
+            # Rejected, possibly because the state was read through a stale lookup.
+            self._invalidate_lookups(state)
+        elif getattr(state, counter_name) is None:
+            # The item may have just been created.
+            self._invalidate_lookups(updated_state)
+
+        return updated_state
+
+    @telemetry.timed("state_table.claim_event")
+    def claim_event(self, event_id: str, ttl_s: int) -> bool:
+        """
+        Claims an event by putting a marker for it, which expires after the given TTL.
+
+        :param event_id: The unique ID of the event.
+        :param ttl_s: How long to hold the claim for.
+        :return: Whether the event was claimed (False if it already had been).
+        """
+
+        return self._claim_event(event_id, ttl_s)
+
+    @telemetry.timed("state_table.release_event")
+    def release_event(self, event_id: str):
+        """
+        Releases the claim on an event, by deleting its marker.
+        """
+
+        self._release_event(event_id)
+
+    @telemetry.timed("state_table.acquire_lease")
+    def acquire_lease(self, key: str, owner: str, lease_s: int) -> bool:
+        """
+        Acquires an exclusive lease on the given key (i.e. a broadcaster).
+        A lease that's expired (i.e. its holder crashed) can be taken over, and the current holder can renew its own.
+
+        :param key: What to lease.
+        :param owner: A unique ID for who is acquiring the lease.
+        :param lease_s: How long to hold the lease for (unless it's released before then).
+        :return: Whether the lease was acquired (False if somebody else holds it).
+        """
+
+        return self._acquire_lease(key, owner, lease_s)
+
+    @telemetry.timed("state_table.release_lease")
+    def release_lease(self, key: str, owner: str):
+        """
+        Releases a lease on the given key, if it's still held by the given owner (it may have expired and been taken over).
+        """
+
+        self._release_lease(key, owner)
+
+
+class DynamoDBStateTableInterface(StateTableInterface):
+    """
+    State table stored in DynamoDB, with a GSI per lookup key (and marker items expired by the table's TTL).
+    """
+
     ATTRIBUTE_KEYS = [
         l1 + l2 for l1 in string.ascii_lowercase for l2 in string.ascii_lowercase
     ]
+    LOOKUP_INDEXES = {
+        "twitch_user_id": "twitch-lookup-index",
+        "discord_user_id": "discord-lookup-index",
+        "github_user_id": "github-lookup-index",
+    }
+
+    # DynamoDB's limit on items per BatchWriteItem.
+    BATCH_WRITE_SIZE = 25
+    BATCH_WRITE_RETRIES = 5
+    BATCH_WRITE_BACKOFF_BASE_S = 0.05
 
     def __init__(self, dynamodb_client, table_name: str):
+        super().__init__()
         self.dynamodb_client = dynamodb_client
         self.table_name = table_name
 
@@ -79,55 +555,43 @@ class StateTableInterface:
         response = self.dynamodb_client.query(**query_args)
         return [ddb_to_dict(item) for item in response["Items"]]
 
-    def _lookup(self, index_name: str, key: str, value: str) -> Optional[LookupFields]:
-        """
-        Helper to query a state table lookup index, to get the corresponding user primary key + IDs for a given platform user ID.
-        """
-
-        users = self._query(key, value, index_name=index_name)
-        if len(users) == 0:
-            return None
-
-        return LookupFields.model_validate(users[0])
-
-    def lookup_by_twitch(self, twitch_user_id: str) -> Optional[LookupFields]:
-        """
-        Looks up a user by a Twitch user ID.
-        """
-
-        return self._lookup("twitch-lookup-index", "twitch_user_id", twitch_user_id)
-
-    def lookup_by_discord(self, discord_user_id: str) -> Optional[LookupFields]:
+    def _find_user(self, key: str, value: str) -> Optional[LookupFields]:
         """
-        Looks up a user by a Discord user ID.
+        Queries the lookup index for the given platform user ID.
         """
 
-        return self._lookup("discord-lookup-index", "discord_user_id", discord_user_id)
+        users = self._query(key, value, index_name=self.LOOKUP_INDEXES[key])
+        return LookupFields.model_validate(users[0]) if len(users) > 0 else None
 
-    def lookup_by_github(self, github_user_id: str) -> Optional[LookupFields]:
-        """
-        Looks up a user by a Discord user ID.
-        """
-
-        return self._lookup("github-lookup-index", "github_user_id", github_user_id)
-
-    def get_state(self, user: str) -> Optional[State]:
+    def _read_state(
+        self,
+        user: str,
+        attributes: Optional[List[str]],
+        consistent_read: bool,
+    ) -> Optional[State]:
         """
-        Queries for the state of a given user.
-
-        :param user: The primary key/user to query the state table on.
-        :return: A State object representing what's in the table.
+        Reads the item directly by its key, projected to the given attributes (so unneeded ones don't use read capacity).
         """
 
-        states = self._query("user", user)
-        return State.model_validate(states[0]) if len(states) > 0 else None
-
-    def update_state(self, state: State):
+        get_args = {
+            "TableName": self.table_name,
+            "Key": {"user": {"S": user}},
+            "ConsistentRead": consistent_read,
+        }
+        if attributes is not None:
+            attribute_names = {
+                "#" + k: n for k, n in zip(self.ATTRIBUTE_KEYS, attributes)
+            }
+            get_args["ProjectionExpression"] = ", ".join(attribute_names)
+            get_args["ExpressionAttributeNames"] = attribute_names
+
+        response = self.dynamodb_client.get_item(**get_args)
+        item = response.get("Item")
+        return State.model_validate(ddb_to_dict(item)) if item is not None else None
+
+    def _write_state(self, state: State) -> State:
         """
-        Updates the table with the given state, validating/incrementing the version in the table if successful.
-
-        :param state: The corresponding state to put into the table.
-        :return: The updated state, with the new version number.
+        Updates the whole item, conditioned on (and incrementing) its version.
         """
 
         item = dict_to_ddb(state.model_dump(exclude_none=True))
@@ -156,14 +620,299 @@ class StateTableInterface:
 
         update_expression = "SET " + ", ".join(update_expressions)
 
-        response = self.dynamodb_client.update_item(
+        try:
+            response = self.dynamodb_client.update_item(
+                TableName=self.table_name,
+                Key={"user": item["user"]},
+                ExpressionAttributeNames=attribute_names,
+                ExpressionAttributeValues=attribute_values,
+                UpdateExpression=update_expression,
+                ConditionExpression=condition_expression,
+                ReturnValues="ALL_NEW",
+            )
+        except ClientError as e:
+            if is_conditional_check_failure(e):
+                # Somebody else wrote a newer version since this state was read.
+                raise VersionConflictError(state.user) from e
+
+            raise
+
+        updated_item = ddb_to_dict(response["Attributes"])
+        return State.model_validate(updated_item)
+
+    def _read_permission(self, user: str, member: str) -> Optional[Permission]:
+        """
+        Reads the member's permission item directly by its key.
+        """
+
+        response = self.dynamodb_client.get_item(
             TableName=self.table_name,
-            Key={"user": item["user"]},
-            ExpressionAttributeNames=attribute_names,
-            ExpressionAttributeValues=attribute_values,
-            UpdateExpression=update_expression,
-            ConditionExpression=condition_expression,
-            ReturnValues="ALL_NEW",
+            Key={"user": {"S": self._member_key(user, member)}},
+            ProjectionExpression="#p",
+            ExpressionAttributeNames={"#p": "permission"},
+        )
+        item = response.get("Item")
+        return Permission(item["permission"]["S"]) if item is not None else None
+
+    def _batch_write(self, requests: List[dict]):
+        """
+        Helper to write items in batches (as many as DynamoDB allows per request), retrying unprocessed ones with backoff.
+
+        :raises UnprocessedItemsError: If some items still weren't processed after all the retries.
+        """
+
+        for i in range(0, len(requests), self.BATCH_WRITE_SIZE):
+            unprocessed = {self.table_name: requests[i : i + self.BATCH_WRITE_SIZE]}
+            for attempt in range(self.BATCH_WRITE_RETRIES + 1):
+                if attempt > 0:
+                    time.sleep(self.BATCH_WRITE_BACKOFF_BASE_S * 2 ** (attempt - 1))
+
+                response = self.dynamodb_client.batch_write_item(
+                    RequestItems=unprocessed
+                )
+                unprocessed = response.get("UnprocessedItems")
+                if not unprocessed:
+                    break
+            else:
+                raise UnprocessedItemsError(len(unprocessed[self.table_name]))
+
+    def _write_permissions(self, user: str, permissions: Dict[str, Permission]):
+        """
+        Puts an item per member.
+        """
+
+        self._batch_write(
+            [
+                {
+                    "PutRequest": {
+                        "Item": {
+                            "user": {"S": self._member_key(user, member)},
+                            "permission": {"S": permission.value},
+                        }
+                    }
+                }
+                for member, permission in permissions.items()
+            ]
         )
+
+    def _delete_permissions(self, user: str, members: List[str]):
+        """
+        Deletes each member's item (once, since DynamoDB rejects a batch with two requests for the same key).
+        """
+
+        self._batch_write(
+            [
+                {
+                    "DeleteRequest": {
+                        "Key": {"user": {"S": self._member_key(user, member)}}
+                    }
+                }
+                for member in dict.fromkeys(members)
+            ]
+        )
+
+    def _find_legacy_members(self) -> Iterator[str]:
+        """
+        Scans the whole table (page by page) for items with a `members` map.
+        """
+
+        scan_args = {
+            "TableName": self.table_name,
+            "FilterExpression": "attribute_exists(#m)",
+            "ProjectionExpression": "#u",
+            "ExpressionAttributeNames": {"#m": "members", "#u": "user"},
+        }
+        while True:
+            response = self.dynamodb_client.scan(**scan_args)
+            for item in response["Items"]:
+                yield item["user"]["S"]
+
+            if "LastEvaluatedKey" not in response:
+                return
+
+            scan_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def _read_legacy_members(self, user: str) -> Dict[str, Permission]:
+        """
+        Reads only the item's `members` map.
+        """
+
+        response = self.dynamodb_client.get_item(
+            TableName=self.table_name,
+            Key={"user": {"S": user}},
+            ProjectionExpression="#m",
+            ExpressionAttributeNames={"#m": "members"},
+            ConsistentRead=True,
+        )
+        members = ddb_to_dict(response.get("Item", {})).get("members", {})
+        return {
+            member: Permission(permission) for member, permission in members.items()
+        }
+
+    def _remove_legacy_members(self, user: str):
+        """
+        Removes the item's `members` map (without touching its version, since the state itself is unchanged).
+        """
+
+        try:
+            self.dynamodb_client.update_item(
+                TableName=self.table_name,
+                Key={"user": {"S": user}},
+                UpdateExpression="REMOVE #m",
+                ConditionExpression="attribute_exists(#m)",
+                ExpressionAttributeNames={"#m": "members"},
+            )
+        except ClientError as e:
+            if not is_conditional_check_failure(e):
+                raise
+
+    def _increment_counter(
+        self,
+        state: State,
+        counter_name: str,
+        timestamp: datetime,
+        dedup_window_s: int,
+    ) -> Optional[State]:
+        """
+        Writes only the counter (+ the version) with SET/ADD arithmetic, enforcing the dedup window with the condition expression.
+        """
+
+        attribute_names = {"#c": counter_name, "#v": "version"}
+        attribute_values = {":one": {"N": "1"}}
+        is_new_counter = getattr(state, counter_name) is None
+        if not is_new_counter:
+            # Bump the existing counter in place (nested paths can't be ADDed to, so use SET arithmetic instead).
+            cutoff = timestamp - timedelta(seconds=dedup_window_s)
+            attribute_names.update({"#n": "count", "#t": "last_timestamp"})
+            attribute_values.update(
+                {
+                    ":t": {"S": to_iso_utc(timestamp)},
+                    ":cutoff": {"S": to_iso_utc(cutoff)},
+                }
+            )
+            update_expression = "SET #c.#n = #c.#n + :one, #c.#t = :t ADD #v :one"
+            condition_expression = "#c.#t < :cutoff"
+        else:
+            # Start the counter, unless somebody else did in the meantime (and fill in the lookup fields for a new item).
+            counter = CounterState(count=1, last_timestamp=timestamp)
+            attribute_values[":c"] = dict_to_ddb({"c": counter.model_dump()})["c"]
+            update_expressions = ["#c = :c"]
+            lookup_fields = state.model_dump(
+                include=set(self.LOOKUP_KEYS), exclude_none=True
+            )
+            for k, (n, v) in zip(
+                self.ATTRIBUTE_KEYS, dict_to_ddb(lookup_fields).items()
+            ):
+                attribute_names["#" + k] = n
+                attribute_values[":" + k] = v
+                update_expressions.append(f"#{k} = if_not_exists(#{k}, :{k})")
+
+            update_expression = "SET " + ", ".join(update_expressions) + " ADD #v :one"
+            condition_expression = "attribute_not_exists(#c)"
+
+        try:
+            response = self.dynamodb_client.update_item(
+                TableName=self.table_name,
+                Key={"user": {"S": state.user}},
+                ExpressionAttributeNames=attribute_names,
+                ExpressionAttributeValues=attribute_values,
+                UpdateExpression=update_expression,
+                ConditionExpression=condition_expression,
+                ReturnValues="ALL_NEW",
+            )
+        except ClientError as e:
+            if is_conditional_check_failure(e):
+                return None
+
+            raise
+
         updated_item = ddb_to_dict(response["Attributes"])
         return State.model_validate(updated_item)
+
+    def _claim_event(self, event_id: str, ttl_s: int) -> bool:
+        """
+        Conditionally puts a marker item for the event, which expires via the table's TTL.
+        """
+
+        now = int(time.time())
+        try:
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "user": {"S": self.EVENT_KEY_PREFIX + event_id},
+                    "expires_at": {"N": str(now + ttl_s)},
+                },
+                ExpressionAttributeNames={"#pk": "user", "#exp": "expires_at"},
+                ExpressionAttributeValues={":now": {"N": str(now)}},
+                # TTL deletion can lag behind, so also allow re-claiming markers that have expired.
+                ConditionExpression="attribute_not_exists(#pk) OR #exp < :now",
+            )
+        except ClientError as e:
+            if is_conditional_check_failure(e):
+                return False
+
+            raise
+
+        return True
+
+    def _release_event(self, event_id: str):
+        """
+        Deletes the event's marker item.
+        """
+
+        self.dynamodb_client.delete_item(
+            TableName=self.table_name,
+            Key={"user": {"S": self.EVENT_KEY_PREFIX + event_id}},
+        )
+
+    def _acquire_lease(self, key: str, owner: str, lease_s: int) -> bool:
+        """
+        Conditionally puts a lease item for the key, which can be taken over once expired, or renewed by its owner.
+        """
+
+        now = time.time()
+        try:
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "user": {"S": self.LEASE_KEY_PREFIX + key},
+                    "owner": {"S": owner},
+                    "lease_expires_at": {"N": str(now + lease_s)},
+                    # For the table's TTL to clean up leases that were never released.
+                    "expires_at": {"N": str(int(now) + lease_s)},
+                },
+                ExpressionAttributeNames={
+                    "#pk": "user",
+                    "#o": "owner",
+                    "#exp": "lease_expires_at",
+                },
+                ExpressionAttributeValues={
+                    ":owner": {"S": owner},
+                    ":now": {"N": str(now)},
+                },
+                ConditionExpression="attribute_not_exists(#pk) OR #exp < :now OR #o = :owner",
+            )
+        except ClientError as e:
+            if is_conditional_check_failure(e):
+                return False
+
+            raise
+
+        return True
+
+    def _release_lease(self, key: str, owner: str):
+        """
+        Deletes the lease item, conditioned on it still being held by the given owner.
+        """
+
+        try:
+            self.dynamodb_client.delete_item(
+                TableName=self.table_name,
+                Key={"user": {"S": self.LEASE_KEY_PREFIX + key}},
+                ExpressionAttributeNames={"#o": "owner"},
+                ExpressionAttributeValues={":owner": {"S": owner}},
+                ConditionExpression="#o = :owner",
+            )
+        except ClientError as e:
+            if not is_conditional_check_failure(e):
+                raise
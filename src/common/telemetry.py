@@ -0,0 +1,151 @@
+from aws_lambda_powertools.metrics import (
+    EphemeralMetrics,
+    MetricUnit,
+)
+from pydantic import BaseModel
+
+from contextlib import contextmanager
+import contextvars
+import functools
+import json
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Tuple,
+)
+
+
+class Span(BaseModel):
+    stage: str
+    duration_ms: float
+    dimensions: Dict[str, str] = {}
+
+
+# Dimensions for the spans recorded in the current context (i.e. the event type, the command being executed).
+_dimensions = contextvars.ContextVar("telemetry_dimensions", default={})
+
+
+class Telemetry:
+    """
+    Times the stages of handling an event, and emits them as CloudWatch embedded metric format (EMF) metrics.
+    Spans are collected in-process until `flush`, with one EMF blob per set of dimensions (so that they can be inspected in tests).
+    """
+
+    def __init__(self, namespace: str, service: str):
+        self.namespace = namespace
+        self.service = service
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def dimensions(self, **dimensions: str) -> Iterator[None]:
+        """
+        Add dimensions to every span recorded within the block (including nested ones).
+        """
+
+        token = _dimensions.set({**_dimensions.get(), **dimensions})
+        try:
+            yield
+        finally:
+            _dimensions.reset(token)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """
+        Time the block as the given stage (whether or not it raises).
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            span = Span(
+                stage=stage, duration_ms=duration_ms, dimensions=_dimensions.get()
+            )
+            with self._lock:
+                self.spans.append(span)
+
+    def timed(self, stage: str) -> Callable:
+        """
+        Decorator version of `span`, timing each call of the function as the given stage.
+        """
+
+        def decorator(fn: Callable) -> Callable:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def collect(self) -> List[Span]:
+        """
+        Take the spans recorded so far (clearing them).
+        """
+
+        with self._lock:
+            spans, self.spans = self.spans, []
+
+        return spans
+
+    def serialize(self, spans: List[Span]) -> List[Dict[str, Any]]:
+        """
+        Build the EMF blobs for the given spans: one per set of dimensions, with a metric (in milliseconds) per stage.
+        """
+
+        groups: Dict[Tuple[Tuple[str, str], ...], EphemeralMetrics] = {}
+        for span in spans:
+            key = tuple(sorted(span.dimensions.items()))
+            emf = groups.get(key)
+            if emf is None:
+                emf = EphemeralMetrics(namespace=self.namespace, service=self.service)
+                for name, value in key:
+                    emf.add_dimension(name=name, value=value)
+
+                groups[key] = emf
+
+            emf.add_metric(
+                name=span.stage,
+                unit=MetricUnit.Milliseconds,
+                value=span.duration_ms,
+            )
+
+        return [emf.serialize_metric_set() for emf in groups.values()]
+
+    def flush(self) -> List[Span]:
+        """
+        Emit the spans recorded so far as EMF metrics (printed to stdout, where CloudWatch picks them up), clearing them.
+
+        :return: The flushed spans.
+        """
+
+        spans = self.collect()
+        for blob in self.serialize(spans):
+            print(json.dumps(blob, separators=(",", ":")))
+
+        return spans
+
+    def log_spans(self, handler: Callable) -> Callable:
+        """
+        Decorator for Lambda handlers, flushing the spans recorded by each invocation once it's done.
+        """
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                self.flush()
+
+        return wrapper
+
+
+telemetry = Telemetry(namespace="bryti", service="bryti")
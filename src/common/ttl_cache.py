@@ -0,0 +1,108 @@
+from collections import OrderedDict
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Optional,
+)
+
+
+class TTLCache:
+    """
+    A bounded, thread-safe LRU cache whose entries also expire after a time-to-live (fixed, unless given per entry).
+    Meant to be kept as a global/cold start variable, so that it survives across warm invocations.
+    """
+
+    def __init__(self, max_size: int, ttl_s: float):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get the cached value for the given key, marking it as recently used.
+
+        :param key: The key to look up.
+        :param default: What to return if the key isn't cached (or has expired).
+        :return: The cached value, otherwise the default.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl_s: Optional[float] = None):
+        """
+        Cache a value for the given key, evicting the least recently used entries if over capacity.
+
+        :param ttl_s: How long this entry lives, if not the cache's default TTL.
+        """
+
+        if ttl_s is None:
+            ttl_s = self.ttl_s
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl_s, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """
+        Drop the given key from the cache (if present).
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_if(self, predicate: Callable[[Hashable, Any], bool]):
+        """
+        Drop every entry whose key/value pair matches the given predicate.
+        """
+
+        with self._lock:
+            for key in [k for k, (_, v) in self._entries.items() if predicate(k, v)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters for how effective the cache has been (since it was created).
+        """
+
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,270 @@
+from pydantic import BaseModel
+
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from collections import (
+    OrderedDict,
+    deque,
+)
+import itertools
+import sqlite3
+import threading
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+)
+
+from src.common.startup import (
+    deferred,
+    lazy_import,
+)
+
+boto3 = lazy_import("boto3")
+
+
+class WorkItem(BaseModel):
+    id: str
+    payload: str
+    receipt: Optional[str] = None
+
+
+class AbstractWorkQueue(ABC):
+    """
+    A queue of work to be done outside of the request that produced it.
+    Dequeued items are held in-flight until they're either acknowledged (done) or released (to be retried).
+    """
+
+    @abstractmethod
+    def enqueue(self, payload: str, key: Optional[str] = None) -> str:
+        """
+        Add work to the back of the queue.
+
+        :param payload: The (serialized) work to be done.
+        :param key: What the work is for (i.e. a broadcaster), where work for the same key must be done in order.
+        :return: The ID of the new work item.
+        """
+        pass
+
+    @abstractmethod
+    def dequeue(self, max_items: int = 10) -> List[WorkItem]:
+        """
+        Take work from the front of the queue, marking it as in-flight.
+
+        :param max_items: The most items to take at once.
+        :return: The taken work items, in the order they were enqueued.
+        """
+        pass
+
+    @abstractmethod
+    def ack(self, item: WorkItem):
+        """
+        Mark an in-flight work item as done, removing it from the queue.
+        """
+        pass
+
+    @abstractmethod
+    def release(self, item: WorkItem):
+        """
+        Put an in-flight work item back at the front of the queue (i.e. if it failed), so that it's retried.
+        """
+        pass
+
+
+class InMemoryWorkQueue(AbstractWorkQueue):
+    """
+    Work queue held in the process' memory (i.e. for tests, or running everything in a single process).
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._pending = deque()
+        self._in_flight = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._in_flight)
+
+    def enqueue(self, payload: str, key: Optional[str] = None) -> str:
+        with self._lock:
+            item = WorkItem(id=str(next(self._ids)), payload=payload)
+            self._pending.append(item)
+            return item.id
+
+    def dequeue(self, max_items: int = 10) -> List[WorkItem]:
+        with self._lock:
+            items = []
+            while self._pending and len(items) < max_items:
+                item = self._pending.popleft()
+                self._in_flight[item.id] = item
+                items.append(item)
+
+            return items
+
+    def ack(self, item: WorkItem):
+        with self._lock:
+            self._in_flight.pop(item.id, None)
+
+    def release(self, item: WorkItem):
+        with self._lock:
+            if self._in_flight.pop(item.id, None) is not None:
+                self._pending.appendleft(item)
+
+
+class SQLiteWorkQueue(AbstractWorkQueue):
+    """
+    Work queue persisted in a local SQLite file (i.e. for local testing across processes, like a separate worker).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS work_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    in_flight INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._connection.execute(
+                "SELECT COUNT(*) FROM work_items"
+            ).fetchone()
+            return count
+
+    def enqueue(self, payload: str, key: Optional[str] = None) -> str:
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO work_items (payload) VALUES (?)",
+                (payload,),
+            )
+            return str(cursor.lastrowid)
+
+    def dequeue(self, max_items: int = 10) -> List[WorkItem]:
+        with self._lock, self._connection:
+            rows = self._connection.execute(
+                "SELECT id, payload FROM work_items WHERE in_flight = 0 ORDER BY id LIMIT ?",
+                (max_items,),
+            ).fetchall()
+            self._connection.executemany(
+                "UPDATE work_items SET in_flight = 1 WHERE id = ?",
+                [(row_id,) for row_id, _ in rows],
+            )
+
+        return [WorkItem(id=str(row_id), payload=payload) for row_id, payload in rows]
+
+    def ack(self, item: WorkItem):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM work_items WHERE id = ?",
+                (int(item.id),),
+            )
+
+    def release(self, item: WorkItem):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE work_items SET in_flight = 0 WHERE id = ?",
+                (int(item.id),),
+            )
+
+
+class SQSWorkQueue(AbstractWorkQueue):
+    """
+    Work queue backed by SQS (where the worker is normally triggered by SQS itself, see `as_sqs_event`).
+    For a FIFO queue, each key is its own message group: SQS then hands out a key's work in order, one batch at a time,
+    while different keys' work is handed out in parallel.
+    """
+
+    def __init__(self, sqs_client, queue_url: str):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.is_fifo = queue_url.endswith(".fifo")
+
+    def enqueue(self, payload: str, key: Optional[str] = None) -> str:
+        kwargs = {}
+        if self.is_fifo:
+            # Deduplication is content-based (configured on the queue).
+            kwargs["MessageGroupId"] = key or "default"
+
+        response = self.sqs_client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=payload,
+            **kwargs,
+        )
+        return response["MessageId"]
+
+    def dequeue(self, max_items: int = 10) -> List[WorkItem]:
+        response = self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=min(max_items, 10),
+        )
+        return [
+            WorkItem(
+                id=message["MessageId"],
+                payload=message["Body"],
+                receipt=message["ReceiptHandle"],
+            )
+            for message in response.get("Messages", [])
+        ]
+
+    def ack(self, item: WorkItem):
+        self.sqs_client.delete_message(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=item.receipt,
+        )
+
+    def release(self, item: WorkItem):
+        self.sqs_client.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=item.receipt,
+            VisibilityTimeout=0,
+        )
+
+
+def as_sqs_event(items: List[WorkItem]) -> Dict[str, Any]:
+    """
+    Shape dequeued work items like the event SQS triggers a Lambda with (i.e. to locally stand in for SQS).
+    """
+
+    return {
+        "Records": [
+            {
+                "messageId": item.id,
+                "receiptHandle": item.receipt or item.id,
+                "body": item.payload,
+                "eventSource": "aws:sqs",
+            }
+            for item in items
+        ]
+    }
+
+
+def build_work_queue(spec: Optional[str]) -> Optional[AbstractWorkQueue]:
+    """
+    Build a work queue from its configured spec:
+    - None/empty: no queue (work is done synchronously instead),
+    - "memory": an in-memory queue,
+    - "sqlite:<path>": a SQLite queue stored at the given path,
+    - "sqs:<queue URL>": an SQS queue.
+    """
+
+    if not spec:
+        return None
+    elif spec == "memory":
+        return InMemoryWorkQueue()
+    elif spec.startswith("sqlite:"):
+        return SQLiteWorkQueue(spec.removeprefix("sqlite:"))
+    elif spec.startswith("sqs:"):
+        sqs_client = deferred("sqs_client", lambda: boto3.client("sqs"))
+        return SQSWorkQueue(sqs_client, spec.removeprefix("sqs:"))
+
+    raise ValueError(f"Unknown work queue: {spec}")
@@ -10,6 +10,10 @@ ENV_VAR_KEYS = [
     "TWITCH_CLIENT_SECRET",
     "TWITCH_USER_ID",
     "GITHUB_ASSIGNEE_IDS",
+    "WORK_QUEUE",
+    "STATE_TABLE",
+    "STARTUP",
+    "LOG_DEBUG_BROADCASTER",
 ]
 ENV_VARS_FILEPATH = "env.json"
 
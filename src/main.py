@@ -4,18 +4,26 @@ from aws_lambda_powertools.event_handler import (
     content_types,
 )
 from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.metrics import Metrics
 from aws_lambda_powertools.utilities.typing import LambdaContext
-import boto3
 from pydantic import ValidationError
 
 from http import HTTPStatus
 from typing import (
     Any,
+    Callable,
     Dict,
 )
 
 from src.common.api_interfaces import APIInterfaces
-from src.common.state_table_interface import StateTableInterface
+from src.common.log_policy import log_policy
+from src.common.startup import (
+    preload,
+    startup,
+)
+from src.common.state_table_backends import build_state_table_interface
+from src.common.telemetry import telemetry
+from src.common.work_queue import build_work_queue
 from src.config import load_env_vars
 from src.twitch.interface import TwitchInterface
 from src.twitch.models import TwitchHeaders
@@ -28,6 +36,7 @@ from src.twitch.service import (
 # --- Global/cold start variables ---
 
 logger = Logger(service="bryti")
+metrics = Metrics(namespace="bryti", service="bryti")
 app = APIGatewayHttpResolver()
 
 env_vars = load_env_vars()
@@ -35,27 +44,43 @@ ENV = env_vars["ENV"]
 STATE_TABLE_NAME = f"bryti-{ENV}-state"
 COMMAND_PREFIX = "bryti" if ENV == "prod" else f"bryti-{ENV}"
 
-dynamodb_client = boto3.client("dynamodb")
-state_table_interface = StateTableInterface(
-    dynamodb_client,
-    STATE_TABLE_NAME,
-)
-twitch_interface = TwitchInterface(
-    env_vars["TWITCH_CLIENT_ID"],
-    env_vars["TWITCH_CLIENT_SECRET"],
-)
-api_interfaces = APIInterfaces(
-    state_table_interface,
-    twitch_interface,
-)
+# If configured, everything for this broadcaster is logged, with full payloads (otherwise info logs are sampled and cut down).
+log_policy.debug_broadcaster_user_id = env_vars["LOG_DEBUG_BROADCASTER"]
 
-# TODO: construct Discord interface and pass to services.
-twitch_service = TwitchService(
-    api_interfaces,
-    env_vars["TWITCH_USER_ID"],
-    COMMAND_PREFIX,
-    env_vars["GITHUB_ASSIGNEE_IDS"],
-)
+with startup.timed("init:interfaces"):
+    # Defaults to the DynamoDB table, but can be configured to be stored locally instead (i.e. for self-hosting).
+    state_table_interface = build_state_table_interface(
+        env_vars["STATE_TABLE"],
+        STATE_TABLE_NAME,
+    )
+    twitch_interface = TwitchInterface(
+        env_vars["TWITCH_CLIENT_ID"],
+        env_vars["TWITCH_CLIENT_SECRET"],
+    )
+    api_interfaces = APIInterfaces(
+        state_table_interface,
+        twitch_interface,
+    )
+
+    # If configured, notifications are acknowledged right away and processed by `worker_handler` instead.
+    work_queue = build_work_queue(env_vars["WORK_QUEUE"])
+
+with startup.timed("init:twitch_service"):
+    # TODO: construct Discord interface and pass to services.
+    twitch_service = TwitchService(
+        api_interfaces,
+        env_vars["TWITCH_USER_ID"],
+        COMMAND_PREFIX,
+        env_vars["GITHUB_ASSIGNEE_IDS"],
+        work_queue=work_queue,
+    )
+
+# Heavy imports, clients and rarely used models are deferred until their first use by default,
+# but can be paid for during init instead (i.e. with provisioned concurrency, where init happens ahead of any request).
+if env_vars["STARTUP"] == "eager":
+    preload()
+
+startup.mark_ready()
 
 
 # --- Main logic ---
@@ -65,19 +90,49 @@ class UnknownEventSourceError(Exception):
     pass
 
 
-@app.post("/bryti")
-def bryti_handler() -> Response:
-    # Determine event source by request headers.
+"""
+Registry of event sources, keyed by a header that only that source's requests have.
+Each source's handler validates its own headers (and raises UnknownEventSourceError if they're invalid).
+"""
+EVENT_SOURCES: Dict[str, Callable[[Dict[str, str], str], Response]] = {}
+
+
+def event_source(header: str) -> Callable:
+    """
+    Register a handler for requests with the given (lowercase) header.
+    """
+
+    def register(
+        handler: Callable[[Dict[str, str], str], Response],
+    ) -> Callable[[Dict[str, str], str], Response]:
+        EVENT_SOURCES[header] = handler
+        return handler
+
+    return register
+
+
+@event_source("twitch-eventsub-message-id")
+def twitch_event_handler(headers: Dict[str, str], body: str) -> Response:
     try:
-        twitch_headers = TwitchHeaders.model_validate(app.current_event.headers)
-        return twitch_service.handle_event(
-            twitch_headers,
-            app.current_event.decoded_body,
-        )
-    except ValidationError:
-        pass
+        with telemetry.span("parse_headers"):
+            twitch_headers = TwitchHeaders.model_validate(headers)
+    except ValidationError as e:
+        raise UnknownEventSourceError from e
+
+    return twitch_service.handle_event(twitch_headers, body)
+
 
-    # TODO: implement Discord service.
+# TODO: implement Discord service.
+
+
+@app.post("/bryti")
+def bryti_handler() -> Response:
+    # Determine event source by request headers (one dict lookup per header, however many sources there are).
+    headers = app.current_event.headers
+    for header in headers:
+        handler = EVENT_SOURCES.get(header)
+        if handler is not None:
+            return handler(headers, app.current_event.decoded_body)
 
     # If no matching event source found, raise an error.
     raise UnknownEventSourceError
@@ -104,8 +159,48 @@ def on_signature_mismatch(e: TwitchSignatureMismatchError) -> Response:
 
 
 @logger.inject_lambda_context()
+@metrics.log_metrics()
+@startup.log_report
+@telemetry.log_spans
+@log_policy.invocation
 def lambda_handler(event: Dict[str, Any], context: LambdaContext):
-    logger.info("Lambda triggered", event=event, context=context)
     response = app.resolve(event, context)
-    logger.info("Returning response", response=response)
+    # A single line per request, cut down to IDs and the status code (and only rendered if sampled).
+    log_policy.info(
+        "Handled request",
+        event=log_policy.payload(event),
+        response=log_policy.payload(response),
+        twitch_connections=twitch_interface.get_connection_stats,
+        lookup_cache=state_table_interface.lookup_cache.stats,
+    )
     return response
+
+
+@logger.inject_lambda_context()
+@metrics.log_metrics()
+@startup.log_report
+@telemetry.log_spans
+@log_policy.invocation
+def worker_handler(event: Dict[str, Any], context: LambdaContext):
+    processed = twitch_service.drain_work_queue()
+    logger.info("Drained work queue", processed=processed)
+    return {"processed": processed}
+
+
+@logger.inject_lambda_context()
+@metrics.log_metrics()
+@startup.log_report
+@telemetry.log_spans
+@log_policy.invocation
+def batch_handler(event: Dict[str, Any], context: LambdaContext):
+    failed_message_ids = twitch_service.handle_batch(event["Records"])
+    logger.info(
+        "Handled batch",
+        records=len(event["Records"]),
+        failed_message_ids=failed_message_ids,
+    )
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": message_id} for message_id in failed_message_ids
+        ],
+    }
@@ -1,12 +1,12 @@
-import requests
-from requests import RequestException
 from pydantic import (
     BaseModel,
-    TypeAdapter,
     ValidationError,
 )
 
+import functools
+from http import HTTPStatus
 from json import JSONDecodeError
+import time
 from typing import (
     Any,
     Dict,
@@ -16,36 +16,139 @@ from typing import (
     Optional,
 )
 
+from src.common.startup import (
+    lazy_import,
+    preloader,
+)
+from src.common.telemetry import telemetry
 from src.twitch.models import (
     TwitchEventSubscription,
     TwitchEventSubscriptionCondition,
     TwitchEventSubscriptionTransport,
+    TwitchResponse,
 )
 
+# Most events never call Twitch (i.e. chat messages that aren't commands), so requests is only imported once they do.
+requests = lazy_import("requests")
+requests_adapters = lazy_import("requests.adapters")
+urllib3_retry = lazy_import("urllib3.util.retry")
+
 
 class TwitchError(Exception):
     pass
 
 
+class TwitchUnauthorizedError(TwitchError):
+    pass
+
+
 T = TypeVar("T", bound=BaseModel)
 
 
+"""
+Registry of response models by the type of their `data`, each built once (instead of once per request).
+"""
+RESPONSE_MODELS: Dict[Any, Type[TwitchResponse]] = {}
+
+
+def get_response_model(DataType: Type[T]) -> Type[TwitchResponse[T]]:
+    """
+    Get (or build + register) the response model for the given data type.
+    """
+    ResponseModel = RESPONSE_MODELS.get(DataType)
+    if ResponseModel is None:
+        ResponseModel = RESPONSE_MODELS[DataType] = TwitchResponse[DataType]
+
+    return ResponseModel
+
+
+@preloader("twitch_response_models")
+def build_response_models():
+    """
+    Build the models for known response types (otherwise built on first use).
+    """
+    get_response_model(List[TwitchEventSubscription])
+
+
 class TwitchInterface:
     BASE_URL = "https://api.twitch.tv/helix"
 
+    # Refresh the app token this long before Twitch says it expires.
+    TOKEN_REFRESH_MARGIN_S = 300
+
+    # Defaults for the pooled HTTP session.
+    POOL_SIZE = 4
+    CONNECT_TIMEOUT_S = 3.05
+    READ_TIMEOUT_S = 5
+    MAX_RETRIES = 2
+    RETRY_BACKOFF_FACTOR = 0.2
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
     def __init__(
         self,
         client_id: str,
         client_secret: str,
         bearer_token: Optional[str] = None,
+        pool_size: int = POOL_SIZE,
+        connect_timeout_s: float = CONNECT_TIMEOUT_S,
+        read_timeout_s: float = READ_TIMEOUT_S,
+        max_retries: int = MAX_RETRIES,
     ):
         self.client_id = client_id
         self.client_secret = client_secret
-        if not bearer_token:
-            bearer_token = self.get_client_credentials_token()
+        self.timeout = (connect_timeout_s, read_timeout_s)
+        self.pool_size = pool_size
+        self.max_retries = max_retries
 
-        self.bearer_token = bearer_token
-        self.validate_token()
+        # The token is fetched lazily on first Helix use (see `bearer_token`), so that cold starts don't pay for it.
+        self._bearer_token = bearer_token
+        self._token_expires_at = None
+
+    @functools.cached_property
+    def adapter(self):
+        """
+        The pooled connections, created on first use (so that events that never call Twitch don't pay for them).
+        """
+        return requests_adapters.HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=urllib3_retry.Retry(
+                total=self.max_retries,
+                backoff_factor=self.RETRY_BACKOFF_FACTOR,
+                status_forcelist=self.RETRY_STATUSES,
+                raise_on_status=False,
+            ),
+        )
+
+    @functools.cached_property
+    def session(self):
+        """
+        Kept for the lifetime of the interface (i.e. across warm invocations), so that connections are re-used.
+        """
+        session = requests.Session()
+        session.mount("https://", self.adapter)
+        return session
+
+    @property
+    def bearer_token(self) -> str:
+        """
+        The current app access token, (re)generated if it is missing or about to expire.
+        """
+        if self._bearer_token is None or (
+            self._token_expires_at is not None
+            and time.monotonic() >= self._token_expires_at - self.TOKEN_REFRESH_MARGIN_S
+        ):
+            self.refresh_token()
+
+        return self._bearer_token
+
+    def refresh_token(self):
+        """
+        Generate a new app access token and cache it until the expiry given by the validate endpoint.
+        """
+        self._bearer_token = self.get_client_credentials_token()
+        expires_in = self.validate_token()
+        self._token_expires_at = time.monotonic() + expires_in
 
     def _send_request(
         self,
@@ -59,16 +162,80 @@ class TwitchInterface:
         Wrapper for sending a request and marshalling the response into some data type.
         """
         try:
-            response = requests.request(method, url, headers=headers, json=payload)
+            response = self.session.request(
+                method,
+                url,
+                headers=headers,
+                json=payload,
+                timeout=self.timeout,
+            )
+            if response.status_code == HTTPStatus.UNAUTHORIZED:
+                raise TwitchUnauthorizedError(response.text)
+
             response.raise_for_status()
-            response_json = response.json()
             if DataType == None:
-                return response_json
+                return response.json()
             else:
-                return TypeAdapter(DataType).validate_python(response_json["data"])
-        except (RequestException, JSONDecodeError, ValidationError) as e:
+                # Decode straight from the raw bytes into the typed response.
+                ResponseModel = get_response_model(DataType)
+                return ResponseModel.model_validate_json(response.content).data
+        except (requests.RequestException, JSONDecodeError, ValidationError) as e:
             raise TwitchError from e
 
+    def get_connection_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Summarize the pooled connections per host, i.e. how many requests were sent over how many connections.
+        """
+        stats = {}
+        if "adapter" not in self.__dict__:
+            # Nothing's been sent yet.
+            return stats
+
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats[f"{pool.scheme}://{pool.host}"] = {
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+                "reused": max(pool.num_requests - pool.num_connections, 0),
+            }
+
+        return stats
+
+    def _send_helix_request(
+        self,
+        method: str,
+        url: str,
+        payload: Dict[str, Any] = None,
+        DataType: Type[T] = None,
+    ) -> T:
+        """
+        Wrapper for sending an authorized request to the Helix API, refreshing the app token once if it was rejected.
+        """
+        try:
+            return self._send_request(
+                method,
+                url,
+                headers=self._helix_headers(),
+                payload=payload,
+                DataType=DataType,
+            )
+        except TwitchUnauthorizedError:
+            self.refresh_token()
+            return self._send_request(
+                method,
+                url,
+                headers=self._helix_headers(),
+                payload=payload,
+                DataType=DataType,
+            )
+
+    def _helix_headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.bearer_token}",
+            "Client-Id": self.client_id,
+        }
+
     def get_client_credentials_token(self) -> str:
         """
         Generate a bearer token (for account-only scope) using the client ID/secret pair.
@@ -82,27 +249,25 @@ class TwitchInterface:
         response = self._send_request("POST", url, payload=payload)
         return response["access_token"]
 
-    def validate_token(self):
+    def validate_token(self) -> int:
         """
         Validate the bearer token is still valid.
+
+        :return: the number of seconds until the token expires.
         """
         url = "https://id.twitch.tv/oauth2/validate"
-        headers = {"Authorization": f"Bearer {self.bearer_token}"}
-        self._send_request("GET", url, headers=headers)
+        headers = {"Authorization": f"Bearer {self._bearer_token}"}
+        response = self._send_request("GET", url, headers=headers)
+        return response["expires_in"]
 
     def get_event_subscriptions(self) -> List[TwitchEventSubscription]:
         """
         Retrieve the current list of event subscriptions.
         """
         url = f"{self.BASE_URL}/eventsub/subscriptions"
-        headers = {
-            "Authorization": f"Bearer {self.bearer_token}",
-            "Client-Id": self.client_id,
-        }
-        return self._send_request(
+        return self._send_helix_request(
             "GET",
             url,
-            headers=headers,
             DataType=List[TwitchEventSubscription],
         )
 
@@ -117,10 +282,6 @@ class TwitchInterface:
         Generate a bearer token using the client ID/secret pair.
         """
         url = f"{self.BASE_URL}/eventsub/subscriptions"
-        headers = {
-            "Authorization": f"Bearer {self.bearer_token}",
-            "Client-Id": self.client_id,
-        }
         transport["secret"] = f"bryti.{subscription_type}.{version}"
         payload = {
             "type": subscription_type,
@@ -128,14 +289,14 @@ class TwitchInterface:
             "condition": condition,
             "transport": transport,
         }
-        return self._send_request(
+        return self._send_helix_request(
             "POST",
             url,
-            headers=headers,
             payload=payload,
             DataType=List[TwitchEventSubscription],
         )
 
+    @telemetry.timed("twitch.send_chat_message")
     def send_chat_message(
         self,
         broadcaster_id: str,
@@ -147,19 +308,14 @@ class TwitchInterface:
         Send a message in the broadcaster's chat.
         """
         url = f"{self.BASE_URL}/chat/messages"
-        headers = {
-            "Authorization": f"Bearer {self.bearer_token}",
-            "Client-Id": self.client_id,
-        }
         payload = {
             "broadcaster_id": broadcaster_id,
             "sender_id": sender_id,
             "message": message,
             "reply_parent_message_id": reply_message_id,
         }
-        return self._send_request(
+        return self._send_helix_request(
             "POST",
             url,
-            headers=headers,
             payload=payload,
         )
@@ -1,17 +1,21 @@
 from pydantic import (
     BaseModel,
+    ConfigDict,
     Field,
 )
 
 from enum import Enum
 from typing import (
     Any,
+    Dict,
     Generic,
     List,
     Optional,
+    Type,
     TypeVar,
 )
 
+from src.common.startup import preloader
 from src.twitch.notification_models import (
     TwitchChannelChatMessage,
     TwitchStreamOffline,
@@ -39,6 +43,9 @@ class TwitchHeaders(BaseModel):
 
 
 class TwitchEventSubscriptionCondition(BaseModel):
+    # Rarely used, so only built on first use (see `build_models`).
+    model_config = ConfigDict(defer_build=True)
+
     broadcaster_user_id: Optional[str] = None
     user_id: Optional[str] = None
 
@@ -57,11 +64,17 @@ class TwitchEventSubscriptionCondition(BaseModel):
 
 
 class TwitchEventSubscriptionTransport(BaseModel):
+    # Rarely used, so only built on first use (see `build_models`).
+    model_config = ConfigDict(defer_build=True)
+
     method: str
     callback: str
 
 
 class TwitchEventSubscription(BaseModel):
+    # Rarely used, so only built on first use (see `build_models`).
+    model_config = ConfigDict(defer_build=True)
+
     id: str
     subscription_type: str = Field(alias="type")
     version: int
@@ -72,18 +85,107 @@ class TwitchEventSubscription(BaseModel):
     transport: TwitchEventSubscriptionTransport
 
 
+# --- Helix API response models ---
+
+
+DataT = TypeVar("DataT")
+
+
+class TwitchResponse(BaseModel, Generic[DataT]):
+    # Rarely used, so only built on first use (see `build_models`).
+    model_config = ConfigDict(defer_build=True)
+
+    data: DataT
+
+
 # --- Specific request event models (by TwitchEventType) ---
 
 
 class TwitchChallengeEvent(BaseModel):
+    # Rarely used, so only built on first use (see `build_models`).
+    model_config = ConfigDict(defer_build=True)
+
     challenge: str
     subscription: TwitchEventSubscription
 
 
-class TwitchNotificationEvent(BaseModel):
+EventT = TypeVar("EventT", bound=BaseModel)
+
+
+class TwitchNotificationEvent(BaseModel, Generic[EventT]):
+    # Each notification model is only built on the first notification of its type (see `build_models`).
+    model_config = ConfigDict(defer_build=True)
+
     subscription: TwitchEventSubscription
-    event: TwitchChannelChatMessage | TwitchStreamOffline | TwitchStreamOnline
+    event: EventT
 
 
 class TwitchRevocationEvent(BaseModel):
+    # Rarely used, so only built on first use (see `build_models`).
+    model_config = ConfigDict(defer_build=True)
+
     subscription: TwitchEventSubscription
+
+
+"""
+Registry of notification models, keyed by subscription type.
+Each is parametrized (and so built) once, so that a notification is parsed exactly once into its own event model.
+"""
+NOTIFICATION_MODELS: Dict[str, Type[TwitchNotificationEvent]] = {}
+
+
+def register_notification_event(subscription_type: str, EventModel: Type[BaseModel]):
+    """
+    Register the event model to parse notifications of the given subscription type with.
+    """
+    NOTIFICATION_MODELS[subscription_type] = TwitchNotificationEvent[EventModel]
+
+
+register_notification_event("channel.chat.message", TwitchChannelChatMessage)
+register_notification_event("stream.online", TwitchStreamOnline)
+register_notification_event("stream.offline", TwitchStreamOffline)
+
+
+@preloader("twitch_models")
+def build_models():
+    """
+    Build the models that are otherwise only built on first use.
+    """
+    for Model in [
+        TwitchChallengeEvent,
+        TwitchRevocationEvent,
+        *NOTIFICATION_MODELS.values(),
+    ]:
+        if not Model.__pydantic_complete__:
+            Model.model_rebuild()
+
+
+# --- Deferred request event models ---
+
+
+class TwitchQueuedNotification(BaseModel):
+    subscription_type: str
+    broadcaster_user_id: Optional[str] = None
+    body: str
+
+
+# --- Partial request event models (for cheaply peeking at an event before fully parsing it) ---
+
+
+class TwitchMessagePreview(BaseModel):
+    text: str
+
+
+class TwitchNotificationEventPreview(BaseModel):
+    broadcaster_user_id: Optional[str] = None
+    chatter_user_id: Optional[str] = None
+    message: Optional[TwitchMessagePreview] = None
+
+
+class TwitchSubscriptionPreview(BaseModel):
+    subscription_type: str = Field(alias="type")
+
+
+class TwitchNotificationPreview(BaseModel):
+    subscription: TwitchSubscriptionPreview
+    event: TwitchNotificationEventPreview
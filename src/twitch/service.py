@@ -4,25 +4,60 @@ from aws_lambda_powertools.event_handler import (
     content_types,
 )
 from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.metrics import (
+    Metrics,
+    MetricUnit,
+)
+from pydantic import ValidationError
 
+from collections import defaultdict
+from contextlib import contextmanager
+import copy
+import functools
 import hashlib
 import hmac
 from http import HTTPStatus
 import json
-from typing import List
+import random
+import time
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Type,
+)
 
 from src.common.api_interfaces import APIInterfaces
-from src.common.commands import resolve_command
+from src.common.batching import (
+    BufferedStateTable,
+    BufferedTwitchInterface,
+)
+from src.common.commands import (
+    AbstractCommand,
+    CommandRequirement,
+    InvalidCommandArgsError,
+    resolve_command,
+)
+from src.common.dedup import EventDeduplicator
+from src.common.lanes import KeyedLanes
+from src.common.log_policy import log_policy
 from src.common.state_models import (
     Permission,
     State,
 )
+from src.common.state_table_interface import VersionConflictError
+from src.common.telemetry import telemetry
+from src.common.work_queue import AbstractWorkQueue
 from src.twitch.interface import TwitchInterface
 from src.twitch.models import (
+    NOTIFICATION_MODELS,
     TwitchChallengeEvent,
     TwitchEventType,
     TwitchHeaders,
-    TwitchNotificationEvent,
+    TwitchNotificationPreview,
+    TwitchQueuedNotification,
     TwitchRevocationEvent,
 )
 from src.twitch.notification_models import (
@@ -33,6 +68,15 @@ from src.twitch.notification_models import (
 
 
 logger = Logger(service="bryti")
+metrics = Metrics(namespace="bryti", service="bryti")
+
+
+# Badges showing the chatter's role in the channel -> the permission that role has.
+BADGE_PERMISSIONS = {
+    "broadcaster": Permission.BROADCASTER,
+    "lead_moderator": Permission.MODERATOR,
+    "moderator": Permission.MODERATOR,
+}
 
 
 class TwitchSignatureMismatchError(Exception):
@@ -40,32 +84,88 @@ class TwitchSignatureMismatchError(Exception):
 
 
 class TwitchService:
+    # How many times a command is re-run after its state write conflicted with another invocation's.
+    MAX_CONFLICT_RETRIES = 3
+    CONFLICT_BACKOFF_BASE_S = 0.05
+
     def __init__(
         self,
         api_interfaces: APIInterfaces,
         user_id: str,
         command_prefix: str,
         assignee_ids: List[str],
+        work_queue: Optional[AbstractWorkQueue] = None,
     ):
         self.api_interfaces = api_interfaces
         self.user_id = user_id
         self.command_prefix = f"!{command_prefix}"
         self.assignee_ids = assignee_ids
+        self.deduplicator = EventDeduplicator(api_interfaces.state_table)
+        self.lanes = KeyedLanes(api_interfaces.state_table)
+        self.work_queue = work_queue
 
     def handle_event(self, headers: TwitchHeaders, body: str) -> Response:
         """
         Router for how to handle the event based on the event type.
         """
-        logger.info("Received Twitch event", headers=headers.model_dump())
-        self.verify_signature(headers, body)
+        log_policy.update(kind=headers.event_type.value)
+        log_policy.info("Received Twitch event", headers=log_policy.payload(headers))
+        with telemetry.dimensions(event_type=headers.event_type.value):
+            return self._handle_event(headers, body)
+
+    def _handle_event(self, headers: TwitchHeaders, body: str) -> Response:
+        with telemetry.span("verify_signature"):
+            self.verify_signature(headers, body)
+
+        if headers.event_type == TwitchEventType.CHALLENGE:
+            return self.handle_challenge(body)
+
+        # Twitch re-delivers events it didn't get a timely reply for, so only handle each one once.
+        # Re-deliveries this instance has seen are caught in-memory, the rest by the claim (only made in the table for events that do work).
+        if self.deduplicator.is_recent(headers.event_id):
+            self._log_duplicate(headers.event_id)
+            return self._acknowledge()
 
         match headers.event_type:
-            case TwitchEventType.CHALLENGE:
-                return self.handle_challenge(body)
             case TwitchEventType.NOTIFICATION:
-                return self.handle_notification(body)
+                return self.handle_notification(body, event_id=headers.event_id)
             case TwitchEventType.REVOCATION:
-                return self.handle_revocation(body)
+                with self._claim_event(headers.event_id) as claimed:
+                    if claimed:
+                        return self.handle_revocation(body)
+
+                return self._acknowledge()
+
+    @contextmanager
+    def _claim_event(
+        self,
+        event_id: Optional[str],
+        durable: bool = True,
+    ) -> Iterator[bool]:
+        """
+        Claim the event (if it has an ID) for the duration of the block, releasing it if the block fails.
+
+        :param durable: Whether to claim it in the state table too (see `EventDeduplicator.claim`).
+        :return: Whether the event was claimed, False if it's already been handled.
+        """
+        if event_id is None:
+            yield True
+            return
+
+        if not self.deduplicator.claim(event_id, durable=durable):
+            self._log_duplicate(event_id)
+            yield False
+            return
+
+        try:
+            yield True
+        except Exception:
+            # Let a retry of the event be handled instead.
+            self.deduplicator.release(event_id, durable=durable)
+            raise
+
+    def _log_duplicate(self, event_id: str):
+        log_policy.info("Skipping already handled event", event_id=event_id)
 
     def verify_signature(self, headers: TwitchHeaders, body: str):
         """
@@ -84,7 +184,7 @@ class TwitchService:
         Handle a callback verification challenge event by replying with the given challenge.
         """
         event = TwitchChallengeEvent.model_validate_json(body)
-        logger.info("Handling challenge", event=event.model_dump())
+        log_policy.info("Handling challenge", event=log_policy.payload(event))
 
         challenge = event.challenge
         return Response(
@@ -93,12 +193,81 @@ class TwitchService:
             body=challenge,
         )
 
-    def handle_notification(self, body: str) -> Response:
+    def handle_notification(
+        self, body: str, event_id: Optional[str] = None
+    ) -> Response:
         """
         Router for how to handle the subscription notification event based on the subscription event type.
+        Notifications that are acknowledged without doing anything (i.e. most chat messages) are never claimed:
+        acknowledging a re-delivery of one again is harmless, and cheaper than a write to the table.
+        Neither are commands that don't fetch anything (i.e. `status`) claimed in the table, only in-memory.
+
+        :param event_id: The event's ID, to claim it before doing any work for it (None: it's already been deduplicated).
+        """
+        with telemetry.span("parse_preview"):
+            preview = TwitchNotificationPreview.model_validate_json(body)
+        subscription_type = preview.subscription.subscription_type
+        log_policy.update(broadcaster_user_id=preview.event.broadcaster_user_id)
+
+        # Most chat messages aren't commands, so acknowledge those before paying for a full parse (or logging them).
+        if (
+            subscription_type == "channel.chat.message"
+            and preview.event.message is not None
+            and not self.is_command_invocation(
+                preview.event.chatter_user_id,
+                preview.event.message.text,
+            )
+        ):
+            return self._acknowledge()
+
+        NotificationModel = NOTIFICATION_MODELS.get(subscription_type)
+        if NotificationModel is None:
+            logger.warning(
+                "Unsupported subscription type",
+                subscription_type=subscription_type,
+            )
+            return self._acknowledge()
+
+        # A re-delivered command that fetches nothing only costs a duplicate reply, so isn't worth a write to the table.
+        message = preview.event.message
+        durable = (
+            subscription_type != "channel.chat.message"
+            or message is None
+            or self._fetches_anything(message.text)
+        )
+        with self._claim_event(event_id, durable=durable) as claimed:
+            if not claimed:
+                return self._acknowledge()
+
+            if self.work_queue is not None:
+                # Reply within Twitch's deadline, and leave the actual work to the queue's worker.
+                queued = TwitchQueuedNotification(
+                    subscription_type=subscription_type,
+                    broadcaster_user_id=preview.event.broadcaster_user_id,
+                    body=body,
+                )
+                work_item_id = self.work_queue.enqueue(
+                    queued.model_dump_json(),
+                    key=queued.broadcaster_user_id,
+                )
+                log_policy.info("Deferred notification", work_item_id=work_item_id)
+            else:
+                self.process_notification(subscription_type, body)
+
+        # Acknowledge notification.
+        return self._acknowledge()
+
+    def process_notification(self, subscription_type: str, body: str):
         """
-        event = TwitchNotificationEvent.model_validate_json(body)
-        logger.info("Handling notification", event=event.model_dump())
+        Fully parse and handle a notification event (of a supported subscription type).
+        """
+        with telemetry.span("parse_notification"):
+            event = NOTIFICATION_MODELS[subscription_type].model_validate_json(body)
+        log_policy.update(
+            kind=TwitchEventType.NOTIFICATION.value,
+            broadcaster_user_id=event.event.broadcaster_user_id,
+        )
+        log_policy.info("Handling notification", event=log_policy.payload(event))
         match event.event:
             case TwitchChannelChatMessage(chatter_user_id=chatter_user_id):
                 if chatter_user_id != self.user_id:
@@ -106,97 +275,311 @@ class TwitchService:
             case TwitchStreamOnline() | TwitchStreamOffline():
                 self.handle_stream_event(event.event)
 
-        # Acknowledge notification.
-        return Response(
-            status_code=HTTPStatus.NO_CONTENT,
-            content_type=content_types.APPLICATION_JSON,
-            body="{}",
+    def drain_work_queue(self, max_items: int = 10) -> int:
+        """
+        Process deferred notifications from the work queue, until it's empty.
+        If one fails, it (and the rest of its batch) is put back on the queue to be retried.
+
+        :param max_items: How many work items to take from the queue at a time.
+        :return: How many work items were processed.
+        """
+        processed = 0
+        if self.work_queue is None:
+            return processed
+
+        while items := self.work_queue.dequeue(max_items):
+            for i, item in enumerate(items):
+                try:
+                    queued = TwitchQueuedNotification.model_validate_json(item.payload)
+                    self.process_notification(queued.subscription_type, queued.body)
+                except Exception:
+                    for unprocessed_item in reversed(items[i:]):
+                        self.work_queue.release(unprocessed_item)
+
+                    raise
+
+                self.work_queue.ack(item)
+                processed += 1
+
+        return processed
+
+    def handle_batch(self, records: List[Dict[str, Any]]) -> List[str]:
+        """
+        Handle a batch of queued notifications (i.e. SQS records), grouped by broadcaster.
+        Each broadcaster's notifications are handled in order, against a single read + write of their state.
+
+        :param records: The queued records, each with a `messageId` and a `body` (a serialized TwitchQueuedNotification).
+        :return: The message IDs of the records that failed to be handled (and should be retried).
+        """
+        failed_message_ids = []
+        groups = defaultdict(list)
+        for record in records:
+            try:
+                queued = TwitchQueuedNotification.model_validate_json(record["body"])
+            except ValidationError:
+                logger.exception(
+                    "Invalid queued record", message_id=record["messageId"]
+                )
+                failed_message_ids.append(record["messageId"])
+                continue
+
+            groups[queued.broadcaster_user_id].append((record["messageId"], queued))
+
+        # Broadcasters are handled in parallel, each in their own lane (so no other invocation writes their state meanwhile).
+        futures = self.lanes.run_all(
+            {
+                broadcaster_user_id: functools.partial(
+                    self.handle_broadcaster_batch,
+                    [queued for _, queued in group],
+                )
+                for broadcaster_user_id, group in groups.items()
+            }
         )
+        for broadcaster_user_id, future in futures.items():
+            if (e := future.exception()) is not None:
+                logger.error(
+                    "Failed to handle batch",
+                    broadcaster_user_id=broadcaster_user_id,
+                    exc_info=e,
+                )
+                group = groups[broadcaster_user_id]
+                failed_message_ids.extend(message_id for message_id, _ in group)
+
+        return failed_message_ids
+
+    def handle_broadcaster_batch(self, notifications: List[TwitchQueuedNotification]):
+        """
+        Handle a single broadcaster's notifications in order: reading their state once, writing it once at the end, then replying.
+        """
+        state_table = BufferedStateTable(self.api_interfaces.state_table)
+        twitch = BufferedTwitchInterface(self.api_interfaces.twitch)
+        batch_service = copy.copy(self)
+        batch_service.api_interfaces = APIInterfaces(state_table, twitch)
+
+        # Logged (and sampled) as this broadcaster's, apart from the other broadcasters' in the batch.
+        with log_policy.scope(broadcaster_user_id=notifications[0].broadcaster_user_id):
+            for notification in notifications:
+                batch_service.process_notification(
+                    notification.subscription_type,
+                    notification.body,
+                )
+
+        state_table.flush()
+        # Only best-effort from here on: the state is written, so the group mustn't be failed (and re-run).
+        twitch.flush()
+
+    def _split_command(self, text: str) -> Optional[List[str]]:
+        """
+        Split a chat message into its command args, if it matches the configured command prefix.
+        """
+        split_msg = text.lower().strip().split()
+        if len(split_msg) == 0 or split_msg[0] != self.command_prefix:
+            return None
+
+        return split_msg[1:]
+
+    def is_command_invocation(self, chatter_user_id: str, text: str) -> bool:
+        """
+        Whether a chat message should be handled as a command (i.e. has the command prefix and wasn't sent by the bot itself).
+        """
+        return chatter_user_id != self.user_id and self._split_command(text) is not None
+
+    def _fetches_anything(self, text: str) -> bool:
+        """
+        Whether the command in a chat message requires anything from the state table (see `AbstractCommand.REQUIRES`),
+        as opposed to only being replied to (i.e. `status`, or an unknown command).
+        """
+        try:
+            CommandClass, _ = resolve_command(self._split_command(text))
+        except InvalidCommandArgsError:
+            return False
+
+        return CommandClass is not None and len(CommandClass.REQUIRES) > 0
 
     def handle_chat_message(self, event: TwitchChannelChatMessage):
         """
         Handle a chat message event by, if the message is a command invocation, attempting to execute it.
         """
         # Check if it matches the configured command prefix.
-        split_msg = event.message.text.lower().strip().split()
-        if len(split_msg) == 0 or split_msg[0] != self.command_prefix:
+        command_args = self._split_command(event.message.text)
+        if command_args is None:
             return
 
-        logger.info("Resolving command", command_args=split_msg[1:])
-        CommandClass, args = resolve_command(split_msg[1:])
-        if CommandClass:
-            can_invoke, state, permission = self.retrieve_event_context(event)
-            logger.info(
+        # Commands are rare compared to other chat messages, so always worth logging.
+        log_policy.update(kind="command")
+        log_policy.info("Resolving command", command_args=command_args)
+        try:
+            with telemetry.span("resolve_command"):
+                CommandClass, args = resolve_command(command_args)
+        except InvalidCommandArgsError as e:
+            # Rejected before anything is fetched for it.
+            reply = f"Invalid call to command! Usage: {self.command_prefix} {e.usage}"
+        else:
+            if CommandClass is None:
+                reply = "Couldn't find that command!"
+            else:
+                reply = self.execute_command(event, CommandClass, args)
+                if reply is None:
+                    return
+
+        log_policy.info("Replying to message", outcome=reply)
+        self.api_interfaces.twitch.send_chat_message(
+            event.broadcaster_user_id,
+            self.user_id,
+            reply,
+            reply_message_id=event.message_id,
+        )
+
+    def execute_command(
+        self,
+        event: TwitchChannelChatMessage,
+        CommandClass: Type[AbstractCommand],
+        args: List[str],
+    ) -> Optional[str]:
+        """
+        Execute the command against the broadcaster's state, in the broadcaster's lane if it read-modify-writes the state.
+        If its write still conflicts with a concurrent one, the state is re-read and the command re-run (a bounded number of times, with jittered backoff).
+
+        :return: The reply to the command, or None if the chatter isn't allowed to invoke commands.
+        """
+        with telemetry.dimensions(command=CommandClass.__name__):
+            # Only read-modify-writes would conflict with a concurrent write (and be re-run), so only they pay for holding
+            # the lane (its lease); read-only commands and atomic increments go straight through.
+            if not CommandClass.READ_MODIFY_WRITE:
+                return self._execute_command(event, CommandClass, args)
+
+            with self.lanes.lane(event.broadcaster_user_id):
+                return self._execute_command(event, CommandClass, args)
+
+    def _execute_command(
+        self,
+        event: TwitchChannelChatMessage,
+        CommandClass: Type[AbstractCommand],
+        args: List[str],
+    ) -> Optional[str]:
+        for attempt in range(self.MAX_CONFLICT_RETRIES + 1):
+            can_invoke, state, permission = self.retrieve_event_context(
+                event,
+                CommandClass,
+            )
+            log_policy.info(
                 "Retrieved event context",
                 can_invoke=can_invoke,
-                state=state,
+                state=log_policy.payload(state),
                 permission=permission,
             )
             if not can_invoke:
-                return
+                return None
 
-            logger.info(
+            log_policy.info(
                 "Executing command",
-                command=CommandClass,
+                command=CommandClass.__name__,
                 command_args=args,
+                attempt=attempt,
             )
             try:
-                reply = CommandClass(
-                    self.api_interfaces,
-                    state,
-                    permission,
-                ).execute(*args)
-            except TypeError as e:
-                reply = "Invalid call to command!"
-        else:
-            reply = "Couldn't find that command!"
+                with telemetry.span("execute_command"):
+                    return CommandClass(
+                        self.api_interfaces,
+                        state,
+                        permission,
+                    ).execute(*args)
+            except VersionConflictError:
+                metrics.add_metric(
+                    name="StateVersionConflicts",
+                    unit=MetricUnit.Count,
+                    value=1,
+                )
+                if attempt == self.MAX_CONFLICT_RETRIES:
+                    raise
 
-        logger.info("Replying to message", reply=reply)
-        self.api_interfaces.twitch.send_chat_message(
-            event.broadcaster_user_id,
-            self.user_id,
-            reply,
-            reply_message_id=event.message_id,
-        )
+                # "Full jitter" exponential backoff, so that racing invocations spread out.
+                metrics.add_metric(
+                    name="StateWriteRetries",
+                    unit=MetricUnit.Count,
+                    value=1,
+                )
+                backoff_s = self.CONFLICT_BACKOFF_BASE_S * 2**attempt
+                time.sleep(random.uniform(0, backoff_s))
 
     def retrieve_event_context(
         self,
         event: TwitchChannelChatMessage,
-    ) -> (bool, State, Permission):
+        CommandClass: Optional[Type[AbstractCommand]] = None,
+    ) -> (bool, Optional[State], Permission):
         """
-        Look up user information/state from the state table.
+        Look up user information/state from the state table, only as much of it as the command requires.
+        Read-only commands get only the state attributes they need (eventually consistent),
+        the rest get the whole state read strongly consistently, since their write is conditioned on its version.
+        Commands that require neither the state nor the chatter (and no assignee check) don't fetch anything.
         """
 
-        # Get broadcaster state (or default if does not exist yet).
-        broadcaster = self.api_interfaces.state_table.lookup_by_twitch(
-            event.broadcaster_user_id
+        attributes = None
+        requires = frozenset(CommandRequirement)
+        min_permission = Permission.BROADCASTER
+        if CommandClass is not None:
+            attributes = CommandClass.STATE_ATTRIBUTES
+            requires = CommandClass.REQUIRES
+            min_permission = CommandClass.PERMISSION
+
+        # The chatter only needs to be looked up for a custom grant (if their role doesn't already give them enough for the command),
+        # or to check they're an assignee.
+        badge_permission = self.resolve_badge_permission(event)
+        look_up_chatter = self.assignee_ids is not None or (
+            CommandRequirement.CHATTER in requires and badge_permission < min_permission
         )
-        if broadcaster is not None:
-            state = self.api_interfaces.state_table.get_state(broadcaster.user)
-        else:
+        read_state = CommandRequirement.STATE in requires
+        if not (look_up_chatter or read_state):
+            return True, None, badge_permission
+
+        context = self.api_interfaces.state_table.fetch_twitch_context(
+            event.broadcaster_user_id,
+            event.chatter_user_id if look_up_chatter else None,
+            attributes=attributes,
+            consistent_read=attributes is None,
+            read_state=read_state,
+        )
+
+        # Get broadcaster state (or default if does not exist yet).
+        state = context.state
+        if not read_state:
+            state = None
+        elif state is None:
             state = State(
                 user=event.broadcaster_user_login,
                 twitch_user_id=event.broadcaster_user_id,
             )
 
-        chatter = self.api_interfaces.state_table.lookup_by_twitch(
-            event.chatter_user_id
-        )
+        chatter = context.chatter
 
         # If there are no assignees (in prod) or if the chatter is assigned to the PR (in dev).
         can_invoke = self.assignee_ids is None or (
             chatter is not None and chatter.github_user_id in self.assignee_ids
         )
 
-        # If the broadcaster called the command, otherwise if they have permissions given by the broadcaster.
-        permission = Permission.EVERYBODY
-        if event.broadcaster_user_id == event.chatter_user_id:
-            permission = Permission.BROADCASTER
-        elif chatter is not None and chatter.user in state.members:
-            permission = state.members[chatter.user]
+        # From the chatter's role in the channel, unless the broadcaster granted them more.
+        permission = badge_permission
+        if context.permission is not None and context.permission > permission:
+            permission = context.permission
 
         return can_invoke, state, permission
 
+    @staticmethod
+    def resolve_badge_permission(event: TwitchChannelChatMessage) -> Permission:
+        """
+        Resolve the chatter's permission from their role in the channel (as shown by the message's badges), without any lookups.
+        """
+        if event.chatter_user_id == event.broadcaster_user_id:
+            return Permission.BROADCASTER
+
+        permission = Permission.EVERYBODY
+        for badge in event.badges:
+            badge_permission = BADGE_PERMISSIONS.get(badge.set_id)
+            if badge_permission is not None and badge_permission > permission:
+                permission = badge_permission
+
+        return permission
+
     def handle_stream_event(self, event: TwitchStreamOnline | TwitchStreamOffline):
         # TODO: Send DeathsInfoCommand.
         pass
@@ -206,11 +589,14 @@ class TwitchService:
         Handle a subscription revocation event.
         """
         event = TwitchRevocationEvent.model_validate_json(body)
-        logger.info("Handling revocation", event=event.model_dump())
+        log_policy.info("Handling revocation", event=log_policy.payload(event))
 
         # TODO: send Discord notification.
 
         # Acknowledge revocation.
+        return self._acknowledge()
+
+    def _acknowledge(self) -> Response:
         return Response(
             status_code=HTTPStatus.NO_CONTENT,
             content_type=content_types.APPLICATION_JSON,
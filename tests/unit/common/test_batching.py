@@ -0,0 +1,156 @@
+import pytest
+
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+from unittest.mock import (
+    MagicMock,
+    call,
+)
+
+from src.common.batching import (
+    metrics,
+    BufferedStateTable,
+    BufferedTwitchInterface,
+)
+from src.common.state_models import (
+    CounterState,
+    EventContext,
+    LookupFields,
+    Permission,
+    State,
+)
+
+
+MOCK_TIMESTAMP = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def mock_state_table():
+    return MagicMock()
+
+
+@pytest.fixture
+def buffered_state_table(mock_state_table):
+    return BufferedStateTable(mock_state_table)
+
+
+def test_fetch_twitch_context_once(mock_state_table, buffered_state_table):
+    broadcaster = LookupFields(user="mock-user")
+    chatter = LookupFields(user="mock-chatter")
+    state = State(user="mock-user", version=1)
+    mock_state_table.fetch_twitch_context.return_value = EventContext(
+        broadcaster=broadcaster,
+        state=state,
+        chatter=broadcaster,
+    )
+    mock_state_table.lookup_by_twitch.return_value = chatter
+    mock_state_table.get_permission.return_value = Permission.MODERATOR
+
+    buffered_state_table.fetch_twitch_context("mock-broadcaster-id", "mock-broadcaster-id")
+    actual = buffered_state_table.fetch_twitch_context("mock-broadcaster-id", "mock-chatter-id")
+
+    assert actual == EventContext(broadcaster=broadcaster, state=state, chatter=chatter, permission=Permission.MODERATOR)
+    mock_state_table.fetch_twitch_context.assert_called_once()
+    mock_state_table.lookup_by_twitch.assert_called_once_with("mock-chatter-id")
+    # Permissions aren't part of the buffered state, so they're always read.
+    mock_state_table.get_permission.assert_called_once_with("mock-user", "mock-chatter")
+
+
+def test_update_state_buffered(mock_state_table, buffered_state_table):
+    state = State(user="mock-user", version=1)
+    mock_state_table.update_state.return_value = state.model_copy(update={"version": 2})
+
+    buffered_state_table.update_state(state)
+    buffered_state_table.update_state(state)
+    mock_state_table.update_state.assert_not_called()
+
+    buffered_state_table.flush()
+    buffered_state_table.flush()
+
+    mock_state_table.update_state.assert_called_once_with(state)
+    assert buffered_state_table.state.version == 2
+
+
+def test_flush_unchanged(mock_state_table, buffered_state_table):
+    buffered_state_table.flush()
+
+    mock_state_table.update_state.assert_not_called()
+
+
+def test_increment_counter(mock_state_table, buffered_state_table):
+    state = State(
+        user="mock-user",
+        deaths=CounterState(count=3, last_timestamp=MOCK_TIMESTAMP),
+    )
+
+    actual = buffered_state_table.increment_counter(
+        state,
+        "deaths",
+        MOCK_TIMESTAMP + timedelta(seconds=30),
+        dedup_window_s=15,
+    )
+
+    assert actual.deaths == CounterState(count=4, last_timestamp=MOCK_TIMESTAMP + timedelta(seconds=30))
+    assert state.deaths.count == 3
+    assert buffered_state_table.state == actual
+    mock_state_table.increment_counter.assert_not_called()
+
+
+def test_increment_counter_new(buffered_state_table):
+    state = State(user="mock-user")
+
+    actual = buffered_state_table.increment_counter(state, "crimes", MOCK_TIMESTAMP, dedup_window_s=15)
+
+    assert actual.crimes == CounterState(count=1, last_timestamp=MOCK_TIMESTAMP)
+
+
+def test_increment_counter_dedup(buffered_state_table):
+    state = State(
+        user="mock-user",
+        deaths=CounterState(count=3, last_timestamp=MOCK_TIMESTAMP),
+    )
+
+    actual = buffered_state_table.increment_counter(
+        state,
+        "deaths",
+        MOCK_TIMESTAMP + timedelta(seconds=5),
+        dedup_window_s=15,
+    )
+
+    assert actual is None
+    assert buffered_state_table.is_dirty == False
+
+
+def test_buffered_twitch_interface():
+    mock_twitch = MagicMock()
+    buffered_twitch = BufferedTwitchInterface(mock_twitch)
+
+    buffered_twitch.send_chat_message("mock-broadcaster-id", "mock-message-1")
+    buffered_twitch.send_chat_message("mock-broadcaster-id", "mock-message-2", reply_parent_message_id="mock-id")
+    mock_twitch.send_chat_message.assert_not_called()
+
+    buffered_twitch.flush()
+
+    assert mock_twitch.send_chat_message.call_args_list == [
+        call("mock-broadcaster-id", "mock-message-1"),
+        call("mock-broadcaster-id", "mock-message-2", reply_parent_message_id="mock-id"),
+    ]
+    assert buffered_twitch.chat_messages == []
+
+
+def test_buffered_twitch_interface_send_failure():
+    mock_twitch = MagicMock()
+    mock_twitch.send_chat_message.side_effect = [Exception("mock-error"), None]
+    buffered_twitch = BufferedTwitchInterface(mock_twitch)
+    buffered_twitch.send_chat_message("mock-broadcaster-id", "mock-message-1")
+    buffered_twitch.send_chat_message("mock-broadcaster-id", "mock-message-2")
+
+    buffered_twitch.flush()
+
+    # The failed message is skipped, the rest are still sent.
+    assert mock_twitch.send_chat_message.call_count == 2
+    assert buffered_twitch.chat_messages == []
+    metrics.clear_metrics()
@@ -15,6 +15,8 @@ from src.common.commands import (
     CrimesAddCommand,
     CrimesSetCommand,
     TwitchConnectCommand,
+    InvalidCommandArgsError,
+    compile_command_tree,
     resolve_command,
 )
 from src.common.state_models import (
@@ -108,12 +110,29 @@ def test_deaths_add_command(mock_datetime, mock_api_interfaces, mock_state, perm
             last_timestamp="2024-01-02T15:04:05Z",
         ),
     )
-    mock_api_interfaces.state_table.update_state.return_value = updated_state
+    mock_api_interfaces.state_table.increment_counter.return_value = updated_state
 
     actual = DeathsAddCommand(mock_api_interfaces, mock_state, permission).execute()
 
     assert actual == "Death count: 5 | Last death: just now"
-    mock_api_interfaces.state_table.update_state.assert_called_once_with(updated_state)
+    mock_api_interfaces.state_table.increment_counter.assert_called_once_with(
+        mock_state,
+        "deaths",
+        datetime(2024, 1, 2, 15, 4, 5, tzinfo=timezone.utc),
+        10,
+    )
+    mock_api_interfaces.state_table.update_state.assert_not_called()
+
+
+@patch("src.common.commands.datetime")
+def test_deaths_add_command_within_window_in_table(mock_datetime, mock_api_interfaces, mock_state):
+    mock_datetime.now.return_value = datetime(2024, 1, 2, 15, 4, 5, tzinfo=timezone.utc)
+    mock_state.deaths = CounterState(count=4, last_timestamp="2006-01-02T15:04:05Z")
+    mock_api_interfaces.state_table.increment_counter.return_value = None
+
+    actual = DeathsAddCommand(mock_api_interfaces, mock_state, Permission.MODERATOR).execute()
+
+    assert actual == "It's been too soon since they last died! Are you sure they died again?"
 
 
 @patch("src.common.commands.datetime")
@@ -126,12 +145,17 @@ def test_deaths_add_command_no_deaths_state(mock_datetime, mock_api_interfaces,
             last_timestamp="2006-01-02T15:04:05Z",
         ),
     )
-    mock_api_interfaces.state_table.update_state.return_value = updated_state
+    mock_api_interfaces.state_table.increment_counter.return_value = updated_state
 
     actual = DeathsAddCommand(mock_api_interfaces, mock_state, Permission.MODERATOR).execute()
 
     assert actual == "Death count: 1 | Last death: just now"
-    mock_api_interfaces.state_table.update_state.assert_called_once_with(updated_state)
+    mock_api_interfaces.state_table.increment_counter.assert_called_once_with(
+        mock_state,
+        "deaths",
+        datetime(2006, 1, 2, 15, 4, 5, tzinfo=timezone.utc),
+        10,
+    )
 
 
 @pytest.mark.parametrize(
@@ -198,12 +222,17 @@ def test_crimes_add_command(mock_datetime, mock_api_interfaces, mock_state):
             last_timestamp="2024-01-02T15:04:05Z",
         ),
     )
-    mock_api_interfaces.state_table.update_state.return_value = updated_state
+    mock_api_interfaces.state_table.increment_counter.return_value = updated_state
 
     actual = CrimesAddCommand(mock_api_interfaces, mock_state, Permission.BROADCASTER).execute()
 
     assert actual == "Crime count: 5 | Last crime: just now"
-    mock_api_interfaces.state_table.update_state.assert_called_once_with(updated_state)
+    mock_api_interfaces.state_table.increment_counter.assert_called_once_with(
+        mock_state,
+        "crimes",
+        datetime(2024, 1, 2, 15, 4, 5, tzinfo=timezone.utc),
+        10,
+    )
 
 
 def test_crimes_set_command_bad_permissions(mock_api_interfaces, mock_state):
@@ -253,7 +282,7 @@ def test_twitch_connect_command(mock_api_interfaces, mock_state):
         # Existing command group w/ no-arg default.
         (["deaths"], (DeathsInfoCommand, [])),
         (["deaths", "add"], (DeathsAddCommand, [])),
-        (["deaths", "set", "0"], (DeathsSetCommand, ["0"])),    # Validate remaining args.
+        (["deaths", "set", "0"], (DeathsSetCommand, [0])),      # Validate remaining args (coerced).
         (["deaths", "nonexistant"], (None, [])),                # Bad nested-level args.
 
         # Existing command group w/o no-arg default.
@@ -265,3 +294,56 @@ def test_resolve_command(args, expected):
     actual = resolve_command(args)
     assert actual == expected
 
+
+
+@pytest.mark.parametrize(
+    "args, expected_usage",
+    [
+        (["status", "extra"], "status"),
+        (["deaths", "set"], "deaths set <deaths>"),
+        (["deaths", "set", "1", "2"], "deaths set <deaths>"),
+        (["crimes", "set", "many"], "crimes set <crimes>"),
+    ],
+)
+def test_resolve_command_invalid_args(args, expected_usage):
+    with pytest.raises(InvalidCommandArgsError) as e:
+        resolve_command(args)
+
+    assert e.value.usage == expected_usage
+
+
+def test_compile_command_tree():
+    tree = {
+        "a": StatusCommand,
+        "b": {
+            None: DeathsInfoCommand,
+            "c": {"d": DeathsSetCommand},
+        },
+    }
+
+    commands, groups = compile_command_tree(tree)
+
+    assert commands == {
+        ("a",): StatusCommand,
+        ("b",): DeathsInfoCommand,
+        ("b", "c", "d"): DeathsSetCommand,
+    }
+    assert groups == {(), ("b",), ("b", "c")}
+
+
+@pytest.mark.parametrize(
+    "CommandClass, expected",
+    [
+        (StatusCommand, False),
+        (DeathsInfoCommand, False),
+        (DeathsAddCommand, False),
+        (DeathsSetCommand, True),
+        (CrimesInfoCommand, False),
+        (CrimesAddCommand, False),
+        (CrimesSetCommand, True),
+        (TwitchConnectCommand, False),
+    ],
+)
+def test_read_modify_write(CommandClass, expected):
+    # Only commands writing back the whole state need the broadcaster's lane.
+    assert CommandClass.READ_MODIFY_WRITE == expected
@@ -0,0 +1,65 @@
+import pytest
+
+from unittest.mock import MagicMock
+
+from src.common.dedup import EventDeduplicator
+
+
+@pytest.fixture
+def mock_state_table():
+    return MagicMock()
+
+
+@pytest.fixture
+def deduplicator(mock_state_table):
+    return EventDeduplicator(mock_state_table, claim_ttl_s=60)
+
+
+def test_claim(mock_state_table, deduplicator):
+    mock_state_table.claim_event.return_value = True
+
+    assert deduplicator.claim("mock-event-id") == True
+    # The second time is caught in-memory, without another claim in the table.
+    assert deduplicator.claim("mock-event-id") == False
+    mock_state_table.claim_event.assert_called_once_with("mock-event-id", 60)
+
+
+def test_claim_already_claimed(mock_state_table, deduplicator):
+    mock_state_table.claim_event.return_value = False
+
+    assert deduplicator.claim("mock-event-id") == False
+    assert deduplicator.claim("mock-event-id") == False
+    mock_state_table.claim_event.assert_called_once_with("mock-event-id", 60)
+
+
+def test_release(mock_state_table, deduplicator):
+    mock_state_table.claim_event.return_value = True
+    deduplicator.claim("mock-event-id")
+
+    deduplicator.release("mock-event-id")
+
+    mock_state_table.release_event.assert_called_once_with("mock-event-id")
+    assert deduplicator.claim("mock-event-id") == True
+    assert mock_state_table.claim_event.call_count == 2
+
+
+def test_is_recent(mock_state_table, deduplicator):
+    mock_state_table.claim_event.return_value = True
+
+    assert deduplicator.is_recent("mock-event-id") == False
+    deduplicator.claim("mock-event-id")
+
+    assert deduplicator.is_recent("mock-event-id") == True
+    mock_state_table.claim_event.assert_called_once()
+
+
+def test_claim_not_durable(mock_state_table, deduplicator):
+    assert deduplicator.claim("mock-event-id", durable=False) == True
+    assert deduplicator.claim("mock-event-id", durable=False) == False
+
+    deduplicator.release("mock-event-id", durable=False)
+
+    # Only caught in-memory, the table isn't touched at all.
+    assert deduplicator.is_recent("mock-event-id") == False
+    mock_state_table.claim_event.assert_not_called()
+    mock_state_table.release_event.assert_not_called()
@@ -0,0 +1,119 @@
+import pytest
+
+import threading
+import time
+from unittest.mock import (
+    MagicMock,
+    patch,
+)
+
+from src.common.lanes import KeyedLanes
+
+
+@pytest.fixture
+def mock_state_table():
+    mock_state_table = MagicMock()
+    mock_state_table.acquire_lease.return_value = True
+    return mock_state_table
+
+
+@pytest.fixture
+def lanes(mock_state_table):
+    return KeyedLanes(mock_state_table, lease_s=30, lease_wait_s=0.1, workers=4)
+
+
+def test_lane(mock_state_table, lanes):
+    with lanes.lane("mock-key"):
+        mock_state_table.acquire_lease.assert_called_once_with("mock-key", lanes.owner, 30)
+        mock_state_table.release_lease.assert_not_called()
+
+    mock_state_table.release_lease.assert_called_once_with("mock-key", lanes.owner)
+    assert lanes._locks == {}
+
+
+def test_lane_reentrant(mock_state_table, lanes):
+    with lanes.lane("mock-key"):
+        with lanes.lane("mock-key"):
+            pass
+
+        mock_state_table.release_lease.assert_not_called()
+
+    mock_state_table.acquire_lease.assert_called_once()
+    mock_state_table.release_lease.assert_called_once()
+
+
+def test_lane_released_on_error(mock_state_table, lanes):
+    with pytest.raises(ValueError):
+        with lanes.lane("mock-key"):
+            raise ValueError()
+
+    mock_state_table.release_lease.assert_called_once()
+    assert lanes._locks == {}
+
+
+@patch("src.common.lanes.time.sleep")
+def test_lane_waits_for_lease(mock_sleep, mock_state_table, lanes):
+    mock_state_table.acquire_lease.side_effect = [False, False, True]
+
+    with lanes.lane("mock-key"):
+        pass
+
+    assert mock_state_table.acquire_lease.call_count == 3
+    assert mock_sleep.call_count == 2
+    mock_state_table.release_lease.assert_called_once()
+
+
+def test_lane_lease_timeout(mock_state_table, lanes):
+    mock_state_table.acquire_lease.return_value = False
+    ran = False
+
+    with lanes.lane("mock-key"):
+        ran = True
+
+    # The work still runs (guarded by the state's version condition), but nobody else's lease is released.
+    assert ran == True
+    mock_state_table.release_lease.assert_not_called()
+
+
+def test_submit_serializes_per_key(lanes):
+    running = {"mock-key-1": 0, "mock-key-2": 0}
+    max_running = {"mock-key-1": 0, "mock-key-2": 0}
+    lock = threading.Lock()
+
+    def work(key):
+        with lock:
+            running[key] += 1
+            max_running[key] = max(max_running[key], running[key])
+
+        time.sleep(0.01)
+        with lock:
+            running[key] -= 1
+
+        return key
+
+    futures = [lanes.submit(key, work, key) for key in ["mock-key-1", "mock-key-2"] * 4]
+
+    assert [future.result() for future in futures] == ["mock-key-1", "mock-key-2"] * 4
+    assert max_running == {"mock-key-1": 1, "mock-key-2": 1}
+
+
+def test_run_all_parallel_across_keys(lanes):
+    barrier = threading.Barrier(2, timeout=1)
+
+    # Would time out if the two keys weren't run at the same time.
+    futures = lanes.run_all({
+        "mock-key-1": barrier.wait,
+        "mock-key-2": barrier.wait,
+    })
+
+    assert all(future.exception() is None for future in futures.values())
+
+
+def test_run_all_exception(lanes):
+    def fail():
+        raise ValueError()
+
+    futures = lanes.run_all({"mock-key-1": fail, "mock-key-2": lambda: "mock-result"})
+
+    assert isinstance(futures["mock-key-1"].exception(), ValueError)
+    assert futures["mock-key-2"].result() == "mock-result"
@@ -0,0 +1,136 @@
+import pytest
+
+from unittest.mock import (
+    MagicMock,
+    patch,
+)
+
+from src.common import log_policy as log_policy_module
+from src.common.log_policy import LogPolicy
+from src.twitch.models import TwitchHeaders
+
+
+@pytest.fixture
+def mock_logger():
+    mock_logger = MagicMock()
+    mock_logger.isEnabledFor.return_value = True
+    return mock_logger
+
+
+@pytest.fixture
+def policy(mock_logger):
+    return LogPolicy(
+        mock_logger,
+        sample_rates={"mock-sampled-out": 0.0},
+        debug_broadcaster_user_id="mock-debug-broadcaster",
+    )
+
+
+@pytest.fixture
+def headers():
+    return TwitchHeaders.model_validate(
+        {
+            "twitch-eventsub-message-id": "mock-event-id",
+            "twitch-eventsub-message-type": "notification",
+            "twitch-eventsub-subscription-type": "channel.chat.message",
+            "twitch-eventsub-subscription-version": 1,
+            "twitch-eventsub-message-timestamp": "mock-timestamp",
+            "twitch-eventsub-message-signature": "mock-signature",
+            "twitch-eventsub-message-retry": 0,
+        }
+    )
+
+
+def test_info_sampled_out(policy, mock_logger):
+    stats = MagicMock()
+
+    @policy.invocation
+    def handler():
+        policy.update(kind="mock-sampled-out")
+        policy.info("mock-info", stats=stats)
+        policy.warning("mock-warning")
+
+    handler()
+
+    mock_logger.info.assert_not_called()
+    stats.assert_not_called()
+    mock_logger.warning.assert_called_once()
+
+
+def test_info_level_disabled(policy, mock_logger):
+    mock_logger.isEnabledFor.return_value = False
+    payload = MagicMock()
+
+    policy.info("mock-info", event=policy.payload(payload))
+
+    mock_logger.info.assert_not_called()
+    payload.model_dump.assert_not_called()
+
+
+def test_payload_allowed_fields(policy, mock_logger, headers):
+    policy.info(
+        "mock-info",
+        headers=policy.payload(headers),
+        event=policy.payload(
+            {
+                "routeKey": "mock-route",
+                "body": "mock-body",
+                "requestContext": {"requestId": "mock-request-id", "http": {}},
+                "headers": {"twitch-eventsub-message-signature": "mock-signature"},
+            }
+        ),
+        stats=lambda: {"mock-stat": 1},
+    )
+
+    kwargs = mock_logger.info.call_args.kwargs
+    assert kwargs["headers"] == {
+        "event_id": "mock-event-id",
+        "event_type": "notification",
+        "subscription_type": "channel.chat.message",
+        "retry_count": 0,
+    }
+    assert kwargs["event"] == {
+        "routeKey": "mock-route",
+        "requestContext": {"requestId": "mock-request-id"},
+    }
+    assert kwargs["stats"] == {"mock-stat": 1}
+
+
+def test_debug_broadcaster(policy, mock_logger, headers):
+    @policy.invocation
+    def handler():
+        policy.update(kind="mock-sampled-out")
+        with policy.scope(broadcaster_user_id="mock-debug-broadcaster"):
+            policy.info("mock-debugged", headers=policy.payload(headers))
+
+        policy.info("mock-sampled-out")
+
+    handler()
+
+    mock_logger.info.assert_called_once()
+    assert mock_logger.info.call_args.args == ("mock-debugged",)
+    assert mock_logger.info.call_args.kwargs["headers"] == headers.model_dump(
+        mode="json"
+    )
+
+
+def test_invocation_resets_scope(policy, mock_logger):
+    policy.invocation(lambda: policy.update(kind="mock-sampled-out"))()
+
+    policy.info("mock-info")
+
+    mock_logger.info.assert_called_once()
+
+
+def test_sample_rate(mock_logger):
+    policy = LogPolicy(mock_logger, sample_rates={"mock-kind": 0.5})
+
+    with patch.object(log_policy_module.random, "random", return_value=0.6):
+        policy.update(kind="mock-kind")
+        policy.info("mock-sampled-out")
+        # Only sampled once per kind.
+        with patch.object(log_policy_module.random, "random", return_value=0.4):
+            policy.update(kind="mock-kind")
+            policy.info("mock-sampled-out")
+
+    mock_logger.info.assert_not_called()
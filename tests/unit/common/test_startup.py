@@ -0,0 +1,126 @@
+import pytest
+
+import subprocess
+import sys
+from unittest.mock import (
+    MagicMock,
+    patch,
+)
+
+from src.common import startup as startup_module
+from src.common.startup import (
+    Deferred,
+    LazyModule,
+    StartupReport,
+)
+from src.twitch.models import TwitchRevocationEvent
+
+
+@pytest.fixture
+def report():
+    report = StartupReport()
+    with patch.object(startup_module, "startup", report):
+        yield report
+
+
+def test_report_once(report):
+    with report.timed("mock-init-step"):
+        pass
+
+    report.mark_ready()
+    with report.timed("mock-first-use-step"):
+        pass
+
+    actual = report.report()
+
+    assert actual["preloaded"] is False
+    assert actual["init_total_ms"] >= 0
+    assert list(actual["init_ms"]) == ["mock-init-step"]
+    assert list(actual["first_use_ms"]) == ["mock-first-use-step"]
+    # Only reported on the cold start's first invocation.
+    assert report.report() is None
+
+
+def test_log_report(report):
+    handler = report.log_report(lambda event, context: "mock-response")
+
+    with patch.object(startup_module, "logger") as mock_logger:
+        assert handler("mock-event", "mock-context") == "mock-response"
+        assert handler("mock-event", "mock-context") == "mock-response"
+
+    mock_logger.info.assert_called_once()
+    assert mock_logger.info.call_args.args == ("Startup report",)
+
+
+def test_lazy_module(report):
+    module = LazyModule("json")
+
+    assert module._module is None
+    assert module.dumps({}) == "{}"
+    assert module._module is sys.modules["json"]
+    assert "import:json" in report.init_ms
+
+
+def test_deferred(report):
+    build = MagicMock()
+    value = Deferred("mock-client", build)
+
+    build.assert_not_called()
+    value.mock_method()
+    value.mock_method()
+
+    build.assert_called_once()
+    assert build.return_value.mock_method.call_count == 2
+    assert "build:mock-client" in report.init_ms
+
+
+def test_preload(report):
+    build = MagicMock()
+    preloader = MagicMock()
+    lazy_modules = {"json": LazyModule("json")}
+    with (
+        patch.object(startup_module, "LAZY_MODULES", lazy_modules),
+        patch.object(startup_module, "DEFERRED", [Deferred("mock-client", build)]),
+        patch.object(startup_module, "PRELOADERS", {"mock-preloader": preloader}),
+    ):
+        startup_module.preload()
+
+    assert lazy_modules["json"]._module is not None
+    build.assert_called_once()
+    preloader.assert_called_once()
+    assert report.is_preloaded
+    assert "preload:mock-preloader" in report.init_ms
+
+
+def test_heavy_imports_deferred():
+    # In a fresh interpreter, since other tests have already imported/built everything in this one.
+    code = """
+import sys
+import src.common.state_table_backends, src.common.work_queue, src.twitch.service
+from src.twitch.models import NOTIFICATION_MODELS, TwitchChallengeEvent, TwitchRevocationEvent
+assert "boto3" not in sys.modules
+assert "requests" not in sys.modules
+assert not any(M.__pydantic_complete__ for M in [TwitchChallengeEvent, TwitchRevocationEvent, *NOTIFICATION_MODELS.values()])
+"""
+
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+
+
+def test_deferred_models_built_on_first_use():
+    event = TwitchRevocationEvent.model_validate({
+        "subscription": {
+            "id": "mock-id",
+            "type": "mock-type",
+            "version": 1,
+            "status": "mock-status",
+            "cost": 0,
+            "condition": {},
+            "created_at": "mock-timestamp",
+            "transport": {"method": "webhook", "callback": "mock-callback"},
+        },
+    })
+
+    assert event.subscription.id == "mock-id"
+    assert TwitchRevocationEvent.__pydantic_complete__
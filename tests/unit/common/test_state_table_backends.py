@@ -0,0 +1,313 @@
+import pytest
+
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+from unittest.mock import patch
+
+from src.common.state_models import (
+    CounterState,
+    EventContext,
+    LookupFields,
+    Permission,
+    State,
+)
+from src.common.state_table_backends import (
+    InMemoryStateTableInterface,
+    SQLiteStateTableInterface,
+    build_state_table_interface,
+)
+from src.common.state_table_interface import (
+    DynamoDBStateTableInterface,
+    VersionConflictError,
+)
+
+
+MOCK_TIMESTAMP = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def state_table(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryStateTableInterface()
+
+    return SQLiteStateTableInterface(str(tmp_path / "state.db"))
+
+
+def test_update_state(state_table):
+    state = State(user="mock-user", twitch_user_id="mock-twitch-id")
+
+    created = state_table.update_state(state)
+    updated = state_table.update_state(created.model_copy(update={"deaths": CounterState(count=1, last_timestamp=MOCK_TIMESTAMP)}))
+
+    assert created.version == 1
+    assert updated.version == 2
+    assert state_table.get_state("mock-user") == updated
+    assert state_table.get_state("nonexistant") is None
+
+
+def test_update_state_version_conflict(state_table):
+    state = state_table.update_state(State(user="mock-user"))
+    state_table.update_state(state)
+
+    with pytest.raises(VersionConflictError):
+        state_table.update_state(state)
+
+
+def test_read_state_is_a_copy(state_table):
+    state_table.update_state(State(user="mock-user"))
+    state_table.increment_counter(State(user="mock-user"), "deaths", MOCK_TIMESTAMP, 10)
+    state = state_table.get_state("mock-user")
+
+    state.deaths.count = 5
+
+    assert state_table.get_state("mock-user").deaths.count == 1
+
+
+def test_get_state_projection(state_table):
+    deaths = CounterState(count=3, last_timestamp=MOCK_TIMESTAMP)
+    state_table.update_state(
+        State(
+            user="mock-user",
+            twitch_user_id="mock-twitch-id",
+            deaths=deaths,
+            crimes=deaths,
+        )
+    )
+
+    actual = state_table.get_state("mock-user", attributes=["deaths"])
+
+    assert actual == State(user="mock-user", twitch_user_id="mock-twitch-id", deaths=deaths, version=1)
+
+
+def test_permissions(state_table):
+    state_table.grant_permissions(
+        "mock-user",
+        {"mock-member": Permission.MODERATOR, "mock-member-2": Permission.MODERATOR},
+    )
+    state_table.grant_permissions("mock-user", {"mock-member": Permission.BROADCASTER})
+    state_table.revoke_permissions("mock-user", ["mock-member-2", "nonexistant"])
+
+    assert state_table.get_permission("mock-user", "mock-member") == Permission.BROADCASTER
+    assert state_table.get_permission("mock-user", "mock-member-2") is None
+    # Permissions are per channel.
+    assert state_table.get_permission("mock-other-user", "mock-member") is None
+
+
+def test_lookups(state_table):
+    state_table.update_state(
+        State(
+            user="mock-user",
+            twitch_user_id="mock-twitch-id",
+            discord_user_id="mock-discord-id",
+            github_user_id="mock-github-id",
+        )
+    )
+    expected = LookupFields(
+        user="mock-user",
+        twitch_user_id="mock-twitch-id",
+        discord_user_id="mock-discord-id",
+        github_user_id="mock-github-id",
+    )
+
+    assert state_table.lookup_by_twitch("mock-twitch-id") == expected
+    assert state_table.lookup_by_discord("mock-discord-id") == expected
+    assert state_table.lookup_by_github("mock-github-id") == expected
+    assert state_table.lookup_by_twitch("nonexistant") is None
+
+
+def test_lookups_follow_changed_ids(state_table):
+    state = state_table.update_state(State(user="mock-user", twitch_user_id="mock-twitch-id-1"))
+    state_table.lookup_by_twitch("mock-twitch-id-1")
+
+    state_table.update_state(state.model_copy(update={"twitch_user_id": "mock-twitch-id-2"}))
+
+    assert state_table.lookup_by_twitch("mock-twitch-id-1") is None
+    assert state_table.lookup_by_twitch("mock-twitch-id-2").user == "mock-user"
+
+
+def test_fetch_twitch_context(state_table):
+    broadcaster = state_table.update_state(State(user="mock-broadcaster", twitch_user_id="mock-broadcaster-id"))
+    state_table.update_state(State(user="mock-chatter", twitch_user_id="mock-chatter-id"))
+
+    actual = state_table.fetch_twitch_context("mock-broadcaster-id", "mock-chatter-id")
+
+    assert actual == EventContext(
+        broadcaster=LookupFields(user="mock-broadcaster", twitch_user_id="mock-broadcaster-id"),
+        state=broadcaster,
+        chatter=LookupFields(user="mock-chatter", twitch_user_id="mock-chatter-id"),
+    )
+
+
+def test_increment_counter(state_table):
+    state = state_table.update_state(
+        State(
+            user="mock-user",
+            deaths=CounterState(count=3, last_timestamp=MOCK_TIMESTAMP),
+        )
+    )
+
+    actual = state_table.increment_counter(state, "deaths", MOCK_TIMESTAMP + timedelta(seconds=30), 10)
+
+    assert actual.deaths == CounterState(count=4, last_timestamp=MOCK_TIMESTAMP + timedelta(seconds=30))
+    assert actual.version == 2
+    assert state_table.get_state("mock-user") == actual
+
+
+def test_increment_counter_dedup(state_table):
+    state = state_table.update_state(
+        State(
+            user="mock-user",
+            deaths=CounterState(count=3, last_timestamp=MOCK_TIMESTAMP),
+        )
+    )
+
+    actual = state_table.increment_counter(state, "deaths", MOCK_TIMESTAMP + timedelta(seconds=5), 10)
+
+    assert actual is None
+    assert state_table.get_state("mock-user") == state
+
+
+def test_increment_counter_new_item(state_table):
+    state = State(user="mock-user", twitch_user_id="mock-twitch-id")
+    # Cache a "not found" lookup, which the increment has to invalidate.
+    state_table.lookup_by_twitch("mock-twitch-id")
+
+    actual = state_table.increment_counter(state, "crimes", MOCK_TIMESTAMP, 10)
+
+    assert actual == State(
+        user="mock-user",
+        twitch_user_id="mock-twitch-id",
+        crimes=CounterState(count=1, last_timestamp=MOCK_TIMESTAMP),
+        version=1,
+    )
+    assert state_table.lookup_by_twitch("mock-twitch-id").user == "mock-user"
+    # Somebody else already started the counter.
+    assert state_table.increment_counter(state, "crimes", MOCK_TIMESTAMP, 10) is None
+
+
+def test_not_found_lookup_created_elsewhere(tmp_path):
+    # Two instances (i.e. two Lambda containers) sharing the same table.
+    path = str(tmp_path / "state.db")
+    state_table = SQLiteStateTableInterface(path)
+    other_state_table = SQLiteStateTableInterface(path)
+    assert state_table.lookup_by_twitch("mock-twitch-id") is None
+    other_state_table.update_state(State(user="mock-user", twitch_user_id="mock-twitch-id"))
+
+    # Written from the stale "not found", so it conflicts, but the retry looks the user up again.
+    with pytest.raises(VersionConflictError):
+        state_table.update_state(State(user="mock-user", twitch_user_id="mock-twitch-id"))
+
+    assert state_table.lookup_by_twitch("mock-twitch-id").user == "mock-user"
+
+
+@patch("src.common.ttl_cache.time.monotonic")
+def test_not_found_lookup_cached_briefly(mock_monotonic, tmp_path):
+    path = str(tmp_path / "state.db")
+    state_table = SQLiteStateTableInterface(path)
+    other_state_table = SQLiteStateTableInterface(path)
+    mock_monotonic.return_value = 100
+    assert state_table.lookup_by_twitch("mock-twitch-id") is None
+    other_state_table.update_state(State(user="mock-user", twitch_user_id="mock-twitch-id"))
+
+    mock_monotonic.return_value = 100 + state_table.LOOKUP_NOT_FOUND_TTL_S - 1
+    assert state_table.lookup_by_twitch("mock-twitch-id") is None
+
+    mock_monotonic.return_value = 100 + state_table.LOOKUP_NOT_FOUND_TTL_S
+    assert state_table.lookup_by_twitch("mock-twitch-id").user == "mock-user"
+
+
+@patch("src.common.state_table_backends.time.time")
+def test_claim_event(mock_time, state_table):
+    mock_time.return_value = 1000
+
+    assert state_table.claim_event("mock-event-id", 60) == True
+    assert state_table.claim_event("mock-event-id", 60) == False
+
+    # Expired claims can be re-claimed.
+    mock_time.return_value = 1061
+    assert state_table.claim_event("mock-event-id", 60) == True
+
+    state_table.release_event("mock-event-id")
+    assert state_table.claim_event("mock-event-id", 60) == True
+
+
+@patch("src.common.state_table_backends.time.time")
+def test_leases(mock_time, state_table):
+    mock_time.return_value = 1000
+
+    assert state_table.acquire_lease("mock-key", "mock-owner-1", 30) == True
+    assert state_table.acquire_lease("mock-key", "mock-owner-2", 30) == False
+    # Renewed by its owner.
+    assert state_table.acquire_lease("mock-key", "mock-owner-1", 30) == True
+
+    # Not released by somebody else.
+    state_table.release_lease("mock-key", "mock-owner-2")
+    assert state_table.acquire_lease("mock-key", "mock-owner-2", 30) == False
+
+    # Taken over once expired.
+    mock_time.return_value = 1031
+    assert state_table.acquire_lease("mock-key", "mock-owner-2", 30) == True
+
+    state_table.release_lease("mock-key", "mock-owner-2")
+    assert state_table.acquire_lease("mock-key", "mock-owner-1", 30) == True
+
+
+def test_sqlite_state_table_persisted(tmp_path):
+    path = str(tmp_path / "state.db")
+    SQLiteStateTableInterface(path).update_state(State(user="mock-user", twitch_user_id="mock-twitch-id"))
+
+    state_table = SQLiteStateTableInterface(path)
+
+    assert state_table.get_state("mock-user").version == 1
+    assert state_table.lookup_by_twitch("mock-twitch-id").user == "mock-user"
+
+
+def test_sqlite_migrate_members(tmp_path):
+    state_table = SQLiteStateTableInterface(str(tmp_path / "state.db"))
+    state_table.update_state(State(user="mock-user"))
+    with state_table._transaction():
+        state_table._connection.execute(
+            "UPDATE states SET state = json_set(state, '$.members', json(?)) WHERE user = ?",
+            ('{"mock-member": "moderator"}', "mock-user"),
+        )
+
+    assert state_table.get_permission("mock-user", "mock-member") is None
+    assert state_table.migrate_all_members() == {"mock-user": 1}
+    assert state_table.get_permission("mock-user", "mock-member") == Permission.MODERATOR
+    assert state_table.get_state("mock-user").version == 1
+    # Nothing is left to migrate.
+    assert state_table.migrate_all_members() == {}
+
+
+def test_sqlite_state_table_rolled_back(tmp_path):
+    state_table = SQLiteStateTableInterface(str(tmp_path / "state.db"))
+    state = state_table.update_state(State(user="mock-user"))
+
+    with pytest.raises(ValueError):
+        with state_table._transaction():
+            state_table._store(state.model_copy(update={"version": 5}))
+            raise ValueError()
+
+    assert state_table.get_state("mock-user").version == 1
+
+
+@pytest.mark.parametrize(
+    "spec, expected_type",
+    [
+        (None, DynamoDBStateTableInterface),
+        ("dynamodb", DynamoDBStateTableInterface),
+        ("memory", InMemoryStateTableInterface),
+        ("sqlite::memory:", SQLiteStateTableInterface),
+    ],
+)
+@patch("boto3.client")
+def test_build_state_table_interface(_mock_boto3_client, spec, expected_type):
+    assert type(build_state_table_interface(spec, "mock-table-name")) is expected_type
+
+
+def test_build_state_table_interface_unknown():
+    with pytest.raises(ValueError):
+        build_state_table_interface("nonexistant", "mock-table-name")
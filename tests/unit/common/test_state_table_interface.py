@@ -1,16 +1,26 @@
+from botocore.exceptions import ClientError
 import pytest
 
+from datetime import (
+    datetime,
+    timezone,
+)
 from unittest.mock import (
     MagicMock,
     patch,
 )
 
 from src.common.state_models import (
+    CounterState,
+    EventContext,
     LookupFields,
+    Permission,
     State,
 )
 from src.common.state_table_interface import (
-    StateTableInterface,
+    DynamoDBStateTableInterface,
+    UnprocessedItemsError,
+    VersionConflictError,
     ddb_to_dict,
     dict_to_ddb,
 )
@@ -45,7 +55,7 @@ def mock_dynamodb_client():
 
 @pytest.fixture
 def state_interface(mock_dynamodb_client):
-    return StateTableInterface(mock_dynamodb_client, "mock-table-name")
+    return DynamoDBStateTableInterface(mock_dynamodb_client, "mock-table-name")
 
 
 @pytest.mark.parametrize(
@@ -161,24 +171,178 @@ def test_lookup_by_github(mock_dynamodb_client, state_interface, ddb_items, expe
     "ddb_items, expected",
     [
         ([], None),
-        ([MOCK_DDB_ITEM], State(user="mock-user")),
+        ([MOCK_DDB_ITEM], LookupFields(user="mock-user")),
     ],
 )
-def test_get_state(mock_dynamodb_client, state_interface, ddb_items, expected):
+def test_lookup_cached(mock_dynamodb_client, state_interface, ddb_items, expected):
     mock_dynamodb_client.query.return_value = {"Items": ddb_items}
 
+    assert state_interface.lookup_by_twitch("mock-twitch-user-id") == expected
+    assert state_interface.lookup_by_twitch("mock-twitch-user-id") == expected
+
+    mock_dynamodb_client.query.assert_called_once()
+    assert state_interface.lookup_cache.stats()["hits"] == 1
+    assert state_interface.lookup_cache.stats()["misses"] == 1
+
+
+def test_lookup_cache_invalidated_by_update_state(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.query.return_value = {"Items": []}
+    state_interface.lookup_by_twitch("mock-twitch-user-id")
+    state_interface.lookup_cache.put(("discord_user_id", "mock-old-discord-user-id"), LookupFields(user="mock-user"))
+    state_interface.lookup_cache.put(("discord_user_id", "mock-other-discord-user-id"), LookupFields(user="mock-other-user"))
+    mock_dynamodb_client.update_item.return_value = {
+        "Attributes": {
+            **MOCK_DDB_ITEM,
+            "twitch_user_id": {"S": "mock-twitch-user-id"},
+            "version": {"N": "1"},
+        },
+    }
+
+    state_interface.update_state(State(user="mock-user", twitch_user_id="mock-twitch-user-id"))
+
+    # Both the newly-written ID and the user's stale ID are dropped, other users' lookups are kept.
+    assert len(state_interface.lookup_cache) == 1
+    mock_dynamodb_client.query.return_value = {"Items": [MOCK_DDB_ITEM]}
+    assert state_interface.lookup_by_twitch("mock-twitch-user-id") == LookupFields(user="mock-user")
+    assert mock_dynamodb_client.query.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "response, expected",
+    [
+        ({}, None),
+        ({"Item": MOCK_DDB_ITEM}, State(user="mock-user")),
+    ],
+)
+def test_get_state(mock_dynamodb_client, state_interface, response, expected):
+    mock_dynamodb_client.get_item.return_value = response
+
     actual = state_interface.get_state("mock-user")
 
     assert actual == expected
-    mock_dynamodb_client.query.assert_called_once_with(
+    mock_dynamodb_client.get_item.assert_called_once_with(
         TableName="mock-table-name",
-        KeyConditionExpression="#pk = :pk",
-        ExpressionAttributeNames={"#pk": "user"},
-        ExpressionAttributeValues={":pk": {"S": "mock-user"}},
-        Limit=1,
+        Key={"user": {"S": "mock-user"}},
+        ConsistentRead=False,
     )
 
 
+def test_get_state_projection(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.get_item.return_value = {"Item": {**MOCK_DDB_ITEM, "version": {"N": "2"}}}
+
+    actual = state_interface.get_state("mock-user", attributes=["deaths", "version"], consistent_read=True)
+
+    assert actual == State(user="mock-user", version=2)
+    # The key, lookup fields and version are always read (once).
+    mock_dynamodb_client.get_item.assert_called_once_with(
+        TableName="mock-table-name",
+        Key={"user": {"S": "mock-user"}},
+        ConsistentRead=True,
+        ProjectionExpression="#aa, #ab, #ac, #ad, #ae, #af",
+        ExpressionAttributeNames={
+            "#aa": "user",
+            "#ab": "twitch_user_id",
+            "#ac": "discord_user_id",
+            "#ad": "github_user_id",
+            "#ae": "version",
+            "#af": "deaths",
+        },
+    )
+
+
+def test_fetch_twitch_context(mock_dynamodb_client, state_interface):
+    def mock_query(**kwargs):
+        value = kwargs["ExpressionAttributeValues"][":pk"]["S"]
+        items = {
+            "mock-broadcaster-id": {"user": {"S": "mock-broadcaster"}},
+            "mock-chatter-id": {"user": {"S": "mock-chatter"}},
+        }
+        return {"Items": [items[value]] if value in items else []}
+
+    def mock_get_item(**kwargs):
+        items = {
+            "mock-broadcaster": {"user": {"S": "mock-broadcaster"}, "version": {"N": "3"}},
+            "member#mock-broadcaster#mock-chatter": {"permission": {"S": "moderator"}},
+        }
+        return {"Item": items[kwargs["Key"]["user"]["S"]]}
+
+    mock_dynamodb_client.query.side_effect = mock_query
+    mock_dynamodb_client.get_item.side_effect = mock_get_item
+    expected = EventContext(
+        broadcaster=LookupFields(user="mock-broadcaster"),
+        state=State(user="mock-broadcaster", version=3),
+        chatter=LookupFields(user="mock-chatter"),
+        permission=Permission.MODERATOR,
+    )
+
+    actual = state_interface.fetch_twitch_context("mock-broadcaster-id", "mock-chatter-id", consistent_read=True)
+
+    assert actual == expected
+    assert mock_dynamodb_client.query.call_count == 2
+    assert mock_dynamodb_client.get_item.call_count == 2
+    mock_dynamodb_client.get_item.assert_any_call(
+        TableName="mock-table-name",
+        Key={"user": {"S": "mock-broadcaster"}},
+        ConsistentRead=True,
+    )
+
+
+def test_fetch_twitch_context_broadcaster_is_chatter(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.query.return_value = {"Items": [MOCK_DDB_ITEM]}
+    mock_dynamodb_client.get_item.return_value = {"Item": MOCK_DDB_ITEM}
+    expected = EventContext(
+        broadcaster=LookupFields(user="mock-user"),
+        state=State(user="mock-user"),
+        chatter=LookupFields(user="mock-user"),
+    )
+
+    actual = state_interface.fetch_twitch_context("mock-broadcaster-id", "mock-broadcaster-id")
+
+    assert actual == expected
+    # The duplicate chatter lookup is skipped.
+    assert mock_dynamodb_client.query.call_count == 1
+
+
+def test_fetch_twitch_context_no_broadcaster(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.query.return_value = {"Items": []}
+    expected = EventContext()
+
+    actual = state_interface.fetch_twitch_context("mock-broadcaster-id", "mock-chatter-id")
+
+    assert actual == expected
+    # No state read without a broadcaster to read it for.
+    assert mock_dynamodb_client.query.call_count == 2
+    mock_dynamodb_client.get_item.assert_not_called()
+
+
+def test_fetch_twitch_context_no_chatter(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.query.return_value = {"Items": [MOCK_DDB_ITEM]}
+    mock_dynamodb_client.get_item.return_value = {"Item": MOCK_DDB_ITEM}
+    expected = EventContext(
+        broadcaster=LookupFields(user="mock-user"),
+        state=State(user="mock-user"),
+    )
+
+    actual = state_interface.fetch_twitch_context("mock-broadcaster-id", None)
+
+    assert actual == expected
+    # Neither the chatter lookup nor their permission read happen.
+    assert mock_dynamodb_client.query.call_count == 1
+    mock_dynamodb_client.get_item.assert_called_once()
+
+
+def test_fetch_twitch_context_no_state(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.query.return_value = {"Items": [MOCK_DDB_ITEM]}
+    expected = EventContext(
+        broadcaster=LookupFields(user="mock-user"),
+    )
+
+    actual = state_interface.fetch_twitch_context("mock-broadcaster-id", None, read_state=False)
+
+    assert actual == expected
+    mock_dynamodb_client.get_item.assert_not_called()
+
+
 def test_update_state(mock_dynamodb_client, state_interface):
     mock_dynamodb_client.update_item.return_value = {"Attributes": {**MOCK_DDB_ITEM, "version": {"N": "2"}}}
     initial_state = State(user="mock-user", version=1)
@@ -190,15 +354,366 @@ def test_update_state(mock_dynamodb_client, state_interface):
         TableName="mock-table-name",
         Key={"user": {"S": "mock-user"}},
         ExpressionAttributeNames={
-            "#ab": "members",
-            "#ac": "version",
+            "#ab": "version",
         },
         ExpressionAttributeValues={
             ":one": {"N": "1"},
-            ":ab": {"M": {}},
-            ":ac": {"N": "1"},
+            ":ab": {"N": "1"},
         },
-        UpdateExpression="SET #ab = :ab, #ac = :ac + :one",
-        ConditionExpression="attribute_not_exists(#ac) OR #ac = :ac",
+        UpdateExpression="SET #ab = :ab + :one",
+        ConditionExpression="attribute_not_exists(#ab) OR #ab = :ab",
         ReturnValues="ALL_NEW",
     )
+
+
+def test_update_state_version_conflict(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.update_item.side_effect = ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException"}},
+        "UpdateItem",
+    )
+
+    with pytest.raises(VersionConflictError):
+        state_interface.update_state(State(user="mock-user", version=1))
+
+
+@pytest.mark.parametrize(
+    "response, expected",
+    [
+        ({}, None),
+        ({"Item": {"permission": {"S": "moderator"}}}, Permission.MODERATOR),
+    ],
+)
+def test_get_permission(mock_dynamodb_client, state_interface, response, expected):
+    mock_dynamodb_client.get_item.return_value = response
+
+    actual = state_interface.get_permission("mock-user", "mock-member")
+
+    assert actual == expected
+    mock_dynamodb_client.get_item.assert_called_once_with(
+        TableName="mock-table-name",
+        Key={"user": {"S": "member#mock-user#mock-member"}},
+        ProjectionExpression="#p",
+        ExpressionAttributeNames={"#p": "permission"},
+    )
+
+
+def test_grant_permissions(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.batch_write_item.return_value = {"UnprocessedItems": {}}
+    permissions = {f"mock-member-{i}": Permission.MODERATOR for i in range(30)}
+
+    state_interface.grant_permissions("mock-user", permissions)
+
+    # Split into batches of at most 25 items.
+    assert mock_dynamodb_client.batch_write_item.call_count == 2
+    first_batch = mock_dynamodb_client.batch_write_item.call_args_list[0].kwargs["RequestItems"]["mock-table-name"]
+    assert len(first_batch) == 25
+    assert first_batch[0] == {
+        "PutRequest": {
+            "Item": {
+                "user": {"S": "member#mock-user#mock-member-0"},
+                "permission": {"S": "moderator"},
+            },
+        },
+    }
+
+
+def test_revoke_permissions_duplicate_member(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.batch_write_item.return_value = {"UnprocessedItems": {}}
+    members = [f"mock-member-{i}" for i in range(25)] + ["mock-member-0"]
+
+    state_interface.revoke_permissions("mock-user", members)
+
+    # Each member is deleted once, so that no batch holds two requests for the same key (nor spills over into another).
+    batch = mock_dynamodb_client.batch_write_item.call_args.kwargs["RequestItems"]["mock-table-name"]
+    mock_dynamodb_client.batch_write_item.assert_called_once()
+    assert len(batch) == 25
+    assert batch[0] == {"DeleteRequest": {"Key": {"user": {"S": "member#mock-user#mock-member-0"}}}}
+
+
+@patch("src.common.state_table_interface.time.sleep")
+def test_revoke_permissions_unprocessed(_mock_sleep, mock_dynamodb_client, state_interface):
+    delete_request = {"DeleteRequest": {"Key": {"user": {"S": "member#mock-user#mock-member"}}}}
+    mock_dynamodb_client.batch_write_item.side_effect = [
+        {"UnprocessedItems": {"mock-table-name": [delete_request]}},
+        {"UnprocessedItems": {}},
+    ]
+
+    state_interface.revoke_permissions("mock-user", ["mock-member"])
+
+    # Unprocessed items are retried by themselves.
+    assert mock_dynamodb_client.batch_write_item.call_count == 2
+    mock_dynamodb_client.batch_write_item.assert_called_with(RequestItems={"mock-table-name": [delete_request]})
+
+
+@patch("src.common.state_table_interface.time.sleep")
+def test_revoke_permissions_unprocessed_error(_mock_sleep, mock_dynamodb_client, state_interface):
+    delete_request = {"DeleteRequest": {"Key": {"user": {"S": "member#mock-user#mock-member"}}}}
+    mock_dynamodb_client.batch_write_item.return_value = {"UnprocessedItems": {"mock-table-name": [delete_request]}}
+
+    with pytest.raises(UnprocessedItemsError):
+        state_interface.revoke_permissions("mock-user", ["mock-member"])
+
+
+def test_grant_permissions_empty(mock_dynamodb_client, state_interface):
+    state_interface.grant_permissions("mock-user", {})
+    state_interface.revoke_permissions("mock-user", [])
+
+    mock_dynamodb_client.batch_write_item.assert_not_called()
+
+
+def test_increment_counter(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.update_item.return_value = {
+        "Attributes": {
+            **MOCK_DDB_ITEM,
+            "deaths": {"M": {"count": {"N": "5"}, "last_timestamp": {"S": "2024-01-02T15:04:05+00:00"}}},
+            "version": {"N": "2"},
+        },
+    }
+    initial_state = State(user="mock-user", deaths=CounterState(count=4, last_timestamp="2006-01-02T15:04:05Z"), version=1)
+    final_state = State(user="mock-user", deaths=CounterState(count=5, last_timestamp="2024-01-02T15:04:05Z"), version=2)
+
+    actual = state_interface.increment_counter(initial_state, "deaths", datetime(2024, 1, 2, 15, 4, 5, tzinfo=timezone.utc), 10)
+
+    assert actual == final_state
+    mock_dynamodb_client.update_item.assert_called_once_with(
+        TableName="mock-table-name",
+        Key={"user": {"S": "mock-user"}},
+        ExpressionAttributeNames={
+            "#c": "deaths",
+            "#v": "version",
+            "#n": "count",
+            "#t": "last_timestamp",
+        },
+        ExpressionAttributeValues={
+            ":one": {"N": "1"},
+            ":t": {"S": "2024-01-02T15:04:05+00:00"},
+            ":cutoff": {"S": "2024-01-02T15:03:55+00:00"},
+        },
+        UpdateExpression="SET #c.#n = #c.#n + :one, #c.#t = :t ADD #v :one",
+        ConditionExpression="#c.#t < :cutoff",
+        ReturnValues="ALL_NEW",
+    )
+
+
+def test_increment_counter_new_counter(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.update_item.return_value = {
+        "Attributes": {
+            **MOCK_DDB_ITEM,
+            "twitch_user_id": {"S": "mock-twitch-user-id"},
+            "crimes": {"M": {"count": {"N": "1"}, "last_timestamp": {"S": "2024-01-02T15:04:05+00:00"}}},
+            "version": {"N": "1"},
+        },
+    }
+    initial_state = State(user="mock-user", twitch_user_id="mock-twitch-user-id")
+    final_state = State(
+        user="mock-user",
+        twitch_user_id="mock-twitch-user-id",
+        crimes=CounterState(count=1, last_timestamp="2024-01-02T15:04:05Z"),
+        version=1,
+    )
+
+    actual = state_interface.increment_counter(initial_state, "crimes", datetime(2024, 1, 2, 15, 4, 5, tzinfo=timezone.utc), 10)
+
+    assert actual == final_state
+    mock_dynamodb_client.update_item.assert_called_once_with(
+        TableName="mock-table-name",
+        Key={"user": {"S": "mock-user"}},
+        ExpressionAttributeNames={
+            "#c": "crimes",
+            "#v": "version",
+            "#aa": "twitch_user_id",
+        },
+        ExpressionAttributeValues={
+            ":one": {"N": "1"},
+            ":c": {"M": {"count": {"N": "1"}, "last_timestamp": {"S": "2024-01-02T15:04:05+00:00"}}},
+            ":aa": {"S": "mock-twitch-user-id"},
+        },
+        UpdateExpression="SET #c = :c, #aa = if_not_exists(#aa, :aa) ADD #v :one",
+        ConditionExpression="attribute_not_exists(#c)",
+        ReturnValues="ALL_NEW",
+    )
+
+
+def test_increment_counter_condition_failed(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.update_item.side_effect = ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException"}},
+        "UpdateItem",
+    )
+    state = State(user="mock-user", deaths=CounterState(count=4, last_timestamp="2006-01-02T15:04:05Z"))
+
+    actual = state_interface.increment_counter(state, "deaths", datetime(2024, 1, 2, 15, 4, 5, tzinfo=timezone.utc), 10)
+
+    assert actual is None
+
+
+def test_increment_counter_error(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.update_item.side_effect = ClientError(
+        {"Error": {"Code": "ProvisionedThroughputExceededException"}},
+        "UpdateItem",
+    )
+    state = State(user="mock-user")
+
+    with pytest.raises(ClientError):
+        state_interface.increment_counter(state, "deaths", datetime(2024, 1, 2, 15, 4, 5, tzinfo=timezone.utc), 10)
+
+
+@patch("src.common.state_table_interface.time.time")
+def test_claim_event(mock_time, mock_dynamodb_client, state_interface):
+    mock_time.return_value = 1000
+
+    actual = state_interface.claim_event("mock-event-id", 60)
+
+    assert actual == True
+    mock_dynamodb_client.put_item.assert_called_once_with(
+        TableName="mock-table-name",
+        Item={
+            "user": {"S": "event#mock-event-id"},
+            "expires_at": {"N": "1060"},
+        },
+        ExpressionAttributeNames={"#pk": "user", "#exp": "expires_at"},
+        ExpressionAttributeValues={":now": {"N": "1000"}},
+        ConditionExpression="attribute_not_exists(#pk) OR #exp < :now",
+    )
+
+
+def test_claim_event_already_claimed(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.put_item.side_effect = ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException"}},
+        "PutItem",
+    )
+
+    actual = state_interface.claim_event("mock-event-id", 60)
+
+    assert actual == False
+
+
+def test_release_event(mock_dynamodb_client, state_interface):
+    state_interface.release_event("mock-event-id")
+
+    mock_dynamodb_client.delete_item.assert_called_once_with(
+        TableName="mock-table-name",
+        Key={"user": {"S": "event#mock-event-id"}},
+    )
+
+
+@patch("src.common.state_table_interface.time.time")
+def test_acquire_lease(mock_time, mock_dynamodb_client, state_interface):
+    mock_time.return_value = 1000.5
+
+    actual = state_interface.acquire_lease("mock-key", "mock-owner", 30)
+
+    assert actual == True
+    mock_dynamodb_client.put_item.assert_called_once_with(
+        TableName="mock-table-name",
+        Item={
+            "user": {"S": "lease#mock-key"},
+            "owner": {"S": "mock-owner"},
+            "lease_expires_at": {"N": "1030.5"},
+            "expires_at": {"N": "1030"},
+        },
+        ExpressionAttributeNames={
+            "#pk": "user",
+            "#o": "owner",
+            "#exp": "lease_expires_at",
+        },
+        ExpressionAttributeValues={
+            ":owner": {"S": "mock-owner"},
+            ":now": {"N": "1000.5"},
+        },
+        ConditionExpression="attribute_not_exists(#pk) OR #exp < :now OR #o = :owner",
+    )
+
+
+def test_acquire_lease_held(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.put_item.side_effect = ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException"}},
+        "PutItem",
+    )
+
+    actual = state_interface.acquire_lease("mock-key", "mock-owner", 30)
+
+    assert actual == False
+
+
+def test_release_lease(mock_dynamodb_client, state_interface):
+    state_interface.release_lease("mock-key", "mock-owner")
+
+    mock_dynamodb_client.delete_item.assert_called_once_with(
+        TableName="mock-table-name",
+        Key={"user": {"S": "lease#mock-key"}},
+        ExpressionAttributeNames={"#o": "owner"},
+        ExpressionAttributeValues={":owner": {"S": "mock-owner"}},
+        ConditionExpression="#o = :owner",
+    )
+
+
+def test_release_lease_taken_over(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.delete_item.side_effect = ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException"}},
+        "DeleteItem",
+    )
+
+    # Somebody else's lease is left alone, without raising.
+    state_interface.release_lease("mock-key", "mock-owner")
+
+
+def test_migrate_all_members(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.scan.side_effect = [
+        {"Items": [{"user": {"S": "mock-user"}}], "LastEvaluatedKey": {"user": {"S": "mock-user"}}},
+        {"Items": []},
+    ]
+    mock_dynamodb_client.get_item.side_effect = [
+        {
+            "Item": {
+                "members": {
+                    "M": {
+                        "mock-member-1": {"S": "moderator"},
+                        "mock-member-2": {"S": "moderator"},
+                    },
+                },
+            },
+        },
+        {},
+        # mock-member-2 was already granted a permission as an item of its own.
+        {"Item": {"permission": {"S": "moderator"}}},
+    ]
+    mock_dynamodb_client.batch_write_item.return_value = {"UnprocessedItems": {}}
+
+    actual = state_interface.migrate_all_members()
+
+    assert actual == {"mock-user": 1}
+    assert mock_dynamodb_client.scan.call_args_list[1].kwargs["ExclusiveStartKey"] == {"user": {"S": "mock-user"}}
+    mock_dynamodb_client.batch_write_item.assert_called_once_with(
+        RequestItems={
+            "mock-table-name": [
+                {
+                    "PutRequest": {
+                        "Item": {
+                            "user": {"S": "member#mock-user#mock-member-1"},
+                            "permission": {"S": "moderator"},
+                        },
+                    },
+                },
+            ],
+        },
+    )
+    mock_dynamodb_client.update_item.assert_called_once_with(
+        TableName="mock-table-name",
+        Key={"user": {"S": "mock-user"}},
+        UpdateExpression="REMOVE #m",
+        ConditionExpression="attribute_exists(#m)",
+        ExpressionAttributeNames={"#m": "members"},
+    )
+
+
+def test_migrate_members_already_removed(mock_dynamodb_client, state_interface):
+    mock_dynamodb_client.get_item.return_value = {"Item": {}}
+    mock_dynamodb_client.update_item.side_effect = ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException"}},
+        "UpdateItem",
+    )
+
+    actual = state_interface.migrate_members("mock-user")
+
+    assert actual == 0
+    mock_dynamodb_client.batch_write_item.assert_not_called()
@@ -0,0 +1,94 @@
+import pytest
+
+import json
+from unittest.mock import patch
+
+from src.common.telemetry import (
+    Span,
+    Telemetry,
+)
+
+
+@pytest.fixture
+def telemetry():
+    return Telemetry(namespace="mock-namespace", service="mock-service")
+
+
+@patch("src.common.telemetry.time.perf_counter")
+def test_span(mock_perf_counter, telemetry):
+    mock_perf_counter.side_effect = [1.0, 1.25]
+
+    with telemetry.span("mock-stage"):
+        pass
+
+    assert telemetry.collect() == [Span(stage="mock-stage", duration_ms=250, dimensions={})]
+    assert telemetry.collect() == []
+
+
+def test_span_error(telemetry):
+    with pytest.raises(ValueError):
+        with telemetry.span("mock-stage"):
+            raise ValueError()
+
+    assert [span.stage for span in telemetry.collect()] == ["mock-stage"]
+
+
+def test_dimensions(telemetry):
+    with telemetry.dimensions(event_type="mock-event-type"):
+        with telemetry.span("mock-stage-1"):
+            pass
+
+        with telemetry.dimensions(command="mock-command"):
+            with telemetry.span("mock-stage-2"):
+                pass
+
+    with telemetry.span("mock-stage-3"):
+        pass
+
+    assert [span.dimensions for span in telemetry.collect()] == [
+        {"event_type": "mock-event-type"},
+        {"event_type": "mock-event-type", "command": "mock-command"},
+        {},
+    ]
+
+
+def test_timed(telemetry):
+    @telemetry.timed("mock-stage")
+    def mock_fn(a, b=None):
+        return a, b
+
+    assert mock_fn(1, b=2) == (1, 2)
+    assert mock_fn.__name__ == "mock_fn"
+    assert [span.stage for span in telemetry.collect()] == ["mock-stage"]
+
+
+def test_serialize(telemetry):
+    spans = [
+        Span(stage="mock-stage-1", duration_ms=1, dimensions={"event_type": "mock-event-type"}),
+        Span(stage="mock-stage-1", duration_ms=2, dimensions={"event_type": "mock-event-type"}),
+        Span(stage="mock-stage-2", duration_ms=3, dimensions={"event_type": "mock-event-type", "command": "mock-command"}),
+    ]
+
+    actual = telemetry.serialize(spans)
+
+    assert len(actual) == 2
+    assert actual[0]["event_type"] == "mock-event-type"
+    assert actual[0]["mock-stage-1"] == [1.0, 2.0]
+    assert actual[0]["_aws"]["CloudWatchMetrics"][0]["Namespace"] == "mock-namespace"
+    assert actual[0]["_aws"]["CloudWatchMetrics"][0]["Metrics"] == [{"Name": "mock-stage-1", "Unit": "Milliseconds"}]
+    assert actual[1]["command"] == "mock-command"
+    assert actual[1]["mock-stage-2"] == [3.0]
+
+
+def test_log_spans(capsys, telemetry):
+    @telemetry.log_spans
+    def mock_handler():
+        with telemetry.span("mock-stage"):
+            raise ValueError()
+
+    with pytest.raises(ValueError):
+        mock_handler()
+
+    blob = json.loads(capsys.readouterr().out)
+    assert "mock-stage" in blob
+    assert telemetry.collect() == []
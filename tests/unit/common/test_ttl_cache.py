@@ -0,0 +1,73 @@
+import pytest
+
+from unittest.mock import patch
+
+from src.common.ttl_cache import TTLCache
+
+
+@pytest.fixture
+def cache():
+    return TTLCache(2, 10)
+
+
+def test_get_put(cache):
+    assert cache.get("mock-key") is None
+    assert cache.get("mock-key", default="mock-default") == "mock-default"
+
+    cache.put("mock-key", "mock-value")
+    cache.put("mock-key-2", None)
+
+    assert cache.get("mock-key") == "mock-value"
+    assert cache.get("mock-key-2", default="mock-default") is None
+    assert cache.stats() == {"size": 2, "hits": 2, "misses": 2, "evictions": 0, "expirations": 0}
+
+
+def test_lru_eviction(cache):
+    cache.put("mock-key-1", 1)
+    cache.put("mock-key-2", 2)
+    cache.get("mock-key-1")  # Mark as recently used.
+    cache.put("mock-key-3", 3)
+
+    assert cache.get("mock-key-2") is None
+    assert cache.get("mock-key-1") == 1
+    assert cache.get("mock-key-3") == 3
+    assert cache.evictions == 1
+    assert len(cache) == 2
+
+
+@patch("src.common.ttl_cache.time.monotonic")
+def test_expiry(mock_monotonic, cache):
+    mock_monotonic.return_value = 100
+    cache.put("mock-key", "mock-value")
+
+    mock_monotonic.return_value = 109
+    assert cache.get("mock-key") == "mock-value"
+
+    mock_monotonic.return_value = 110
+    assert cache.get("mock-key") is None
+    assert cache.expirations == 1
+    assert len(cache) == 0
+
+
+@patch("src.common.ttl_cache.time.monotonic")
+def test_expiry_per_entry(mock_monotonic, cache):
+    mock_monotonic.return_value = 100
+    cache.put("mock-key", "mock-value", ttl_s=2)
+
+    mock_monotonic.return_value = 101
+    assert cache.get("mock-key") == "mock-value"
+
+    mock_monotonic.return_value = 102
+    assert cache.get("mock-key") is None
+
+
+def test_invalidate(cache):
+    cache.put("mock-key-1", 1)
+    cache.put("mock-key-2", 2)
+
+    cache.invalidate("mock-key-1")
+    cache.invalidate("nonexistant")
+    assert cache.get("mock-key-1") is None
+
+    cache.invalidate_if(lambda k, v: v == 2)
+    assert len(cache) == 0
@@ -0,0 +1,159 @@
+import pytest
+
+from unittest.mock import (
+    MagicMock,
+    patch,
+)
+
+from src.common.work_queue import (
+    InMemoryWorkQueue,
+    SQLiteWorkQueue,
+    SQSWorkQueue,
+    WorkItem,
+    as_sqs_event,
+    build_work_queue,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def work_queue(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryWorkQueue()
+
+    return SQLiteWorkQueue(str(tmp_path / "work-queue.db"))
+
+
+def test_enqueue_dequeue(work_queue):
+    work_queue.enqueue("mock-payload-1")
+    work_queue.enqueue("mock-payload-2")
+    work_queue.enqueue("mock-payload-3")
+
+    items = work_queue.dequeue(max_items=2)
+
+    assert [item.payload for item in items] == ["mock-payload-1", "mock-payload-2"]
+    # In-flight items aren't handed out again.
+    assert [item.payload for item in work_queue.dequeue()] == ["mock-payload-3"]
+    assert work_queue.dequeue() == []
+    assert len(work_queue) == 3
+
+
+def test_ack(work_queue):
+    work_queue.enqueue("mock-payload")
+    (item,) = work_queue.dequeue()
+
+    work_queue.ack(item)
+
+    assert len(work_queue) == 0
+    assert work_queue.dequeue() == []
+
+
+def test_release(work_queue):
+    work_queue.enqueue("mock-payload-1")
+    work_queue.enqueue("mock-payload-2")
+    item_1, item_2 = work_queue.dequeue()
+
+    work_queue.release(item_1)
+
+    assert work_queue.dequeue() == [item_1]
+    assert len(work_queue) == 2
+
+
+def test_sqlite_work_queue_persisted(tmp_path):
+    path = str(tmp_path / "work-queue.db")
+    SQLiteWorkQueue(path).enqueue("mock-payload")
+
+    items = SQLiteWorkQueue(path).dequeue()
+
+    assert [item.payload for item in items] == ["mock-payload"]
+
+
+def test_sqs_work_queue():
+    mock_sqs_client = MagicMock()
+    mock_sqs_client.send_message.return_value = {"MessageId": "mock-message-id"}
+    mock_sqs_client.receive_message.return_value = {
+        "Messages": [
+            {
+                "MessageId": "mock-message-id",
+                "Body": "mock-payload",
+                "ReceiptHandle": "mock-receipt",
+            },
+        ],
+    }
+    work_queue = SQSWorkQueue(mock_sqs_client, "mock-queue-url")
+
+    assert work_queue.enqueue("mock-payload") == "mock-message-id"
+    (item,) = work_queue.dequeue(max_items=20)
+    work_queue.release(item)
+    work_queue.ack(item)
+
+    assert item == WorkItem(id="mock-message-id", payload="mock-payload", receipt="mock-receipt")
+    mock_sqs_client.receive_message.assert_called_once_with(
+        QueueUrl="mock-queue-url",
+        MaxNumberOfMessages=10,
+    )
+    mock_sqs_client.change_message_visibility.assert_called_once_with(
+        QueueUrl="mock-queue-url",
+        ReceiptHandle="mock-receipt",
+        VisibilityTimeout=0,
+    )
+    mock_sqs_client.delete_message.assert_called_once_with(
+        QueueUrl="mock-queue-url",
+        ReceiptHandle="mock-receipt",
+    )
+
+
+@pytest.mark.parametrize(
+    "queue_url, expected_kwargs",
+    [
+        ("mock-queue-url", {}),
+        ("mock-queue-url.fifo", {"MessageGroupId": "mock-key"}),
+    ],
+)
+def test_sqs_work_queue_enqueue_key(queue_url, expected_kwargs):
+    mock_sqs_client = MagicMock()
+    work_queue = SQSWorkQueue(mock_sqs_client, queue_url)
+
+    work_queue.enqueue("mock-payload", key="mock-key")
+
+    mock_sqs_client.send_message.assert_called_once_with(
+        QueueUrl=queue_url,
+        MessageBody="mock-payload",
+        **expected_kwargs,
+    )
+
+
+def test_as_sqs_event():
+    work_queue = InMemoryWorkQueue()
+    work_queue.enqueue("mock-payload-1")
+    work_queue.enqueue("mock-payload-2")
+
+    actual = as_sqs_event(work_queue.dequeue())
+
+    assert [record["body"] for record in actual["Records"]] == ["mock-payload-1", "mock-payload-2"]
+    assert [record["messageId"] for record in actual["Records"]] == ["1", "2"]
+
+
+@patch("boto3.client")
+def test_build_work_queue_sqs(_mock_boto3_client):
+    actual = build_work_queue("sqs:mock-queue-url")
+
+    assert type(actual) is SQSWorkQueue
+    assert actual.queue_url == "mock-queue-url"
+
+
+@pytest.mark.parametrize(
+    "spec, expected_type",
+    [
+        (None, type(None)),
+        ("", type(None)),
+        ("memory", InMemoryWorkQueue),
+        ("sqlite::memory:", SQLiteWorkQueue),
+    ],
+)
+def test_build_work_queue(spec, expected_type):
+    assert type(build_work_queue(spec)) is expected_type
+
+
+def test_build_work_queue_unknown():
+    with pytest.raises(ValueError):
+        build_work_queue("nonexistant")
@@ -105,3 +105,61 @@ def test_bryti_handler_unknown_event_source(_mock_boto3_client, _mock_twitch_int
 
     assert actual == expected
     assert mock_handle_event.call_count == 0
+
+
+@patch("src.twitch.service.TwitchService.handle_batch")
+@patch("src.twitch.interface.TwitchInterface")
+@patch("boto3.client")
+def test_batch_handler(_mock_boto3_client, _mock_twitch_interface, mock_handle_batch):
+    from src import main
+
+    mock_handle_batch.return_value = ["mock-message-id-2"]
+    event = {
+        "Records": [
+            {"messageId": "mock-message-id-1", "body": "mock-body-1"},
+            {"messageId": "mock-message-id-2", "body": "mock-body-2"},
+        ],
+    }
+    expected = {"batchItemFailures": [{"itemIdentifier": "mock-message-id-2"}]}
+
+    actual = main.batch_handler(event, MOCK_CONTEXT)
+
+    assert actual == expected
+    mock_handle_batch.assert_called_once_with(event["Records"])
+
+
+@patch("src.twitch.service.TwitchService.handle_event")
+@patch("src.twitch.interface.TwitchInterface")
+@patch("boto3.client")
+def test_bryti_handler_twitch_invalid_headers(_mock_boto3_client, _mock_twitch_interface, mock_handle_event):
+    from src import main
+
+    event = {
+        **MOCK_TWITCH_EVENT,
+        "headers": {"twitch-eventsub-message-id": "mock-id"},
+    }
+
+    actual = main.app.resolve(event, MOCK_CONTEXT)
+
+    assert actual["statusCode"] == 401
+    assert mock_handle_event.call_count == 0
+
+
+@patch("src.twitch.interface.TwitchInterface")
+@patch("boto3.client")
+def test_bryti_handler_event_source_registry(_mock_boto3_client, _mock_twitch_interface):
+    from src import main
+
+    def mock_source_handler(headers, body):
+        return Response(status_code=200, content_type="text/plain", body=f"{headers['x-mock-source-id']}:{body}")
+
+    event = {
+        **MOCK_TWITCH_EVENT,
+        "headers": {"x-mock-source-id": "mock-id"},
+    }
+
+    with patch.dict(main.EVENT_SOURCES, {"x-mock-source-id": mock_source_handler}):
+        actual = main.app.resolve(event, MOCK_CONTEXT)
+
+    assert actual["statusCode"] == 200
+    assert actual["body"] == "mock-id:mock-body"
@@ -0,0 +1,92 @@
+import json
+import random
+
+from src.common.state_models import State
+from src.common.state_table_backends import InMemoryStateTableInterface
+from src.common.state_table_interface import StateTableInterface
+from src.twitch.models import TwitchHeaders
+from src.twitch.service import TwitchService
+from tools.load_generator import (
+    _worker,
+    load_recorded_events,
+    run_load,
+    send_in_worker,
+    sign_event,
+    synthetic_chat_event,
+)
+from tools.stand_ins import LatencyProxy
+
+
+def test_synthetic_chat_event_signed():
+    headers, body = synthetic_chat_event(random.Random(0), broadcasters=5, command_ratio=1)
+
+    parsed_headers = TwitchHeaders.model_validate(headers)
+
+    # Raises if the signature doesn't match.
+    TwitchService.verify_signature(None, parsed_headers, body)
+    assert json.loads(body)["event"]["message"]["text"].startswith("!bryti-loadtest ")
+
+
+def test_load_recorded_events(tmp_path):
+    headers, body = synthetic_chat_event(random.Random(0), broadcasters=5, command_ratio=0)
+    recorded_headers = {**headers, "Twitch-Eventsub-Message-Signature": "sha256=stale"}
+    del recorded_headers["twitch-eventsub-message-signature"]
+    path = tmp_path / "recorded.jsonl"
+    path.write_text(json.dumps({"headers": recorded_headers, "body": body}) + "\n")
+
+    (actual,) = load_recorded_events(str(path))
+
+    assert actual == (sign_event(headers, body), body)
+
+
+def test_run_load():
+    def mock_send(event):
+        if event == "mock-bad-event":
+            raise ValueError()
+
+        return 204
+
+    actual = run_load(mock_send, ["mock-event"] * 9 + ["mock-bad-event"], rate=None, concurrency=4)
+
+    assert actual["events"] == 10
+    assert actual["statuses"] == {"204": 9, "ValueError": 1}
+    assert set(actual["latency_ms"]) == {"p50", "p95", "p99", "max", "mean"}
+
+
+def test_latency_proxy_counts_calls():
+    state_table = LatencyProxy(InMemoryStateTableInterface(), StateTableInterface.__abstractmethods__)
+
+    state_table.target.update_state(State(user="mock-user", twitch_user_id="mock-twitch-id"))
+    state_table.target.get_state("mock-user")
+    state_table.target.get_state("mock-user")
+
+    assert state_table.calls == {"_write_state": 1, "_read_state": 2}
+
+
+def test_latency_proxy_skips_cached_lookups():
+    state_table = LatencyProxy(InMemoryStateTableInterface(), StateTableInterface.__abstractmethods__)
+
+    state_table.target.lookup_by_twitch("mock-twitch-id")
+    state_table.target.lookup_by_twitch("mock-twitch-id")
+    state_table.target.fetch_twitch_context("mock-twitch-id", "mock-chatter-id")
+
+    # The broadcaster's (not found) lookup is cached, so only the chatter's lookup is a round trip.
+    assert state_table.calls == {"_find_user": 2}
+
+
+def test_send_in_worker(monkeypatch):
+    state_table = LatencyProxy(InMemoryStateTableInterface(), StateTableInterface.__abstractmethods__)
+
+    def mock_send(event):
+        state_table.target.get_state("mock-user")
+        if event == "mock-bad-event":
+            raise ValueError()
+
+        return 204
+
+    monkeypatch.setattr(_worker, "send", mock_send)
+    monkeypatch.setattr(_worker, "downstreams", {"state_table": state_table})
+
+    # Each event reports only its own calls, even if it failed.
+    assert send_in_worker("mock-event")[:2] == (204, {"state_table": {"_read_state": 1}})
+    assert send_in_worker("mock-bad-event")[:2] == ("ValueError", {"state_table": {"_read_state": 1}})
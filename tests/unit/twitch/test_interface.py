@@ -5,31 +5,59 @@ from typing import List
 from unittest.mock import patch
 
 from src.twitch.interface import (
+    RESPONSE_MODELS,
     TwitchError,
     TwitchInterface,
+    TwitchUnauthorizedError,
+    build_response_models,
+    get_response_model,
 )
 from src.twitch.models import (
     TwitchEventSubscription,
     TwitchEventSubscriptionCondition,
     TwitchEventSubscriptionTransport,
+    TwitchResponse,
 )
 
 
 @pytest.fixture
 def twitch_interface():
-    with patch("src.twitch.interface.TwitchInterface.validate_token"):
-        yield TwitchInterface("mock-client-id", "mock-client-secret", bearer_token="mock-bearer-token")
+    return TwitchInterface("mock-client-id", "mock-client-secret", bearer_token="mock-bearer-token")
 
 
 @patch("src.twitch.interface.TwitchInterface.validate_token")
 @patch("src.twitch.interface.TwitchInterface.get_client_credentials_token")
 def test_init(mock_get_client_credentials, mock_validate_token):
-    mock_get_client_credentials.return_value = "mock-bearer-token"
-
     TwitchInterface("mock-client-id", "mock-client-secret")
 
-    mock_get_client_credentials.assert_called_once()
-    mock_validate_token.assert_called_once()
+    mock_get_client_credentials.assert_not_called()
+    mock_validate_token.assert_not_called()
+
+
+@patch("src.twitch.interface.time.monotonic")
+@patch("src.twitch.interface.TwitchInterface.validate_token")
+@patch("src.twitch.interface.TwitchInterface.get_client_credentials_token")
+def test_bearer_token_lazy(mock_get_client_credentials, mock_validate_token, mock_monotonic):
+    mock_get_client_credentials.side_effect = ["mock-bearer-token", "mock-bearer-token-2"]
+    mock_validate_token.return_value = 3600
+    mock_monotonic.return_value = 1000
+    twitch_interface = TwitchInterface("mock-client-id", "mock-client-secret")
+
+    # Fetched on first use, then cached.
+    assert twitch_interface.bearer_token == "mock-bearer-token"
+    assert twitch_interface.bearer_token == "mock-bearer-token"
+    assert mock_get_client_credentials.call_count == 1
+    assert mock_validate_token.call_count == 1
+
+    # Still outside of the refresh margin.
+    mock_monotonic.return_value = 1000 + 3600 - 301
+    assert twitch_interface.bearer_token == "mock-bearer-token"
+
+    # Refreshed ahead of expiry.
+    mock_monotonic.return_value = 1000 + 3600 - 300
+    assert twitch_interface.bearer_token == "mock-bearer-token-2"
+    assert mock_get_client_credentials.call_count == 2
+    assert mock_validate_token.call_count == 2
 
 
 def test_send_request(twitch_interface):
@@ -50,9 +78,114 @@ def test_send_request(twitch_interface):
         assert actual == response
 
         mock_requests.post(url, request_headers=headers, status_code=401)
+        with pytest.raises(TwitchUnauthorizedError) as e:
+            twitch_interface._send_request("POST", url, headers, DataType=dict)
+
+        mock_requests.post(url, request_headers=headers, status_code=500)
         with pytest.raises(TwitchError) as e:
             twitch_interface._send_request("POST", url, headers, DataType=dict)
-            assert e == True
+
+
+def test_get_response_model():
+    build_response_models()
+    assert List[TwitchEventSubscription] in RESPONSE_MODELS
+
+    actual = get_response_model(List[TwitchEventSubscription])
+
+    assert actual is TwitchResponse[List[TwitchEventSubscription]]
+    assert actual is get_response_model(List[TwitchEventSubscription])
+
+
+def test_send_request_data_type(twitch_interface):
+    url = "https://api.twitch.tv/mock/endpoint"
+    subscription = {
+        "id": "mock-id",
+        "type": "mock-type",
+        "version": "1",
+        "status": "mock-status",
+        "cost": 0,
+        "condition": {},
+        "created_at": "mock-timestamp",
+        "transport": {"method": "webhook", "callback": "mock-callback"},
+    }
+    with requests_mock.Mocker() as mock_requests:
+        mock_requests.get(url, json={"data": [subscription], "total": 1})
+        actual = twitch_interface._send_request("GET", url, DataType=List[TwitchEventSubscription])
+        assert actual == [TwitchEventSubscription.model_validate(subscription)]
+
+        mock_requests.get(url, json={"total": 1})
+        with pytest.raises(TwitchError):
+            twitch_interface._send_request("GET", url, DataType=List[TwitchEventSubscription])
+
+        mock_requests.get(url, text="not-json")
+        with pytest.raises(TwitchError):
+            twitch_interface._send_request("GET", url, DataType=List[TwitchEventSubscription])
+
+
+def test_session():
+    twitch_interface = TwitchInterface(
+        "mock-client-id",
+        "mock-client-secret",
+        pool_size=8,
+        connect_timeout_s=1,
+        read_timeout_s=2,
+        max_retries=3,
+    )
+
+    assert twitch_interface.timeout == (1, 2)
+    assert twitch_interface.session.get_adapter("https://api.twitch.tv") is twitch_interface.adapter
+    assert twitch_interface.adapter._pool_maxsize == 8
+    assert twitch_interface.adapter.max_retries.total == 3
+    assert 503 in twitch_interface.adapter.max_retries.status_forcelist
+
+
+def test_send_request_reuses_session(twitch_interface):
+    url = "https://api.twitch.tv/mock/endpoint"
+    with requests_mock.Mocker() as mock_requests:
+        mock_requests.get(url, json={})
+        twitch_interface._send_request("GET", url)
+        twitch_interface._send_request("GET", url)
+
+        assert mock_requests.call_count == 2
+        assert all(r.timeout == twitch_interface.timeout for r in mock_requests.request_history)
+
+
+def test_get_connection_stats(twitch_interface):
+    assert twitch_interface.get_connection_stats() == {}
+
+    pool = twitch_interface.adapter.poolmanager.connection_from_url("https://api.twitch.tv")
+    pool.num_connections = 1
+    pool.num_requests = 5
+
+    actual = twitch_interface.get_connection_stats()
+
+    assert actual == {
+        "https://api.twitch.tv": {"connections": 1, "requests": 5, "reused": 4},
+    }
+
+
+@patch("src.twitch.interface.TwitchInterface.refresh_token")
+@patch("src.twitch.interface.TwitchInterface._send_request")
+def test_send_helix_request_unauthorized(mock_send_request, mock_refresh_token, twitch_interface):
+    mock_send_request.side_effect = [TwitchUnauthorizedError(), "mock-response"]
+
+    actual = twitch_interface._send_helix_request("GET", "https://api.twitch.tv/mock/endpoint")
+
+    assert actual == "mock-response"
+    assert mock_send_request.call_count == 2
+    mock_refresh_token.assert_called_once()
+
+
+@patch("src.twitch.interface.TwitchInterface.refresh_token")
+@patch("src.twitch.interface.TwitchInterface._send_request")
+def test_send_helix_request_unauthorized_twice(mock_send_request, mock_refresh_token, twitch_interface):
+    mock_send_request.side_effect = TwitchUnauthorizedError()
+
+    with pytest.raises(TwitchUnauthorizedError):
+        twitch_interface._send_helix_request("GET", "https://api.twitch.tv/mock/endpoint")
+
+    assert mock_send_request.call_count == 2
+    mock_refresh_token.assert_called_once()
 
 
 @patch("src.twitch.interface.TwitchInterface._send_request")
@@ -71,10 +204,14 @@ def test_get_client_credentials_token(mock_send_request, twitch_interface):
 
 
 @patch("src.twitch.interface.TwitchInterface._send_request")
-def test_validate_token(mock_send_request):
+def test_validate_token(mock_send_request, twitch_interface):
     expected_headers = {"Authorization": "Bearer mock-bearer-token"}
-    TwitchInterface("mock-client-id", "mock-client-secret", bearer_token="mock-bearer-token")
+    mock_send_request.return_value = {"expires_in": 3600}
+
+    actual = twitch_interface.validate_token()
+
     mock_send_request.assert_called_once_with("GET", "https://id.twitch.tv/oauth2/validate", headers=expected_headers)
+    assert actual == 3600
 
 
 @patch("src.twitch.interface.TwitchInterface._send_request")
@@ -90,6 +227,7 @@ def test_get_event_subscriptions(mock_send_request, twitch_interface):
         "GET",
         "https://api.twitch.tv/helix/eventsub/subscriptions",
         headers=expected_headers,
+        payload=None,
         DataType=List[TwitchEventSubscription],
     )
 
@@ -140,4 +278,5 @@ def test_send_chat_message(mock_send_request, twitch_interface):
         "https://api.twitch.tv/helix/chat/messages",
         headers=expected_headers,
         payload=expected_payload,
+        DataType=None,
     )
@@ -0,0 +1,82 @@
+from pydantic import (
+    BaseModel,
+    ValidationError,
+)
+import pytest
+
+import json
+from unittest.mock import patch
+
+from src.twitch.models import (
+    NOTIFICATION_MODELS,
+    TwitchNotificationEvent,
+    register_notification_event,
+)
+from src.twitch.notification_models import (
+    TwitchChannelChatMessage,
+    TwitchStreamOffline,
+    TwitchStreamOnline,
+)
+
+
+MOCK_SUBSCRIPTION = {
+    "id": "mock-id",
+    "type": "stream.offline",
+    "version": 1,
+    "status": "mock-status",
+    "cost": 0,
+    "condition": {},
+    "created_at": "mock-timestamp",
+    "transport": {
+        "method": "webhook",
+        "callback": "mock-callback",
+    },
+}
+
+MOCK_STREAM_ONLINE_EVENT = {
+    "broadcaster_user_id": "mock-broadcaster-id",
+    "broadcaster_user_login": "mock-broadcaster-login",
+    "broadcaster_user_name": "mock-broadcaster-name",
+    "id": "mock-id",
+    "type": "live",
+    "started_at": "mock-timestamp",
+}
+
+
+@pytest.mark.parametrize(
+    "subscription_type, EventModel",
+    [
+        ("channel.chat.message", TwitchChannelChatMessage),
+        ("stream.online", TwitchStreamOnline),
+        ("stream.offline", TwitchStreamOffline),
+    ],
+)
+def test_notification_models(subscription_type, EventModel):
+    assert NOTIFICATION_MODELS[subscription_type] is TwitchNotificationEvent[EventModel]
+
+
+def test_notification_model_parses_into_own_model():
+    # A stream.online event also fits the stream.offline model, but is parsed by its subscription type instead.
+    body = json.dumps({"subscription": MOCK_SUBSCRIPTION, "event": MOCK_STREAM_ONLINE_EVENT})
+
+    actual = NOTIFICATION_MODELS["stream.offline"].model_validate_json(body)
+
+    assert type(actual.event) is TwitchStreamOffline
+
+    with pytest.raises(ValidationError):
+        NOTIFICATION_MODELS["stream.online"].model_validate_json(
+            json.dumps({"subscription": MOCK_SUBSCRIPTION, "event": {"broadcaster_user_id": "mock-broadcaster-id"}})
+        )
+
+
+@patch.dict("src.twitch.models.NOTIFICATION_MODELS")
+def test_register_notification_event():
+    class MockEvent(BaseModel):
+        mock_field: str
+
+    register_notification_event("mock.subscription.type", MockEvent)
+    body = json.dumps({"subscription": MOCK_SUBSCRIPTION, "event": {"mock_field": "mock-value"}})
+
+    actual = NOTIFICATION_MODELS["mock.subscription.type"].model_validate_json(body)
+
+    assert actual.event == MockEvent(mock_field="mock-value")
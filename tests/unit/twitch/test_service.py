@@ -9,7 +9,17 @@ from unittest.mock import (
     patch,
 )
 
+from src.common.api_interfaces import APIInterfaces
+from src.common.commands import (
+    DeathsAddCommand,
+    DeathsInfoCommand,
+    DeathsSetCommand,
+    InvalidCommandArgsError,
+    StatusCommand,
+    TwitchConnectCommand,
+)
 from src.common.state_models import (
+    EventContext,
     LookupFields,
     Permission,
     State,
@@ -19,9 +29,18 @@ from src.twitch.models import (
     TwitchHeaders,
 )
 from src.twitch.notification_models import TwitchChannelChatMessage
+from src.common.state_table_backends import InMemoryStateTableInterface
+from src.common.state_table_interface import VersionConflictError
+from src.common.lanes import KeyedLanes
+from src.common.telemetry import telemetry
+from src.common.work_queue import (
+    InMemoryWorkQueue,
+    as_sqs_event,
+)
 from src.twitch.service import (
     TwitchService,
     TwitchSignatureMismatchError,
+    metrics,
 )
 
 
@@ -49,6 +68,11 @@ DEFAULT_MOCK_SUBSCRIPTION = {
     },
 }
 
+MOCK_CHAT_MESSAGE_SUBSCRIPTION = {
+    **DEFAULT_MOCK_SUBSCRIPTION,
+    "type": "channel.chat.message",
+}
+
 DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE = {
     "broadcaster_user_id": "mock-broadcaster-id",
     "broadcaster_user_name": "mock-broadcaster-name",
@@ -93,15 +117,15 @@ def twitch_service(mock_api_interfaces):
 
 
 @pytest.mark.parametrize(
-    "event_type, service_function_name",
+    "event_type, service_function_name, kwargs",
     [
-        (TwitchEventType.CHALLENGE, "handle_challenge"),
-        (TwitchEventType.NOTIFICATION, "handle_notification"),
-        (TwitchEventType.REVOCATION, "handle_revocation"),
+        (TwitchEventType.CHALLENGE, "handle_challenge", {}),
+        (TwitchEventType.NOTIFICATION, "handle_notification", {"event_id": "mock-id"}),
+        (TwitchEventType.REVOCATION, "handle_revocation", {}),
     ],
 )
 @patch("src.twitch.service.TwitchService.verify_signature")
-def test_handle_event(mock_verify_signature, twitch_service, event_type, service_function_name):
+def test_handle_event(mock_verify_signature, twitch_service, event_type, service_function_name, kwargs):
     headers = TwitchHeaders.model_validate({
         **DEFAULT_MOCK_HEADERS,
         "twitch-eventsub-message-type": event_type,
@@ -110,7 +134,104 @@ def test_handle_event(mock_verify_signature, twitch_service, event_type, service
         twitch_service.handle_event(headers, "mock-body")
 
         mock_verify_signature.assert_called_with(headers, "mock-body")
-        mock_service_fn.assert_called_with("mock-body")
+        mock_service_fn.assert_called_with("mock-body", **kwargs)
+
+
+@patch("src.twitch.service.TwitchService.process_notification")
+@patch("src.twitch.service.TwitchService.verify_signature")
+def test_handle_event_duplicate(mock_verify_signature, mock_process_notification, mock_api_interfaces, twitch_service):
+    headers = TwitchHeaders.model_validate({
+        **DEFAULT_MOCK_HEADERS,
+        "twitch-eventsub-message-retry": "1",
+    })
+    body = json.dumps({"event": MOCK_ADD_COMMAND_CHANNEL_CHAT_MESSAGE, "subscription": MOCK_CHAT_MESSAGE_SUBSCRIPTION})
+    mock_api_interfaces.state_table.claim_event.return_value = False
+
+    response = twitch_service.handle_event(headers, body)
+
+    assert response.status_code == 204
+    mock_verify_signature.assert_called_once()
+    mock_api_interfaces.state_table.claim_event.assert_called_once_with("mock-id", 3600)
+    mock_process_notification.assert_not_called()
+
+    # Seen by this instance now, so caught without another claim.
+    twitch_service.handle_event(headers, body)
+    mock_api_interfaces.state_table.claim_event.assert_called_once()
+
+
+@patch("src.twitch.service.TwitchService.process_notification")
+@patch("src.twitch.service.TwitchService.verify_signature")
+def test_handle_event_failure_releases_claim(mock_verify_signature, mock_process_notification, mock_api_interfaces, twitch_service):
+    headers = TwitchHeaders.model_validate(DEFAULT_MOCK_HEADERS)
+    body = json.dumps({"event": MOCK_ADD_COMMAND_CHANNEL_CHAT_MESSAGE, "subscription": MOCK_CHAT_MESSAGE_SUBSCRIPTION})
+    mock_api_interfaces.state_table.claim_event.return_value = True
+    mock_process_notification.side_effect = Exception
+
+    with pytest.raises(Exception):
+        twitch_service.handle_event(headers, body)
+
+    mock_api_interfaces.state_table.release_event.assert_called_once_with("mock-id")
+
+
+@patch("src.twitch.service.TwitchService.process_notification")
+@patch("src.twitch.service.TwitchService.verify_signature")
+def test_handle_event_non_command_not_claimed(mock_verify_signature, mock_process_notification, mock_api_interfaces, twitch_service):
+    headers = TwitchHeaders.model_validate(DEFAULT_MOCK_HEADERS)
+    body = json.dumps({"event": DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE, "subscription": MOCK_CHAT_MESSAGE_SUBSCRIPTION})
+
+    response = twitch_service.handle_event(headers, body)
+
+    # Acknowledged without a write to the table.
+    assert response.status_code == 204
+    mock_api_interfaces.state_table.claim_event.assert_not_called()
+    mock_process_notification.assert_not_called()
+
+
+@pytest.mark.parametrize("text", ["!mock-command-prefix status", "!mock-command-prefix nonexistant"])
+@patch("src.twitch.service.TwitchService.process_notification")
+@patch("src.twitch.service.TwitchService.verify_signature")
+def test_handle_event_command_fetching_nothing_not_claimed(mock_verify_signature, mock_process_notification, mock_api_interfaces, twitch_service, text):
+    headers = TwitchHeaders.model_validate(DEFAULT_MOCK_HEADERS)
+    event = {**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE, "message": {"text": text, "fragments": []}}
+    body = json.dumps({"event": event, "subscription": MOCK_CHAT_MESSAGE_SUBSCRIPTION})
+
+    twitch_service.handle_event(headers, body)
+    twitch_service.handle_event(headers, body)
+
+    # Only a duplicate reply is at stake, so re-deliveries are only caught in-memory (without a write to the table).
+    mock_process_notification.assert_called_once()
+    mock_api_interfaces.state_table.claim_event.assert_not_called()
+
+
+@patch("src.twitch.service.TwitchService.handle_revocation")
+@patch("src.twitch.service.TwitchService.verify_signature")
+def test_handle_event_revocation_claimed(mock_verify_signature, mock_handle_revocation, mock_api_interfaces, twitch_service):
+    headers = TwitchHeaders.model_validate({
+        **DEFAULT_MOCK_HEADERS,
+        "twitch-eventsub-message-type": TwitchEventType.REVOCATION,
+    })
+    mock_api_interfaces.state_table.claim_event.return_value = False
+
+    response = twitch_service.handle_event(headers, "mock-body")
+
+    assert response.status_code == 204
+    mock_api_interfaces.state_table.claim_event.assert_called_once_with("mock-id", 3600)
+    mock_handle_revocation.assert_not_called()
+
+
+@patch("src.twitch.service.TwitchService.handle_challenge")
+@patch("src.twitch.service.TwitchService.verify_signature")
+def test_handle_event_challenge_not_deduplicated(mock_verify_signature, mock_handle_challenge, mock_api_interfaces, twitch_service):
+    headers = TwitchHeaders.model_validate({
+        **DEFAULT_MOCK_HEADERS,
+        "twitch-eventsub-message-type": TwitchEventType.CHALLENGE,
+    })
+
+    twitch_service.handle_event(headers, "mock-body")
+    twitch_service.handle_event(headers, "mock-body")
+
+    assert mock_handle_challenge.call_count == 2
+    mock_api_interfaces.state_table.claim_event.assert_not_called()
 
 
 def test_verify_signature(twitch_service):
@@ -144,18 +265,34 @@ def test_handle_challenge(twitch_service):
     assert response.body == "mock-challenge"
 
 
+MOCK_COMMAND_CHANNEL_CHAT_MESSAGE = {
+    **DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE,
+    "message": {
+        "text": "!mock-command-prefix status",
+        "fragments": [],
+    },
+}
+MOCK_ADD_COMMAND_CHANNEL_CHAT_MESSAGE = {
+    **DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE,
+    "message": {
+        "text": "!mock-command-prefix deaths add",
+        "fragments": [],
+    },
+}
+
+
 @pytest.mark.parametrize(
-    "event, service_function_name",
+    "subscription_type, event, service_function_name",
     [
-        (DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE, "handle_chat_message"),
-        (MOCK_STREAM_ONLINE_EVENT, "handle_stream_event"),
-        (MOCK_STREAM_OFFLINE_EVENT, "handle_stream_event"),
+        ("channel.chat.message", MOCK_COMMAND_CHANNEL_CHAT_MESSAGE, "handle_chat_message"),
+        ("stream.online", MOCK_STREAM_ONLINE_EVENT, "handle_stream_event"),
+        ("stream.offline", MOCK_STREAM_OFFLINE_EVENT, "handle_stream_event"),
     ],
 )
-def test_handle_notification(twitch_service, event, service_function_name):
+def test_handle_notification(twitch_service, subscription_type, event, service_function_name):
     body = {
         "event": event,
-        "subscription": DEFAULT_MOCK_SUBSCRIPTION,
+        "subscription": {**DEFAULT_MOCK_SUBSCRIPTION, "type": subscription_type},
     }
     with patch(f"src.twitch.service.TwitchService.{service_function_name}") as mock_service_fn:
         response = twitch_service.handle_notification(json.dumps(body))
@@ -166,17 +303,240 @@ def test_handle_notification(twitch_service, event, service_function_name):
         mock_service_fn.assert_called_once()
 
 
+@pytest.mark.parametrize(
+    "chatter_user_id, text",
+    [
+        ("mock-chatter-id", "mock-text"),
+        ("mock-chatter-id", ""),
+        ("mock-user-id", "!mock-command-prefix status"),
+    ],
+)
+@patch("src.twitch.service.NOTIFICATION_MODELS")
 @patch("src.twitch.service.TwitchService.handle_chat_message")
-def test_handle_notification_channel_chat_message_same_user_id(mock_handle_chat_message, twitch_service):
+def test_handle_notification_prefilter(mock_handle_chat_message, mock_notification_models, twitch_service, chatter_user_id, text):
     body = {
         "event": {
             **DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE,
-            "chatter_user_id": "mock-user-id",
+            "chatter_user_id": chatter_user_id,
+            "message": {"text": text, "fragments": []},
         },
+        "subscription": MOCK_CHAT_MESSAGE_SUBSCRIPTION,
+    }
+    response = twitch_service.handle_notification(json.dumps(body))
+
+    assert response.status_code == 204
+    # Acknowledged without fully parsing the event.
+    mock_notification_models.get.assert_not_called()
+    mock_handle_chat_message.assert_not_called()
+
+
+@patch("src.twitch.service.TwitchService.handle_stream_event")
+@patch("src.twitch.service.TwitchService.handle_chat_message")
+def test_handle_notification_unsupported_subscription_type(mock_handle_chat_message, mock_handle_stream_event, twitch_service):
+    body = {
+        "event": MOCK_STREAM_ONLINE_EVENT,
         "subscription": DEFAULT_MOCK_SUBSCRIPTION,
     }
     response = twitch_service.handle_notification(json.dumps(body))
 
+    assert response.status_code == 204
+    mock_handle_chat_message.assert_not_called()
+    mock_handle_stream_event.assert_not_called()
+
+
+@patch("src.twitch.service.TwitchService.process_notification")
+def test_handle_notification_deferred(mock_process_notification, twitch_service):
+    twitch_service.work_queue = InMemoryWorkQueue()
+    body = json.dumps({
+        "event": MOCK_COMMAND_CHANNEL_CHAT_MESSAGE,
+        "subscription": MOCK_CHAT_MESSAGE_SUBSCRIPTION,
+    })
+
+    response = twitch_service.handle_notification(body)
+
+    assert response.status_code == 204
+    mock_process_notification.assert_not_called()
+    (item,) = twitch_service.work_queue.dequeue()
+    assert json.loads(item.payload) == {
+        "subscription_type": "channel.chat.message",
+        "broadcaster_user_id": "mock-broadcaster-id",
+        "body": body,
+    }
+
+
+@patch("src.twitch.service.TwitchService.handle_chat_message")
+def test_drain_work_queue(mock_handle_chat_message, twitch_service):
+    twitch_service.work_queue = InMemoryWorkQueue()
+    for _ in range(3):
+        twitch_service.handle_notification(json.dumps({
+            "event": MOCK_COMMAND_CHANNEL_CHAT_MESSAGE,
+            "subscription": MOCK_CHAT_MESSAGE_SUBSCRIPTION,
+        }))
+
+    actual = twitch_service.drain_work_queue(max_items=2)
+
+    assert actual == 3
+    assert mock_handle_chat_message.call_count == 3
+    assert len(twitch_service.work_queue) == 0
+
+
+@patch("src.twitch.service.TwitchService.handle_chat_message")
+def test_drain_work_queue_failure(mock_handle_chat_message, twitch_service):
+    twitch_service.work_queue = InMemoryWorkQueue()
+    for _ in range(3):
+        twitch_service.handle_notification(json.dumps({
+            "event": MOCK_COMMAND_CHANNEL_CHAT_MESSAGE,
+            "subscription": MOCK_CHAT_MESSAGE_SUBSCRIPTION,
+        }))
+    mock_handle_chat_message.side_effect = [None, Exception]
+
+    with pytest.raises(Exception):
+        twitch_service.drain_work_queue()
+
+    # The failed item (and the rest after it) are put back, in order.
+    assert [item.id for item in twitch_service.work_queue.dequeue()] == ["2", "3"]
+
+
+def test_drain_work_queue_no_queue(twitch_service):
+    assert twitch_service.drain_work_queue() == 0
+
+
+def mock_queued_record(message_id, broadcaster_user_id, text):
+    body = json.dumps({
+        "event": {
+            **DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE,
+            "broadcaster_user_id": broadcaster_user_id,
+            "chatter_user_id": broadcaster_user_id,
+            "message": {"text": text, "fragments": []},
+        },
+        "subscription": MOCK_CHAT_MESSAGE_SUBSCRIPTION,
+    })
+    return {
+        "messageId": message_id,
+        "body": json.dumps({
+            "subscription_type": "channel.chat.message",
+            "broadcaster_user_id": broadcaster_user_id,
+            "body": body,
+        }),
+    }
+
+
+@patch("src.twitch.service.datetime", create=True)
+def test_handle_batch(_mock_datetime, mock_api_interfaces, twitch_service):
+    records = [
+        mock_queued_record("mock-message-id-1", "mock-broadcaster-id-1", "!mock-command-prefix deaths set 4"),
+        mock_queued_record("mock-message-id-2", "mock-broadcaster-id-2", "!mock-command-prefix crimes set 1"),
+        mock_queued_record("mock-message-id-3", "mock-broadcaster-id-1", "!mock-command-prefix crimes add"),
+    ]
+
+    def mock_fetch_twitch_context(broadcaster_user_id, chatter_user_id, **kwargs):
+        return EventContext(state=State(user=broadcaster_user_id, version=1))
+
+    mock_api_interfaces.state_table.fetch_twitch_context.side_effect = mock_fetch_twitch_context
+    mock_api_interfaces.state_table.update_state.side_effect = lambda state: state
+
+    actual = twitch_service.handle_batch(records)
+
+    assert actual == []
+    # State is read + written once per broadcaster, with the commands applied in order.
+    assert mock_api_interfaces.state_table.fetch_twitch_context.call_count == 2
+    assert mock_api_interfaces.state_table.update_state.call_count == 2
+    mock_api_interfaces.state_table.increment_counter.assert_not_called()
+    written_states = {c.args[0].user: c.args[0] for c in mock_api_interfaces.state_table.update_state.call_args_list}
+    assert written_states["mock-broadcaster-id-1"].deaths.count == 4
+    assert written_states["mock-broadcaster-id-1"].crimes.count == 1
+    assert written_states["mock-broadcaster-id-2"].crimes.count == 1
+    assert mock_api_interfaces.twitch.send_chat_message.call_count == 3
+
+
+@patch("src.twitch.service.datetime", create=True)
+def test_handle_batch_send_failure_after_flush(_mock_datetime, mock_api_interfaces, twitch_service):
+    records = [
+        mock_queued_record("mock-message-id-1", "mock-broadcaster-id-1", "!mock-command-prefix crimes add"),
+        mock_queued_record("mock-message-id-2", "mock-broadcaster-id-1", "!mock-command-prefix status"),
+    ]
+    mock_api_interfaces.state_table.fetch_twitch_context.return_value = EventContext(
+        state=State(user="mock-broadcaster-id-1", version=1),
+    )
+    mock_api_interfaces.state_table.update_state.side_effect = lambda state: state
+    mock_api_interfaces.twitch.send_chat_message.side_effect = [Exception("mock-error"), None]
+
+    actual = twitch_service.handle_batch(records)
+
+    # The state was written, so the group isn't retried (which would apply the increment twice).
+    assert actual == []
+    mock_api_interfaces.state_table.update_state.assert_called_once()
+    assert mock_api_interfaces.twitch.send_chat_message.call_count == 2
+    metrics.clear_metrics()
+
+
+def test_handle_batch_failures(mock_api_interfaces, twitch_service):
+    records = [
+        mock_queued_record("mock-message-id-1", "mock-broadcaster-id-1", "!mock-command-prefix deaths set 4"),
+        mock_queued_record("mock-message-id-2", "mock-broadcaster-id-2", "!mock-command-prefix crimes set 1"),
+        mock_queued_record("mock-message-id-3", "mock-broadcaster-id-1", "!mock-command-prefix status"),
+        {"messageId": "mock-message-id-4", "body": "not-json"},
+    ]
+
+    def mock_fetch_twitch_context(broadcaster_user_id, chatter_user_id, **kwargs):
+        return EventContext(state=State(user=broadcaster_user_id, version=1))
+
+    def mock_update_state(state):
+        if state.user == "mock-broadcaster-id-1":
+            raise VersionConflictError()
+        return state
+
+    mock_api_interfaces.state_table.fetch_twitch_context.side_effect = mock_fetch_twitch_context
+    mock_api_interfaces.state_table.update_state.side_effect = mock_update_state
+
+    actual = twitch_service.handle_batch(records)
+
+    # The whole conflicting broadcaster's group is retried, and nothing was replied to in it.
+    assert sorted(actual) == ["mock-message-id-1", "mock-message-id-3", "mock-message-id-4"]
+    mock_api_interfaces.twitch.send_chat_message.assert_called_once()
+    assert mock_api_interfaces.twitch.send_chat_message.call_args.args[0] == "mock-broadcaster-id-2"
+
+
+def test_handle_batch_from_work_queue(mock_api_interfaces, twitch_service):
+    twitch_service.work_queue = InMemoryWorkQueue()
+    mock_api_interfaces.state_table.fetch_twitch_context.return_value = EventContext()
+    twitch_service.handle_notification(json.dumps({
+        "event": MOCK_COMMAND_CHANNEL_CHAT_MESSAGE,
+        "subscription": MOCK_CHAT_MESSAGE_SUBSCRIPTION,
+    }))
+    event = as_sqs_event(twitch_service.work_queue.dequeue())
+
+    actual = twitch_service.handle_batch(event["Records"])
+
+    assert actual == []
+    mock_api_interfaces.twitch.send_chat_message.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "chatter_user_id, text, expected",
+    [
+        ("mock-chatter-id", "!mock-command-prefix status", True),
+        ("mock-chatter-id", " !MOCK-COMMAND-PREFIX ", True),
+        ("mock-chatter-id", "mock-text !mock-command-prefix", False),
+        ("mock-chatter-id", "", False),
+        ("mock-user-id", "!mock-command-prefix status", False),
+    ],
+)
+def test_is_command_invocation(twitch_service, chatter_user_id, text, expected):
+    assert twitch_service.is_command_invocation(chatter_user_id, text) == expected
+
+
+@patch("src.twitch.service.TwitchService.handle_chat_message")
+def test_handle_notification_channel_chat_message_same_user_id(mock_handle_chat_message, twitch_service):
+    body = {
+        "event": {
+            **MOCK_COMMAND_CHANNEL_CHAT_MESSAGE,
+            "chatter_user_id": "mock-user-id",
+        },
+        "subscription": MOCK_CHAT_MESSAGE_SUBSCRIPTION,
+    }
+    response = twitch_service.handle_notification(json.dumps(body))
+
     assert response.status_code == 204
     assert response.content_type == "application/json"
     assert response.body == "{}"
@@ -223,7 +583,7 @@ def test_handle_chat_message_nonexistant_command(mock_resolve_command, mock_api_
 def test_handle_chat_message_cannot_invoke(mock_resolve_command, mock_retrieve_event_context, mock_api_interfaces, twitch_service):
     event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
     event.message.text = "!mock-command-prefix arg1 arg2 arg3"
-    mock_command = MagicMock()
+    mock_command = MagicMock(__name__="MockCommand")
     mock_resolve_command.return_value = (mock_command, ["arg2", "arg3"])
     mock_state = MagicMock()
     mock_retrieve_event_context.return_value = (False, mock_state, Permission.EVERYBODY)
@@ -231,7 +591,7 @@ def test_handle_chat_message_cannot_invoke(mock_resolve_command, mock_retrieve_e
     twitch_service.handle_chat_message(event)
 
     mock_resolve_command.assert_called_once_with(["arg1", "arg2", "arg3"])
-    mock_retrieve_event_context.assert_called_once_with(event)
+    mock_retrieve_event_context.assert_called_once_with(event, mock_command)
     mock_command.assert_not_called()
     mock_api_interfaces.twitch.send_chat_message.assert_not_called()
 
@@ -241,23 +601,17 @@ def test_handle_chat_message_cannot_invoke(mock_resolve_command, mock_retrieve_e
 def test_handle_chat_message_bad_command(mock_resolve_command, mock_retrieve_event_context, mock_api_interfaces, twitch_service):
     event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
     event.message.text = "!mock-command-prefix arg1 arg2 arg3"
-    mock_command = MagicMock()
-    mock_command_obj = mock_command.return_value
-    mock_command_obj.execute.side_effect = TypeError
-    mock_resolve_command.return_value = (mock_command, ["arg2", "arg3"])
-    mock_state = MagicMock()
-    mock_retrieve_event_context.return_value = (True, mock_state, Permission.EVERYBODY)
+    mock_resolve_command.side_effect = InvalidCommandArgsError("arg1 <mock-arg>")
 
     twitch_service.handle_chat_message(event)
 
     mock_resolve_command.assert_called_once_with(["arg1", "arg2", "arg3"])
-    mock_retrieve_event_context.assert_called_once_with(event)
-    mock_command.assert_called_once_with(mock_api_interfaces, mock_state, Permission.EVERYBODY)
-    mock_command_obj.execute.assert_called_once_with("arg2", "arg3")
+    # Rejected without fetching anything.
+    mock_retrieve_event_context.assert_not_called()
     mock_api_interfaces.twitch.send_chat_message.assert_called_with(
         "mock-broadcaster-id",
         "mock-user-id",
-        "Invalid call to command!",
+        "Invalid call to command! Usage: !mock-command-prefix arg1 <mock-arg>",
         reply_message_id="mock-message-id",
     )
 
@@ -267,7 +621,7 @@ def test_handle_chat_message_bad_command(mock_resolve_command, mock_retrieve_eve
 def test_handle_chat_message_valid_command(mock_resolve_command, mock_retrieve_event_context, mock_api_interfaces, twitch_service):
     event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
     event.message.text = "!mock-command-prefix arg1 arg2 arg3"
-    mock_command = MagicMock()
+    mock_command = MagicMock(__name__="MockCommand")
     mock_command_obj = mock_command.return_value
     mock_command_obj.execute.return_value = "mock-reply"
     mock_resolve_command.return_value = (mock_command, ["arg2", "arg3"])
@@ -287,127 +641,331 @@ def test_handle_chat_message_valid_command(mock_resolve_command, mock_retrieve_e
     )
 
 
+@pytest.mark.parametrize("command", ["status", "twitch connect"])
+def test_handle_chat_message_no_state_table_calls(mock_api_interfaces, twitch_service, command):
+    event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
+    event.message.text = f"!mock-command-prefix {command}"
+
+    twitch_service.handle_chat_message(event)
+
+    # Neither fetched for nor serialized in a lane.
+    assert mock_api_interfaces.state_table.method_calls == []
+    mock_api_interfaces.twitch.send_chat_message.assert_called_once()
+
+
+@patch("src.twitch.service.TwitchService.retrieve_event_context")
+def test_execute_command_in_lane(mock_retrieve_event_context, mock_api_interfaces, twitch_service):
+    event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
+    mock_command = MagicMock(__name__="MockCommand", READ_MODIFY_WRITE=True)
+    mock_command.return_value.execute.return_value = "mock-reply"
+    mock_retrieve_event_context.return_value = (True, MagicMock(), Permission.MODERATOR)
+
+    actual = twitch_service.execute_command(event, mock_command, ["arg"])
+
+    assert actual == "mock-reply"
+    mock_api_interfaces.state_table.acquire_lease.assert_called_once_with(
+        "mock-broadcaster-id",
+        twitch_service.lanes.owner,
+        KeyedLanes.LEASE_S,
+    )
+    mock_api_interfaces.state_table.release_lease.assert_called_once_with(
+        "mock-broadcaster-id",
+        twitch_service.lanes.owner,
+    )
+
+
+@patch("src.twitch.service.TwitchService.retrieve_event_context")
+def test_execute_command_outside_lane(mock_retrieve_event_context, mock_api_interfaces, twitch_service):
+    event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
+    mock_command = MagicMock(__name__="MockCommand", READ_MODIFY_WRITE=False)
+    mock_command.return_value.execute.return_value = "mock-reply"
+    mock_retrieve_event_context.return_value = (True, MagicMock(), Permission.EVERYBODY)
+
+    actual = twitch_service.execute_command(event, mock_command, [])
+
+    assert actual == "mock-reply"
+    mock_api_interfaces.state_table.acquire_lease.assert_not_called()
+
+
+@patch("src.twitch.service.TwitchService.retrieve_event_context")
+def test_execute_command_telemetry(mock_retrieve_event_context, twitch_service):
+    event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
+    mock_command = MagicMock(__name__="MockCommand")
+    mock_retrieve_event_context.return_value = (True, MagicMock(), Permission.MODERATOR)
+    telemetry.collect()
+
+    with telemetry.dimensions(event_type="notification"):
+        twitch_service.execute_command(event, mock_command, ["arg"])
+
+    spans = {span.stage: span for span in telemetry.collect()}
+    assert spans["execute_command"].dimensions == {"event_type": "notification", "command": "MockCommand"}
+
+
+@patch("src.twitch.service.time.sleep")
+@patch("src.twitch.service.TwitchService.retrieve_event_context")
+def test_execute_command_version_conflict(mock_retrieve_event_context, mock_sleep, mock_api_interfaces, twitch_service):
+    event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
+    mock_command = MagicMock(__name__="MockCommand")
+    mock_command_obj = mock_command.return_value
+    mock_command_obj.execute.side_effect = [VersionConflictError(), VersionConflictError(), "mock-reply"]
+    stale_state = MagicMock()
+    fresh_state = MagicMock()
+    mock_retrieve_event_context.side_effect = [
+        (True, stale_state, Permission.MODERATOR),
+        (True, stale_state, Permission.MODERATOR),
+        (True, fresh_state, Permission.MODERATOR),
+    ]
+    metrics.clear_metrics()
+
+    actual = twitch_service.execute_command(event, mock_command, ["arg"])
+
+    assert actual == "mock-reply"
+    # Re-read + re-run after each conflict.
+    assert mock_retrieve_event_context.call_count == 3
+    assert mock_command.call_args_list[-1] == call(mock_api_interfaces, fresh_state, Permission.MODERATOR)
+    assert mock_sleep.call_count == 2
+    assert metrics.metric_set["StateVersionConflicts"]["Value"] == [1.0, 1.0]
+    assert metrics.metric_set["StateWriteRetries"]["Value"] == [1.0, 1.0]
+    metrics.clear_metrics()
+
+
+@patch("src.twitch.service.time.sleep")
+@patch("src.twitch.service.TwitchService.retrieve_event_context")
+def test_execute_command_version_conflict_exhausted(mock_retrieve_event_context, mock_sleep, mock_api_interfaces, twitch_service):
+    event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
+    mock_command = MagicMock(__name__="MockCommand")
+    mock_command.return_value.execute.side_effect = VersionConflictError()
+    mock_retrieve_event_context.return_value = (True, MagicMock(), Permission.MODERATOR)
+
+    with pytest.raises(VersionConflictError):
+        twitch_service.execute_command(event, mock_command, [])
+
+    assert mock_retrieve_event_context.call_count == TwitchService.MAX_CONFLICT_RETRIES + 1
+    assert mock_sleep.call_count == TwitchService.MAX_CONFLICT_RETRIES
+    metrics.clear_metrics()
+
+
 @pytest.mark.parametrize(
-    "chatter_user_id, permission",
+    "chatter_user_id, permission, looked_up_chatter_user_id",
     [
-        ("mock-broadcaster-id", Permission.BROADCASTER),
-        ("mock-chatter-id", Permission.EVERYBODY),
+        ("mock-broadcaster-id", Permission.BROADCASTER, None),
+        ("mock-chatter-id", Permission.EVERYBODY, "mock-chatter-id"),
     ],
 )
-def test_retrieve_event_context_no_lookup(mock_api_interfaces, twitch_service, chatter_user_id, permission):
+def test_retrieve_event_context_no_lookup(mock_api_interfaces, twitch_service, chatter_user_id, permission, looked_up_chatter_user_id):
     event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
     event.chatter_user_id = chatter_user_id
 
-    mock_api_interfaces.state_table.lookup_by_twitch.return_value = None
+    mock_api_interfaces.state_table.fetch_twitch_context.return_value = EventContext()
     state = State(user="mock-broadcaster-login", twitch_user_id="mock-broadcaster-id")
     expected = (True, state, permission)
 
     actual = twitch_service.retrieve_event_context(event)
 
     assert actual == expected
-    assert mock_api_interfaces.state_table.lookup_by_twitch.call_args_list == [
-        call("mock-broadcaster-id"),
-        call(chatter_user_id),
-    ]
-    mock_api_interfaces.state_table.get_state.assert_not_called()
+    mock_api_interfaces.state_table.fetch_twitch_context.assert_called_once_with(
+        "mock-broadcaster-id",
+        looked_up_chatter_user_id,
+        attributes=None,
+        consistent_read=True,
+        read_state=True,
+    )
 
 
 @pytest.mark.parametrize(
-    "chatter_user_id, permission",
+    "chatter_user_id, permission, looked_up_chatter_user_id",
     [
-        ("mock-broadcaster-id", Permission.BROADCASTER),
-        ("mock-chatter-id", Permission.EVERYBODY),
+        ("mock-broadcaster-id", Permission.BROADCASTER, None),
+        ("mock-chatter-id", Permission.EVERYBODY, "mock-chatter-id"),
     ],
 )
-def test_retrieve_event_context_broadcaster_lookup(mock_api_interfaces, twitch_service, chatter_user_id, permission):
+def test_retrieve_event_context_broadcaster_lookup(mock_api_interfaces, twitch_service, chatter_user_id, permission, looked_up_chatter_user_id):
     event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
     event.chatter_user_id = chatter_user_id
 
-    def mock_lookup_by_twitch(twitch_user_id: str):
-        if twitch_user_id == "mock-broadcaster-id":
-            return LookupFields(user="mock-broadcaster-login")
-
-        return None
-
-    mock_api_interfaces.state_table.lookup_by_twitch.side_effect = mock_lookup_by_twitch
-    state = State(user="mock-broadcaster-login", twitch_user_id="mock-broadcaster-id")
-    mock_api_interfaces.state_table.get_state.return_value = state
+    state = State(user="mock-broadcaster-login", twitch_user_id="mock-broadcaster-id", deaths={"count": 1, "last_timestamp": "2006-01-02T15:04:05Z"})
+    mock_api_interfaces.state_table.fetch_twitch_context.return_value = EventContext(
+        broadcaster=LookupFields(user="mock-broadcaster-login"),
+        state=state,
+    )
     expected = (True, state, permission)
 
     actual = twitch_service.retrieve_event_context(event)
 
     assert actual == expected
-    assert mock_api_interfaces.state_table.lookup_by_twitch.call_args_list == [
-        call("mock-broadcaster-id"),
-        call(chatter_user_id),
-    ]
-    mock_api_interfaces.state_table.get_state.assert_called_once_with("mock-broadcaster-login")
+    mock_api_interfaces.state_table.fetch_twitch_context.assert_called_once_with(
+        "mock-broadcaster-id",
+        looked_up_chatter_user_id,
+        attributes=None,
+        consistent_read=True,
+        read_state=True,
+    )
 
 
 @pytest.mark.parametrize(
-    "chatter_user_id, permission",
+    "chatter_user_id, permission, looked_up_chatter_user_id",
     [
-        ("mock-broadcaster-id", Permission.BROADCASTER),
-        ("mock-chatter-id", Permission.EVERYBODY),
+        ("mock-broadcaster-id", Permission.BROADCASTER, None),
+        ("mock-chatter-id", Permission.EVERYBODY, "mock-chatter-id"),
     ],
 )
-def test_retrieve_event_context_chatter_lookup(mock_api_interfaces, twitch_service, chatter_user_id, permission):
+def test_retrieve_event_context_chatter_lookup(mock_api_interfaces, twitch_service, chatter_user_id, permission, looked_up_chatter_user_id):
     event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
     event.chatter_user_id = chatter_user_id
 
-    def mock_lookup_by_twitch(twitch_user_id: str):
-        if twitch_user_id == "mock-chatter-id":
-            return LookupFields(user="mock-chatter-login")
-
-        return None
-
-    mock_api_interfaces.state_table.lookup_by_twitch.side_effect = mock_lookup_by_twitch
+    mock_api_interfaces.state_table.fetch_twitch_context.return_value = EventContext(
+        chatter=LookupFields(user="mock-chatter-login"),
+    )
     state = State(user="mock-broadcaster-login", twitch_user_id="mock-broadcaster-id")
     expected = (True, state, permission)
 
     actual = twitch_service.retrieve_event_context(event)
 
     assert actual == expected
-    assert mock_api_interfaces.state_table.lookup_by_twitch.call_args_list == [
-        call("mock-broadcaster-id"),
-        call(chatter_user_id),
-    ]
-    mock_api_interfaces.state_table.get_state.assert_not_called()
+    mock_api_interfaces.state_table.fetch_twitch_context.assert_called_once_with(
+        "mock-broadcaster-id",
+        looked_up_chatter_user_id,
+        attributes=None,
+        consistent_read=True,
+        read_state=True,
+    )
 
 
 @pytest.mark.parametrize(
-    "chatter_user_id, permission",
+    "chatter_user_id, permission, looked_up_chatter_user_id",
     [
-        ("mock-broadcaster-id", Permission.BROADCASTER),
-        ("mock-chatter-id", Permission.EVERYBODY),
-        ("mock-chatter-id-2", Permission.MODERATOR),
+        ("mock-broadcaster-id", Permission.BROADCASTER, None),
+        ("mock-chatter-id", Permission.EVERYBODY, "mock-chatter-id"),
+        ("mock-chatter-id-2", Permission.MODERATOR, "mock-chatter-id-2"),
     ],
 )
-def test_retrieve_event_context_both_lookups(mock_api_interfaces, twitch_service, chatter_user_id, permission):
+def test_retrieve_event_context_both_lookups(mock_api_interfaces, twitch_service, chatter_user_id, permission, looked_up_chatter_user_id):
     event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
     event.chatter_user_id = chatter_user_id
 
-    def mock_lookup_by_twitch(twitch_user_id: str):
-        if twitch_user_id == "mock-broadcaster-id":
-            return LookupFields(user="mock-broadcaster-login")
-        elif twitch_user_id == "mock-chatter-id":
-            return LookupFields(user="mock-chatter-login")
-        elif twitch_user_id == "mock-chatter-id-2":
-            return LookupFields(user="mock-chatter-login-2")
-
-    mock_api_interfaces.state_table.lookup_by_twitch.side_effect = mock_lookup_by_twitch
-    state = State(user="mock-broadcaster-login", twitch_user_id="mock-broadcaster-id", members={"mock-chatter-login-2": Permission.MODERATOR})
-    mock_api_interfaces.state_table.get_state.return_value = state
+    chatters = {
+        "mock-broadcaster-id": (LookupFields(user="mock-broadcaster-login"), None),
+        "mock-chatter-id": (LookupFields(user="mock-chatter-login"), None),
+        "mock-chatter-id-2": (LookupFields(user="mock-chatter-login-2"), Permission.MODERATOR),
+    }
+    state = State(user="mock-broadcaster-login", twitch_user_id="mock-broadcaster-id")
+    chatter, granted_permission = chatters[chatter_user_id]
+    mock_api_interfaces.state_table.fetch_twitch_context.return_value = EventContext(
+        broadcaster=LookupFields(user="mock-broadcaster-login"),
+        state=state,
+        chatter=chatter,
+        permission=granted_permission,
+    )
     expected = (True, state, permission)
 
     actual = twitch_service.retrieve_event_context(event)
 
     assert actual == expected
-    assert mock_api_interfaces.state_table.lookup_by_twitch.call_args_list == [
-        call("mock-broadcaster-id"),
-        call(chatter_user_id),
-    ]
-    mock_api_interfaces.state_table.get_state.assert_called_once_with("mock-broadcaster-login")
+    mock_api_interfaces.state_table.fetch_twitch_context.assert_called_once_with(
+        "mock-broadcaster-id",
+        looked_up_chatter_user_id,
+        attributes=None,
+        consistent_read=True,
+        read_state=True,
+    )
+
+
+@pytest.mark.parametrize(
+    "chatter_user_id, badge_set_ids, expected",
+    [
+        ("mock-broadcaster-id", [], Permission.BROADCASTER),
+        ("mock-chatter-id", [], Permission.EVERYBODY),
+        ("mock-chatter-id", ["subscriber", "moderator"], Permission.MODERATOR),
+        ("mock-chatter-id", ["lead_moderator"], Permission.MODERATOR),
+        ("mock-chatter-id", ["broadcaster", "moderator"], Permission.BROADCASTER),
+        ("mock-chatter-id", ["vip"], Permission.EVERYBODY),
+    ],
+)
+def test_resolve_badge_permission(twitch_service, chatter_user_id, badge_set_ids, expected):
+    event = TwitchChannelChatMessage(**{
+        **DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE,
+        "chatter_user_id": chatter_user_id,
+        "badges": [{"set_id": set_id, "id": "1", "info": ""} for set_id in badge_set_ids],
+    })
+
+    actual = twitch_service.resolve_badge_permission(event)
+
+    assert actual == expected
+
+
+@pytest.mark.parametrize(
+    "CommandClass, looks_up_chatter, expected_permission",
+    [
+        # The chatter's role already gives them enough for the command, so they aren't looked up.
+        (DeathsAddCommand, False, Permission.MODERATOR),
+        # It doesn't, so their custom grant is looked up (and outranks their role).
+        (DeathsSetCommand, True, Permission.BROADCASTER),
+    ],
+)
+def test_retrieve_event_context_moderator_badge(mock_api_interfaces, twitch_service, CommandClass, looks_up_chatter, expected_permission):
+    event = TwitchChannelChatMessage(**{
+        **DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE,
+        "chatter_user_id": "mock-chatter-id",
+        "badges": [{"set_id": "moderator", "id": "1", "info": ""}],
+    })
+    state = State(user="mock-broadcaster-login", twitch_user_id="mock-broadcaster-id")
+    mock_api_interfaces.state_table.fetch_twitch_context.return_value = EventContext(
+        broadcaster=LookupFields(user="mock-broadcaster-login"),
+        state=state,
+        chatter=LookupFields(user="mock-chatter-login") if looks_up_chatter else None,
+        permission=Permission.BROADCASTER if looks_up_chatter else None,
+    )
+
+    actual = twitch_service.retrieve_event_context(event, CommandClass)
+
+    assert actual == (True, state, expected_permission)
+    mock_api_interfaces.state_table.fetch_twitch_context.assert_called_once_with(
+        "mock-broadcaster-id",
+        "mock-chatter-id" if looks_up_chatter else None,
+        attributes=None,
+        consistent_read=True,
+        read_state=True,
+    )
+
+
+def test_execute_command_moderator_with_broadcaster_grant():
+    state_table = InMemoryStateTableInterface()
+    state_table.update_state(State(user="mock-broadcaster-login", twitch_user_id="mock-broadcaster-id"))
+    state_table.update_state(State(user="mock-chatter-login", twitch_user_id="mock-chatter-id"))
+    state_table.grant_permissions("mock-broadcaster-login", {"mock-chatter-login": Permission.BROADCASTER})
+    twitch_service = TwitchService(APIInterfaces(state_table, MagicMock()), "mock-user-id", "mock-command-prefix", None)
+    event = TwitchChannelChatMessage(**{
+        **DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE,
+        "chatter_user_id": "mock-chatter-id",
+        "badges": [{"set_id": "moderator", "id": "1", "info": ""}],
+    })
+
+    actual = twitch_service.execute_command(event, DeathsSetCommand, [5])
+
+    assert actual.startswith("Death count: 5")
+    assert state_table.get_state("mock-broadcaster-login").deaths.count == 5
+
+
+def test_retrieve_event_context_badge_with_grant(mock_api_interfaces, twitch_service):
+    event = TwitchChannelChatMessage(**{
+        **DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE,
+        "chatter_user_id": "mock-chatter-id",
+        "badges": [{"set_id": "moderator", "id": "1", "info": ""}],
+    })
+    twitch_service.assignee_ids = ["mock-github-user-id"]
+    state = State(user="mock-broadcaster-login", twitch_user_id="mock-broadcaster-id")
+    mock_api_interfaces.state_table.fetch_twitch_context.return_value = EventContext(
+        broadcaster=LookupFields(user="mock-broadcaster-login"),
+        state=state,
+        chatter=LookupFields(user="mock-chatter-login", github_user_id="mock-github-user-id"),
+        permission=Permission.BROADCASTER,
+    )
+
+    actual = twitch_service.retrieve_event_context(event)
+
+    # Looked up for the assignee check anyway, so the higher of the role and the grant is used.
+    assert actual == (True, state, Permission.BROADCASTER)
+    assert mock_api_interfaces.state_table.fetch_twitch_context.call_args.args == ("mock-broadcaster-id", "mock-chatter-id")
 
 
 @pytest.mark.parametrize(
@@ -422,24 +980,79 @@ def test_retrieve_event_context_can_invoke(mock_api_interfaces, twitch_service,
     event.chatter_user_id = "mock-chatter-id"
     twitch_service.assignee_ids = ["mock-github-user-id"]
 
-    def mock_lookup_by_twitch(twitch_user_id: str):
-        if twitch_user_id == "mock-chatter-id":
-            return LookupFields(user="mock-chatter-login", github_user_id=github_user_id)
-
-        return None
-
-    mock_api_interfaces.state_table.lookup_by_twitch.side_effect = mock_lookup_by_twitch
+    mock_api_interfaces.state_table.fetch_twitch_context.return_value = EventContext(
+        chatter=LookupFields(user="mock-chatter-login", github_user_id=github_user_id),
+    )
     state = State(user="mock-broadcaster-login", twitch_user_id="mock-broadcaster-id")
     expected = (can_invoke, state, Permission.EVERYBODY)
 
     actual = twitch_service.retrieve_event_context(event)
 
     assert actual == expected
-    assert mock_api_interfaces.state_table.lookup_by_twitch.call_args_list == [
-        call("mock-broadcaster-id"),
-        call("mock-chatter-id"),
-    ]
-    mock_api_interfaces.state_table.get_state.assert_not_called()
+    mock_api_interfaces.state_table.fetch_twitch_context.assert_called_once_with(
+        "mock-broadcaster-id",
+        "mock-chatter-id",
+        attributes=None,
+        consistent_read=True,
+        read_state=True,
+    )
+
+
+@pytest.mark.parametrize(
+    "CommandClass, attributes, consistent_read, looks_up_chatter",
+    [
+        (DeathsInfoCommand, ["deaths"], False, False),
+        (DeathsSetCommand, None, True, True),
+    ],
+)
+def test_retrieve_event_context_projection(mock_api_interfaces, twitch_service, CommandClass, attributes, consistent_read, looks_up_chatter):
+    event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
+    mock_api_interfaces.state_table.fetch_twitch_context.return_value = EventContext()
+
+    twitch_service.retrieve_event_context(event, CommandClass)
+
+    # Read-only commands only read what they need, eventually consistently (and don't need the chatter's grants).
+    mock_api_interfaces.state_table.fetch_twitch_context.assert_called_once_with(
+        "mock-broadcaster-id",
+        event.chatter_user_id if looks_up_chatter else None,
+        attributes=attributes,
+        consistent_read=consistent_read,
+        read_state=True,
+    )
+
+
+@pytest.mark.parametrize("CommandClass", [StatusCommand, TwitchConnectCommand])
+def test_retrieve_event_context_nothing_required(mock_api_interfaces, twitch_service, CommandClass):
+    event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
+    event.chatter_user_id = "mock-chatter-id"
+
+    actual = twitch_service.retrieve_event_context(event, CommandClass)
+
+    # Nothing fetched at all, the chatter's role is enough.
+    assert actual == (True, None, Permission.EVERYBODY)
+    mock_api_interfaces.state_table.fetch_twitch_context.assert_not_called()
+
+
+def test_retrieve_event_context_assignee_check_only(mock_api_interfaces, twitch_service):
+    event = TwitchChannelChatMessage(**DEFAULT_MOCK_CHANNEL_CHAT_MESSAGE)
+    event.chatter_user_id = "mock-chatter-id"
+    twitch_service.assignee_ids = ["mock-github-user-id"]
+    mock_api_interfaces.state_table.fetch_twitch_context.return_value = EventContext(
+        broadcaster=LookupFields(user="mock-broadcaster-login"),
+        chatter=LookupFields(user="mock-chatter-login", github_user_id="mock-github-user-id"),
+    )
+
+    actual = twitch_service.retrieve_event_context(event, StatusCommand)
+
+    # The chatter is still looked up to check they're an assignee, but the state isn't read.
+    assert actual == (True, None, Permission.EVERYBODY)
+    mock_api_interfaces.state_table.fetch_twitch_context.assert_called_once_with(
+        "mock-broadcaster-id",
+        "mock-chatter-id",
+        attributes=[],
+        consistent_read=False,
+        read_state=False,
+    )
 
 
 def test_handle_revocation(twitch_service):
@@ -0,0 +1,551 @@
+"""
+Replay recorded (or synthetic) EventSub webhook events against the /bryti route, at a target rate and concurrency,
+with DynamoDB and Twitch Helix replaced by local stand-ins (see `tools.stand_ins`) with configurable latency.
+
+Reports throughput, latency percentiles, response statuses, downstream call counts and per-stage timings.
+
+Concurrency is driven with worker processes, each with its own `main` handling one event at a time (like a Lambda instance):
+powertools keeps the event being resolved on the resolver's class, so concurrent events in one process would swap requests.
+The workers share the state table through an SQLite file (so claims, leases and conditional writes race like they would
+in DynamoDB), and report the downstream calls and spans each event took back to the load generator.
+
+Run from the repo root, i.e.:
+    python -m tools.load_generator --events 2000 --rate 200 --concurrency 16 --state-latency-ms 8
+    python -m tools.load_generator --replay recorded.jsonl --target handler
+
+Recorded events are JSON lines of {"headers": {...}, "body": "..."} (headers are re-signed, so any signature is fine).
+Per-stage timings are only reported for the "resolve" target, since the full handler flushes them as EMF instead.
+"""
+
+import argparse
+from collections import Counter
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+import uuid
+import warnings
+
+from tools.stand_ins import (
+    LatencyProxy,
+    LocalTwitchInterface,
+)
+
+
+BOT_USER_ID = "loadtest-bot-id"
+COMMAND_PREFIX = "bryti-loadtest"
+COMMANDS = ["deaths", "deaths add", "crimes", "crimes add", "status"]
+
+MOCK_CONTEXT = SimpleNamespace(
+    function_name="bryti-loadtest",
+    memory_limit_in_mb=128,
+    invoked_function_arn="arn:aws:lambda:us-east-1:000000000000:function:bryti-loadtest",
+    aws_request_id="loadtest-request-id",
+)
+
+# A Twitch webhook event: its headers, and its raw body.
+Event = Tuple[Dict[str, str], str]
+
+
+def sign_event(headers: Dict[str, str], body: str) -> Dict[str, str]:
+    """
+    Sign an event the way `TwitchService.verify_signature` expects it to be.
+    """
+
+    secret = (
+        f"bryti.{headers['twitch-eventsub-subscription-type']}"
+        f".{headers['twitch-eventsub-subscription-version']}"
+    ).encode("UTF-8")
+    message = (
+        f"{headers['twitch-eventsub-message-id']}"
+        f"{headers['twitch-eventsub-message-timestamp']}"
+        f"{body}"
+    ).encode("UTF-8")
+    digest = hmac.new(secret, message, hashlib.sha256).hexdigest()
+    return {**headers, "twitch-eventsub-message-signature": f"sha256={digest}"}
+
+
+def broadcaster_id(i: int) -> str:
+    return f"loadtest-broadcaster-{i}"
+
+
+def synthetic_chat_event(
+    rng: random.Random,
+    broadcasters: int,
+    command_ratio: float,
+) -> Event:
+    """
+    Build a signed `channel.chat.message` notification: a command (sent by the broadcaster) with the given probability,
+    otherwise a regular chat message (from a random chatter), in a random broadcaster's channel.
+    """
+
+    i = rng.randrange(broadcasters)
+    is_command = rng.random() < command_ratio
+    chatter_id = (
+        broadcaster_id(i) if is_command else f"loadtest-chatter-{rng.randrange(10000)}"
+    )
+    text = (
+        f"!{COMMAND_PREFIX} {rng.choice(COMMANDS)}"
+        if is_command
+        else " ".join(
+            rng.choice(["gg", "lol", "pog", "nice", "KEKW", "no way"])
+            for _ in range(rng.randint(1, 8))
+        )
+    )
+    message_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    body = json.dumps(
+        {
+            "subscription": {
+                "id": "loadtest-subscription-id",
+                "type": "channel.chat.message",
+                "version": "1",
+                "status": "enabled",
+                "cost": 0,
+                "condition": {
+                    "broadcaster_user_id": broadcaster_id(i),
+                    "user_id": BOT_USER_ID,
+                },
+                "transport": {
+                    "method": "webhook",
+                    "callback": "https://example.com/bryti",
+                },
+                "created_at": "2024-01-01T00:00:00.000000000Z",
+            },
+            "event": {
+                "broadcaster_user_id": broadcaster_id(i),
+                "broadcaster_user_name": f"Broadcaster{i}",
+                "broadcaster_user_login": f"broadcaster{i}",
+                "chatter_user_id": chatter_id,
+                "chatter_user_name": chatter_id,
+                "chatter_user_login": chatter_id,
+                "message_id": message_id,
+                "message": {
+                    "text": text,
+                    "fragments": [
+                        {
+                            "type": "text",
+                            "text": text,
+                            "cheermote": None,
+                            "emote": None,
+                            "mention": None,
+                        }
+                    ],
+                },
+                "color": "#00FF00",
+                "badges": [{"set_id": "subscriber", "id": "12", "info": "16"}],
+                "message_type": "text",
+                "cheer": None,
+                "reply": None,
+                "channel_points_custom_reward_id": None,
+            },
+        }
+    )
+    headers = {
+        "twitch-eventsub-message-id": message_id,
+        "twitch-eventsub-message-type": "notification",
+        "twitch-eventsub-subscription-type": "channel.chat.message",
+        "twitch-eventsub-subscription-version": "1",
+        "twitch-eventsub-message-timestamp": "2024-01-01T00:00:00.000000000Z",
+        "twitch-eventsub-message-retry": "0",
+    }
+    return sign_event(headers, body), body
+
+
+def load_recorded_events(path: str) -> List[Event]:
+    """
+    Read recorded events from a JSON lines file, (re-)signing each of them.
+    """
+
+    events = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                headers = {k.lower(): str(v) for k, v in record["headers"].items()}
+                events.append((sign_event(headers, record["body"]), record["body"]))
+
+    return events
+
+
+def as_http_api_event(headers: Dict[str, str], body: str) -> Dict[str, Any]:
+    """
+    Wrap a webhook event the way API Gateway (HTTP API, payload format 2.0) hands it to the Lambda.
+    """
+
+    return {
+        "version": "2.0",
+        "routeKey": "ANY /bryti",
+        "rawPath": "/bryti",
+        "rawQueryString": "",
+        "headers": {**headers, "content-type": "application/json"},
+        "requestContext": {
+            "http": {"method": "POST", "path": "/bryti"},
+            "stage": "$default",
+        },
+        "body": body,
+        "isBase64Encoded": False,
+    }
+
+
+def configure_environment():
+    """
+    Configure `src` for running against the local stand-ins (before any of it is imported).
+    """
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("POWERTOOLS_LOG_LEVEL", "WARNING")
+    os.environ.setdefault("POWERTOOLS_METRICS_DISABLED", "true")
+    os.environ.setdefault(
+        "ENV_VARS",
+        json.dumps(
+            {
+                "ENV": "loadtest",
+                "TWITCH_CLIENT_ID": "loadtest-client-id",
+                "TWITCH_CLIENT_SECRET": "loadtest-client-secret",
+                "TWITCH_USER_ID": BOT_USER_ID,
+                "GITHUB_ASSIGNEE_IDS": None,
+            }
+        ),
+    )
+
+    # Metrics are disabled, so powertools warns about there being none on every invocation.
+    warnings.filterwarnings("ignore", message="No application metrics to publish")
+
+
+def seed_state_table(state_path: str, broadcasters: int):
+    """
+    Create the broadcasters' states that synthetic events are sent for.
+    """
+
+    from src.common.state_models import State
+    from src.common.state_table_backends import SQLiteStateTableInterface
+
+    state_table = SQLiteStateTableInterface(state_path)
+    for i in range(broadcasters):
+        state_table.update_state(
+            State(user=f"broadcaster{i}", twitch_user_id=broadcaster_id(i))
+        )
+
+
+def build_target(
+    target: str,
+    state_path: str,
+    state_latency_ms: float,
+    twitch_latency_ms: float,
+) -> Tuple[Callable[[Event], int], Dict[str, LatencyProxy]]:
+    """
+    Import `main` against the local stand-ins, and build a function sending an event to the given target
+    ("resolve": `app.resolve`, "handler": the full `lambda_handler`) and returning the response's status code.
+    Only one event can be sent at a time (see the module's docstring).
+    """
+
+    from src import main
+    from src.common.api_interfaces import APIInterfaces
+    from src.common.state_table_backends import SQLiteStateTableInterface
+    from src.common.state_table_interface import StateTableInterface
+    from src.twitch.service import TwitchService
+
+    # Only the storage primitives (i.e. every method a backend has to implement) are actual round trips.
+    state_table = LatencyProxy(
+        SQLiteStateTableInterface(state_path),
+        StateTableInterface.__abstractmethods__,
+        state_latency_ms,
+    )
+    twitch = LatencyProxy(
+        LocalTwitchInterface(), ["send_chat_message"], twitch_latency_ms
+    )
+    main.state_table_interface = state_table.target
+    main.twitch_interface = twitch.target
+    main.twitch_service = TwitchService(
+        APIInterfaces(state_table.target, twitch.target),
+        BOT_USER_ID,
+        COMMAND_PREFIX,
+        None,
+    )
+
+    def send(event: Event) -> int:
+        api_event = as_http_api_event(*event)
+        if target == "handler":
+            response = main.lambda_handler(api_event, MOCK_CONTEXT)
+        else:
+            response = main.app.resolve(api_event, MOCK_CONTEXT)
+
+        return response["statusCode"]
+
+    return send, {"state_table": state_table, "twitch": twitch}
+
+
+# The target built in this worker process (see `init_worker`).
+_worker = SimpleNamespace(send=None, downstreams={}, ready=None)
+
+
+def init_worker(
+    target: str,
+    state_path: str,
+    state_latency_ms: float,
+    twitch_latency_ms: float,
+    ready: Any,
+):
+    # The handler prints its logs/EMF to stdout, which would drown out the report.
+    sys.stdout = open(os.devnull, "w")
+    configure_environment()
+    _worker.send, _worker.downstreams = build_target(
+        target,
+        state_path,
+        state_latency_ms,
+        twitch_latency_ms,
+    )
+    _worker.ready = ready
+
+    from src.common.telemetry import telemetry
+
+    # Drop the spans inherited from seeding the state table (if the worker was forked).
+    telemetry.collect()
+
+
+def wait_for_workers():
+    """
+    Block until every worker has started (so that starting them isn't counted against the first events' latency).
+    """
+
+    _worker.ready.wait()
+
+
+def send_in_worker(
+    event: Event,
+) -> Tuple[int | str, Dict[str, Dict[str, int]], List[Any]]:
+    """
+    Send the event to this worker's target.
+
+    :return: The response's status code (or the name of the exception raised), and the downstream calls and spans it took.
+    """
+
+    from src.common.telemetry import telemetry
+
+    try:
+        status = _worker.send(event)
+    except Exception as e:
+        status = type(e).__name__
+
+    calls = {}
+    for name, proxy in _worker.downstreams.items():
+        calls[name] = dict(proxy.calls)
+        proxy.calls.clear()
+
+    return status, calls, telemetry.collect()
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+
+    i = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[i]
+
+
+def summarize(values_ms: List[float]) -> Dict[str, float]:
+    values_ms = sorted(values_ms)
+    return {
+        "p50": round(percentile(values_ms, 50), 3),
+        "p95": round(percentile(values_ms, 95), 3),
+        "p99": round(percentile(values_ms, 99), 3),
+        "max": round(values_ms[-1], 3) if values_ms else 0.0,
+        "mean": round(statistics.fmean(values_ms), 3) if values_ms else 0.0,
+    }
+
+
+def run_load(
+    send: Callable[[Event], int],
+    events: List[Event],
+    rate: Optional[float],
+    concurrency: int,
+) -> Dict[str, Any]:
+    """
+    Send the events, open-loop: each is scheduled at its slot for the target rate (or right away, with no rate),
+    so that a slow target builds up a backlog instead of slowing down the load.
+
+    :return: Throughput, latency (from send to response) and delay (from scheduled slot to send) percentiles, and response statuses.
+    """
+
+    latencies_ms = []
+    delays_ms = []
+    statuses = Counter()
+
+    def send_at(scheduled_at: float, event: Event):
+        now = time.perf_counter()
+        if scheduled_at > now:
+            time.sleep(scheduled_at - now)
+
+        sent_at = time.perf_counter()
+        try:
+            status = send(event)
+        except Exception as e:
+            status = type(e).__name__
+
+        done_at = time.perf_counter()
+        latencies_ms.append((done_at - sent_at) * 1000)
+        delays_ms.append(max(0.0, sent_at - scheduled_at) * 1000)
+        statuses[str(status)] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i, event in enumerate(events):
+            scheduled_at = start + (i / rate if rate else 0)
+            executor.submit(send_at, scheduled_at, event)
+
+    elapsed_s = time.perf_counter() - start
+    return {
+        "events": len(events),
+        "elapsed_s": round(elapsed_s, 3),
+        "throughput_per_s": round(len(events) / elapsed_s, 1) if elapsed_s > 0 else 0.0,
+        "latency_ms": summarize(latencies_ms),
+        "schedule_delay_ms": summarize(delays_ms),
+        "statuses": dict(statuses),
+    }
+
+
+def summarize_spans(spans: List[Any]) -> Dict[str, Dict[str, float]]:
+    """
+    Per-stage timings, from the spans recorded by `src.common.telemetry`.
+    """
+
+    by_stage = {}
+    for span in spans:
+        by_stage.setdefault(span.stage, []).append(span.duration_ms)
+
+    return {
+        stage: {"count": len(v), **summarize(v)}
+        for stage, v in sorted(by_stage.items())
+    }
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--replay",
+        help="JSON lines file of recorded events (default: synthetic events).",
+    )
+    parser.add_argument(
+        "--events", type=int, default=1000, help="How many synthetic events to send."
+    )
+    parser.add_argument(
+        "--broadcasters",
+        type=int,
+        default=20,
+        help="How many channels synthetic events are spread across.",
+    )
+    parser.add_argument(
+        "--command-ratio",
+        type=float,
+        default=0.1,
+        help="Fraction of synthetic chat messages that are commands.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Target events per second (default: as fast as possible).",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="How many events can be in flight at once.",
+    )
+    parser.add_argument("--target", choices=["resolve", "handler"], default="resolve")
+    parser.add_argument(
+        "--state-latency-ms",
+        type=float,
+        default=5.0,
+        help="Latency of each state table call.",
+    )
+    parser.add_argument(
+        "--twitch-latency-ms",
+        type=float,
+        default=50.0,
+        help="Latency of each Twitch Helix call.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> Dict[str, Any]:
+    args = parse_args(argv)
+    if args.replay:
+        events = load_recorded_events(args.replay)
+    else:
+        rng = random.Random(args.seed)
+        events = [
+            synthetic_chat_event(rng, args.broadcasters, args.command_ratio)
+            for _ in range(args.events)
+        ]
+
+    configure_environment()
+    calls = {}
+    spans = []
+    lock = threading.Lock()
+    with tempfile.TemporaryDirectory() as state_dir:
+        state_path = os.path.join(state_dir, "state.db")
+        seed_state_table(state_path, args.broadcasters)
+
+        mp_context = multiprocessing.get_context()
+        ready = mp_context.Barrier(args.concurrency)
+        with ProcessPoolExecutor(
+            max_workers=args.concurrency,
+            mp_context=mp_context,
+            initializer=init_worker,
+            initargs=(
+                args.target,
+                state_path,
+                args.state_latency_ms,
+                args.twitch_latency_ms,
+                ready,
+            ),
+        ) as workers:
+            for future in [
+                workers.submit(wait_for_workers) for _ in range(args.concurrency)
+            ]:
+                future.result()
+
+            def send(event: Event) -> int | str:
+                status, event_calls, event_spans = workers.submit(
+                    send_in_worker, event
+                ).result()
+                with lock:
+                    for name, counts in event_calls.items():
+                        calls.setdefault(name, Counter()).update(counts)
+                    spans.extend(event_spans)
+
+                return status
+
+            report = run_load(send, events, args.rate, args.concurrency)
+
+    report["downstream_calls"] = {name: dict(counts) for name, counts in calls.items()}
+    report["stages_ms"] = summarize_spans(spans)
+    return report
+
+
+if __name__ == "__main__":
+    print(json.dumps(main(sys.argv[1:]), indent=4))
@@ -0,0 +1,33 @@
+"""
+One-off migration of the legacy `members` map on each user's item into `member#<user>#<member>` items of their own,
+which is where permissions are read from since they were split out of the state.
+Until it has run, members granted before the split have no permission.
+
+Run from the repo root, right after deploying, with the same environment variables as the deployed stage, i.e.:
+    python -m tools.migrate_members
+
+Safe to re-run (i.e. if it failed partway): users that are already migrated no longer have a `members` map.
+"""
+
+import json
+import sys
+from typing import (
+    Dict,
+    List,
+)
+
+from src.common.state_table_backends import build_state_table_interface
+from src.config import load_env_vars
+
+
+def main(argv: List[str]) -> Dict[str, int]:
+    env_vars = load_env_vars()
+    state_table_interface = build_state_table_interface(
+        env_vars["STATE_TABLE"],
+        f"bryti-{env_vars['ENV']}-state",
+    )
+    return state_table_interface.migrate_all_members()
+
+
+if __name__ == "__main__":
+    print(json.dumps(main(sys.argv[1:]), indent=4))
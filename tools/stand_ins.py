@@ -0,0 +1,83 @@
+"""
+Local stand-ins for the downstream services, for exercising the whole request path offline (i.e. under `tools.load_generator`).
+The state table is stood in for by a local backend (with its storage primitives wrapped in a `LatencyProxy`).
+"""
+
+from collections import Counter
+import random
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+)
+
+
+class LatencyProxy:
+    """
+    Adds latency to (and counts) every call of the given methods of a stand-in.
+    The methods are wrapped on the stand-in itself, so that its calls to its own methods go through the proxy too,
+    i.e. the shared `StateTableInterface` logic (lookup caching, concurrent fetches) runs unproxied,
+    and only its storage primitives (the actual round trips) are delayed and counted.
+    Latency is uniformly jittered around the base, i.e. 10ms with 0.5 jitter is anywhere from 5ms to 15ms.
+    """
+
+    def __init__(
+        self,
+        target: Any,
+        methods: Iterable[str],
+        latency_ms: float = 0,
+        jitter: float = 0.5,
+    ):
+        self.target = target
+        self._latency_ms = latency_ms
+        self._jitter = jitter
+        self._lock = threading.Lock()
+        self.calls = Counter()
+
+        for name in methods:
+            setattr(target, name, self._with_latency(name, getattr(target, name)))
+
+    def _with_latency(
+        self, name: str, method: Callable[..., Any]
+    ) -> Callable[..., Any]:
+        def call_with_latency(*args, **kwargs):
+            with self._lock:
+                self.calls[name] += 1
+
+            if self._latency_ms > 0:
+                spread = self._latency_ms * self._jitter
+                time.sleep(
+                    random.uniform(self._latency_ms - spread, self._latency_ms + spread)
+                    / 1000
+                )
+
+            return method(*args, **kwargs)
+
+        return call_with_latency
+
+
+class LocalTwitchInterface:
+    """
+    Stand-in for `TwitchInterface`, recording sent chat messages instead of calling Helix.
+    """
+
+    def __init__(self):
+        self.chat_messages = []
+        self._lock = threading.Lock()
+
+    def send_chat_message(
+        self,
+        broadcaster_id: str,
+        sender_id: str,
+        message: str,
+        reply_message_id: Optional[str] = None,
+    ):
+        with self._lock:
+            self.chat_messages.append((broadcaster_id, message))
+
+    def get_connection_stats(self) -> Dict[str, Dict[str, int]]:
+        return {}